@@ -1,90 +1,142 @@
-from ..models.tables import App
-from sqlmodel import Session, select
+from ..models.tables import App, AuthService
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from uuid import UUID
 
+from typing import Optional
+
 from app.lib.otp import generate_secret
+from app.lib.model_cache import TieredCache
+from app.lib.redis_service import redis_service
+from app.lib.api_keys import format_api_key, generate_prefix, hash_api_key, parse_prefix, verify_api_key
 from ..utils.errors import require, NotFound, Conflict, Unauthorized
 
+# Keys are "id:<uuid>", "name:<name>" and "prefix:<api key prefix>"
+app_cache = TieredCache("app", App)
+
+
+def _set_new_api_key(record: App) -> str:
+    """Give `record` a new API key and return it; only its prefix and hash are stored."""
+    prefix = generate_prefix()
+    api_key = format_api_key(prefix, generate_secret())
+    record.api_key_prefix = prefix
+    record.api_key_secret = hash_api_key(api_key)
+    return api_key
+
+
+async def _enrolled_user_ids(app_id: UUID, session: AsyncSession) -> list[UUID]:
+    statement = select(AuthService.user_id).where(AuthService.app_id == app_id)
+    return list((await session.exec(statement)).all())
 
-def create_app(user_id: UUID, name: str, session: Session):
+
+async def create_app(user_id: UUID, name: str, session: AsyncSession) -> tuple[App, str]:
     statement = select(App).where(App.owner_id == user_id, App.name == name)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
     # Ensure there is no existing app with same owner and name
     require(not record, Conflict("Record already exists"))
 
-    record = App(
-        name=name,
-        owner_id=user_id,
-        api_key_secret=f"OTP-{name.lower().replace(' ', '_')}-{generate_secret()}"
-    )
+    record = App(name=name, owner_id=user_id)
+    api_key = _set_new_api_key(record)
     session.add(record)
-    session.commit()
-    session.refresh(record)
-    return record
+    await session.commit()
+    await session.refresh(record)
+    # Names are not unique, so a cached lookup by this name may now be ambiguous
+    await app_cache.invalidate(f"name:{name}")
+    return record, api_key
 
 
-def get_app_by_id(app_id: UUID, session: Session):
-    statement = select(App).where(App.id == app_id)
-    record = session.exec(statement).first()
-    return record
+async def get_app_by_id(app_id: UUID, session: AsyncSession):
+    async def load():
+        statement = select(App).where(App.id == app_id)
+        return (await session.exec(statement)).first()
 
+    return await app_cache.get(f"id:{app_id}", load)
+
+
+async def get_app_by_name(name: str, session: AsyncSession):
+    async def load():
+        statement = select(App).where(App.name == name)
+        return (await session.exec(statement)).first()
+
+    return await app_cache.get(f"name:{name}", load)
 
-def get_app_by_name(name: str, session: Session):
-    statement = select(App).where(App.name == name)
-    record = session.exec(statement).first()
-    return record
 
+async def get_app_by_api_key(api_key: str, session: AsyncSession) -> Optional[App]:
+    """The app an API key belongs to, or None. Cached by prefix, so usually no DB or Redis work."""
+    prefix = parse_prefix(api_key)
+    if prefix is None:
+        return None
 
-def update_app_name(user_id: UUID, app_id: UUID, name: str, session: Session):
+    async def load():
+        statement = select(App).where(App.api_key_prefix == prefix)
+        return (await session.exec(statement)).first()
+
+    app = await app_cache.get(f"prefix:{prefix}", load)
+    if app is None or not verify_api_key(api_key, app.api_key_secret):
+        return None
+    return app
+
+
+async def update_app_name(user_id: UUID, app_id: UUID, name: str, session: AsyncSession):
     statement = select(App).where(App.id == app_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
 
     require(record, NotFound("Record not found"))
     require(record.owner_id == user_id, Unauthorized("Unauthorized"))
 
+    old_name = record.name
     record.name = name
     session.add(record)
-    session.commit()
-    session.refresh(record)
+    await session.commit()
+    await session.refresh(record)
+    await app_cache.invalidate(f"id:{app_id}", f"name:{old_name}", f"name:{name}", f"prefix:{record.api_key_prefix}")
+    # Cached enrollments carry the app name used in outgoing codes
+    await redis_service.invalidate_app_enrollments(app_id, await _enrolled_user_ids(app_id, session))
     return record
 
 
-def delete_app(user_id: UUID, app_id: UUID, session: Session):
+async def delete_app(user_id: UUID, app_id: UUID, session: AsyncSession):
     statement = select(App).where(App.id == app_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
 
     require(record, NotFound("Record not found"))
     require(record.owner_id == user_id, Unauthorized("Unauthorized"))
 
-    session.delete(record)
-    session.commit()
+    # Looked up before the delete, while the enrollments still reference the app
+    user_ids = await _enrolled_user_ids(app_id, session)
+    await session.delete(record)
+    await session.commit()
+    await app_cache.invalidate(f"id:{app_id}", f"name:{record.name}", f"prefix:{record.api_key_prefix}")
+    await redis_service.invalidate_app_enrollments(app_id, user_ids)
     return record
 
 
-def reset_api_key_secret(app_id: UUID, user_id: UUID, session: Session):
+async def reset_api_key_secret(app_id: UUID, user_id: UUID, session: AsyncSession) -> tuple[App, str]:
     statement = select(App).where(App.id == app_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
 
     require(record, NotFound("Record not found"))
     require(record.owner_id == user_id, Unauthorized("Unauthorized"))
 
-    # Use record.name (not an undefined `name`) when creating the secret
-    record.api_key_secret = f"OTP-{record.name.lower().replace(' ', '_')}-{generate_secret()}"
+    old_prefix = record.api_key_prefix
+    api_key = _set_new_api_key(record)
     session.add(record)
-    session.commit()
-    session.refresh(record)
-    return record
+    await session.commit()
+    await session.refresh(record)
+    # Broadcast, so the old key stops working in every worker right away
+    await app_cache.invalidate(f"id:{app_id}", f"name:{record.name}", f"prefix:{old_prefix}")
+    return record, api_key
 
 
-def get_api_key_secret(app_id: UUID, user_id: UUID, session: Session):
+async def get_api_key_secret(app_id: UUID, user_id: UUID, session: AsyncSession):
     statement = select(App).where(App.id == app_id, App.owner_id == user_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
     require(record, NotFound("Record not found"))
 
     return record
 
 
-def get_user_apps(user_id: UUID, app_id: UUID, session: Session):
+async def get_user_apps(user_id: UUID, app_id: UUID, session: AsyncSession):
     statement = select(App).where(App.owner_id == user_id, App.id == app_id)
-    records = session.exec(statement).all()
+    records = (await session.exec(statement)).all()
     return records
\ No newline at end of file
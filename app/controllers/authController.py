@@ -1,10 +1,11 @@
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime, timedelta, timezone
 from uuid import UUID
 
 from app.models.tables import Auth, User
 
-def create_auth_record(user: User, password_hash: str, session: Session):
+async def create_auth_record(user: User, password_hash: str, session: AsyncSession):
     auth_record = Auth(
         user_id=user.id,
         password_hash=password_hash,
@@ -12,14 +13,21 @@ def create_auth_record(user: User, password_hash: str, session: Session):
         expires_at=datetime.now(timezone.utc) + timedelta(days=30))
 
     session.add(auth_record)
-    session.commit()
-    session.refresh(auth_record)
+    await session.commit()
+    await session.refresh(auth_record)
     if auth_record:
         return True
 
     return False
 
-def get_auth_record(user_id: UUID, session: Session):
+async def get_auth_record(user_id: UUID, session: AsyncSession):
     statement = select(Auth).where(Auth.user_id == user_id)
-    auth_record = session.exec(statement).first()
+    auth_record = (await session.exec(statement)).first()
+    return auth_record
+
+async def update_password_hash(auth_record: Auth, password_hash: str, session: AsyncSession):
+    auth_record.password_hash = password_hash
+    session.add(auth_record)
+    await session.commit()
+    await session.refresh(auth_record)
     return auth_record
@@ -1,30 +1,37 @@
+from typing import Optional
 from uuid import UUID
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.models.tables import AuthService, User, App
 from app.lib.otp import generate_secret
-from app.schemas.schemas import OTPRegister, RecoveryOTPData
+from app.lib.redis_service import redis_service
+from app.schemas.schemas import OTPRegister, RecoveryOTPData, Enrollment
+from app.schemas.enums import RecoveryMethod
 from app.utils.errors import require, NotFound, Conflict
 
 
-def register_otp(data: OTPRegister, session: Session):
+async def register_otp(data: OTPRegister, session: AsyncSession):
     record = AuthService(
         user_id=data.user_id,
         app_id=data.app_id,
         recovery_method=data.recovery_method,
         otp_method=data.otp_method,
         otp_secret=generate_secret(),
-        enabled= False
+        enabled= False,
+        failover=data.failover
     )
     session.add(record)
-    session.commit()
-    session.refresh(record)
+    await session.commit()
+    await session.refresh(record)
+    # Drops a cached "not found" for this user and app
+    await redis_service.invalidate_enrollment(record.user_id, record.app_id)
 
     return record
 
-def disable_otp(user_id: UUID,app_id: UUID, session: Session):
-    statement = select(AuthService).where(AuthService.user_id == user_id)
-    record = session.exec(statement).first()
+async def disable_otp(user_id: UUID,app_id: UUID, session: AsyncSession):
+    statement = select(AuthService).where(AuthService.user_id == user_id, AuthService.app_id == app_id)
+    record = (await session.exec(statement)).first()
 
     require(record, NotFound("Record not found"))
     require(record.enabled, Conflict("Record already disabled"))
@@ -32,14 +39,15 @@ def disable_otp(user_id: UUID,app_id: UUID, session: Session):
 
     record.enabled = False
     session.add(record)
-    session.commit()
-    session.refresh(record)
+    await session.commit()
+    await session.refresh(record)
+    await redis_service.invalidate_enrollment(record.user_id, record.app_id)
     succeed = record.enabled == False
     return succeed
 
-def enable_otp(user_id: UUID, app_id: UUID, session: Session):
+async def enable_otp(user_id: UUID, app_id: UUID, session: AsyncSession):
     statement = select(AuthService).where(AuthService.user_id == user_id, AuthService.app_id == app_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
 
     require(record, NotFound("Record not found"))
     # Only allow enabling if currently disabled
@@ -47,23 +55,24 @@ def enable_otp(user_id: UUID, app_id: UUID, session: Session):
 
     record.enabled = True
     session.add(record)
-    session.commit()
-    session.refresh(record)
+    await session.commit()
+    await session.refresh(record)
+    await redis_service.invalidate_enrollment(record.user_id, record.app_id)
     succeed = record.enabled == True
     return succeed
 
 
-def status_otp(user_id: UUID, app_id: UUID, session: Session):
+async def status_otp(user_id: UUID, app_id: UUID, session: AsyncSession):
     statement = select(AuthService).where(AuthService.user_id == user_id, AuthService.app_id == app_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
 
     if record and record.enabled:
         return True
     return False
 
-def recovery_otp(user_id: UUID, body: RecoveryOTPData, session: Session):
+async def recovery_otp(user_id: UUID, body: RecoveryOTPData, session: AsyncSession):
     statement = select(AuthService).where(AuthService.user_id == user_id, AuthService.app_id == body.app_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
 
     require(record, NotFound("Record not found"))
     require(record.otp_method == body.otp_method, Conflict("Invalid OTP method"))
@@ -71,20 +80,44 @@ def recovery_otp(user_id: UUID, body: RecoveryOTPData, session: Session):
     record.recovery_method = body.recovery_method
     record.otp_method = body.otp_method
     record.otp_secret = generate_secret()
+    if body.failover is not None:
+        record.failover = body.failover
     session.add(record)
-    session.commit()
-    session.refresh(record)
+    await session.commit()
+    await session.refresh(record)
+    await redis_service.invalidate_enrollment(record.user_id, record.app_id)
     succeed = record.recovery_method == body.recovery_method and record.otp_method == body.otp_method
     return succeed
 
-def get_secret(user_id: UUID, app_id: UUID, session: Session):
+async def get_secret(user_id: UUID, app_id: UUID, session: AsyncSession):
     statement = select(AuthService).where(AuthService.user_id == user_id, AuthService.app_id == app_id)
-    record = session.exec(statement).first()
+    record = (await session.exec(statement)).first()
     require(record, NotFound("Record not found"))
 
     return record.otp_secret
 
-def get_service_with_user_and_app(user_id: UUID, app_id: UUID, session: Session):
+async def get_service_with_user_and_app(user_id: UUID, app_id: UUID, session: AsyncSession):
     statement = select(AuthService, User, App).where(AuthService.user_id == user_id, AuthService.app_id == app_id).join(User, AuthService.user_id == User.id).join(App, AuthService.app_id == App.id)
-    record = session.exec(statement).first()
-    return record
\ No newline at end of file
+    record = (await session.exec(statement)).first()
+    return record
+
+async def get_enrollment(user_id: UUID, app_id: UUID, session: AsyncSession) -> Optional[Enrollment]:
+    """Read-through cache of the enrollment used by the code routes. Returns None if not enrolled."""
+    hit, data = await redis_service.get_cached_enrollment(user_id, app_id)
+    if hit:
+        return Enrollment(**data) if data else None
+
+    record = await get_service_with_user_and_app(user_id, app_id, session)
+    enrollment = None
+    if record:
+        enrollment = Enrollment(
+            secret=record.AuthService.otp_secret,
+            enabled=record.AuthService.enabled,
+            phone_number=record.User.phone_number,
+            email=record.User.email,
+            app_name=record.App.name,
+            recovery_method=RecoveryMethod(record.AuthService.recovery_method).value,
+            failover=record.AuthService.failover,
+        )
+    await redis_service.cache_enrollment(user_id, app_id, enrollment.model_dump() if enrollment else None)
+    return enrollment
@@ -1,27 +1,37 @@
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from uuid import UUID
 
+from app.lib.model_cache import TieredCache
 from app.models.tables import User
 from app.schemas import schemas
 
+# Keys are "id:<uuid>" and "username:<username>"
+user_cache = TieredCache("user", User)
 
-def get_user(username: str, session: Session) -> User | None:
-    statement = select(User).where(User.username == username)
-    user = session.exec(statement).first()
-    return user
 
-def user_exists(username: str, session: Session) -> bool:
-    user = get_user(username, session)
+async def get_user(username: str, session: AsyncSession) -> User | None:
+    async def load():
+        statement = select(User).where(User.username == username)
+        return (await session.exec(statement)).first()
+
+    return await user_cache.get(f"username:{username}", load)
+
+async def user_exists(username: str, session: AsyncSession) -> bool:
+    user = await get_user(username, session)
     return bool(user)
 
-def create_user(user: schemas.CreateUser, session: Session) :
+async def create_user(user: schemas.CreateUser, session: AsyncSession) :
     user = User.model_validate(user)
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
+    await user_cache.invalidate(f"id:{user.id}", f"username:{user.username}")
     return user
 
-def get_user_by_id(user_id: UUID, session: Session) -> User | None:
-    statement = select(User).where(User.id == user_id)
-    user = session.exec(statement).first()
-    return user
\ No newline at end of file
+async def get_user_by_id(user_id: UUID, session: AsyncSession) -> User | None:
+    async def load():
+        statement = select(User).where(User.id == user_id)
+        return (await session.exec(statement)).first()
+
+    return await user_cache.get(f"id:{user_id}", load)
@@ -0,0 +1,43 @@
+"""
+App API keys.
+
+Keys look like `otp_<prefix>_<secret>`. Only the prefix (for lookup) and a keyed
+hash of the whole key are stored; the key itself is shown once, when it is
+created. Keys are long random strings, so an HMAC (peppered with API_KEY_PEPPER,
+or SECRET_KEY when unset) is enough and costs microseconds to check, unlike a
+password hash.
+"""
+
+import hashlib
+import hmac
+import secrets
+from typing import Optional
+
+from config import settings
+
+PREFIX_BYTES = 6
+
+
+def generate_prefix() -> str:
+    return secrets.token_hex(PREFIX_BYTES)
+
+
+def format_api_key(prefix: str, secret: str) -> str:
+    return f"otp_{prefix}_{secret}"
+
+
+def parse_prefix(api_key: str) -> Optional[str]:
+    """The lookup prefix of a well-formed key, else None."""
+    parts = api_key.split("_", 2)
+    if len(parts) != 3 or parts[0] != "otp" or len(parts[1]) != PREFIX_BYTES * 2 or not parts[2]:
+        return None
+    return parts[1]
+
+
+def hash_api_key(api_key: str) -> str:
+    pepper = (settings.API_KEY_PEPPER or settings.SECRET_KEY).encode()
+    return hmac.new(pepper, api_key.encode(), hashlib.sha256).hexdigest()
+
+
+def verify_api_key(api_key: str, api_key_hash: str) -> bool:
+    return hmac.compare_digest(hash_api_key(api_key), api_key_hash)
@@ -1,9 +1,23 @@
+import time
 from typing import AsyncGenerator
 from redis.asyncio import Redis
 from config import settings
+from app.utils import timing
+
+
+class TimedRedis(Redis):
+    """Redis client that adds each command's round trip to the request's Server-Timing."""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            timing.record("redis", time.perf_counter() - start)
+
 
 # Singleton Redis client for the app
-redis_client: Redis = Redis.from_url(settings.REDIS_URL, decode_responses=True)
+redis_client: Redis = TimedRedis.from_url(settings.REDIS_URL, decode_responses=True)
 
 async def get_redis() -> Redis:
     """FastAPI dependency that returns the global Redis client."""
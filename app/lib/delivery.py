@@ -0,0 +1,465 @@
+"""
+OTP delivery queue on Redis Streams.
+
+Send routes enqueue a delivery and answer 202 right away; a pool of async
+workers (in the API process, or standalone via `python -m app.worker`) hands
+them to Twilio/Resend over the shared async provider client.
+
+Deliveries are queued per app and priority (`otp:delivery:<priority>:<app_id>`).
+Workers read one entry per app stream at a time, so a burst from one tenant is
+interleaved with everyone else's sends instead of delaying them, and bulk
+deliveries are only read while no interactive one is waiting. Each worker sends
+up to DELIVERY_CONCURRENCY deliveries at once, so one waiting on a busy sender
+does not hold up the others. Every send first
+takes a token from the shared outbound throttle of its sender and provider
+(see `app.lib.throttle`); a queued delivery waits at most DELIVERY_THROTTLE_WAIT
+for it, then goes back to the end of its app's stream.
+
+Each delivery carries the deadline of its code: once it has passed, sending it
+is pointless and it is dropped. Sends go through per-channel circuit breakers
+and are retried with backoff inside that deadline (see `deliver`); enrollments
+that opted in fail over to their other channels. Deliveries that still failed
+are requeued up to DELIVERY_MAX_ATTEMPTS while the code is valid, then moved to
+the dead-letter stream. Entries are deleted once handled, so codes do not linger
+in the stream; deliveries left pending by a crashed worker are claimed by
+another after DELIVERY_CLAIM_IDLE seconds.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from app.lib.cache import redis_client
+from app.lib.issuance import derive_code
+from app.lib.metrics import record_delivery
+from app.lib.resend import get_template, send_email
+from app.lib.resilience import ProviderRejected, backoff_delay, get_breaker
+from app.lib.sender_pool import SenderPool, parse_senders
+from app.lib.throttle import Throttled
+from app.lib.twilio import send_sms, send_whatsapp
+from app.schemas.schemas import Enrollment
+from app.utils.logger import Logger
+from config import settings
+
+SMS = "sms"
+WHATSAPP = "whatsapp"
+EMAIL = "email"
+
+DELIVERY_STREAM = "otp:delivery"
+DEAD_LETTER_STREAM = "otp:delivery:dead"
+CONSUMER_GROUP = "delivery"
+
+# Interactive sends (a user waiting on a code) are always delivered before bulk ones (retries)
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+PROVIDERS = {SMS: "twilio", WHATSAPP: "twilio", EMAIL: "resend"}
+# Failover order after the enrollment's recovery method
+FAILOVER_ORDER = (SMS, WHATSAPP, EMAIL)
+
+
+sender_pools = {
+    SMS: SenderPool("twilio", SMS, parse_senders(settings.TWILIO_PHONE_NUMBERS) or [settings.TWILIO_PHONE_NUMBER]),
+    WHATSAPP: SenderPool("twilio", WHATSAPP, parse_senders(settings.TWILIO_WHATSAPP_NUMBERS) or [settings.TWILIO_WHATSAPP_NUMBER]),
+    EMAIL: SenderPool("resend", EMAIL, [settings.EMAIL_ADDRESS]),
+}
+
+
+async def _send(channel: str, to: str, app_name: str, otp: str, sender: str) -> bool:
+    if channel == SMS:
+        result = await send_sms(to=to, body=f"Your verification code for {app_name} is: {otp}", from_=sender)
+    elif channel == WHATSAPP:
+        result = await send_whatsapp(to=to, code=otp, from_=sender)
+    else:
+        result = await send_email(to=to, subject=f"Your verification code for {app_name}", body=get_template(app_name, otp))
+    return result is not None
+
+
+async def deliver(
+    channel: str, to: str, app_name: str, otp: str, deadline: Optional[float] = None, max_wait: Optional[float] = None
+) -> bool:
+    """
+    Send one code through its provider. Returns whether the provider accepted it.
+
+    Goes through the channel's circuit breaker (fails fast while it is open),
+    picks a healthy sender from the channel's pool and retries failed sends with
+    jittered backoff (possibly from another sender), never past `deadline` (epoch seconds).
+    Raises `ProviderRejected`, without retrying, when the provider refused the
+    message itself, and `Throttled` when no send capacity was free within
+    `max_wait` seconds (but might be before the deadline).
+    """
+    if channel not in PROVIDERS:
+        raise ValueError(f"Unknown delivery channel: {channel}")
+    breaker = get_breaker(PROVIDERS[channel], channel)
+    pool = sender_pools[channel]
+
+    for attempt in range(1, settings.PROVIDER_RETRY_ATTEMPTS + 1):
+        if not breaker.allow():
+            Logger.warning(f"Circuit {breaker.name} is open; not sending {channel} code")
+            return False
+        sender = await pool.choose(to)
+        if sender is None:
+            Logger.warning(f"No healthy {channel} sender; not sending {channel} code")
+            breaker.release()
+            return False
+        wait_until, capped = deadline, False
+        if max_wait is not None and (deadline is None or time.time() + max_wait < deadline):
+            wait_until, capped = time.time() + max_wait, True
+        if not await pool.throttle.acquire(PROVIDERS[channel], pool.bucket(sender), wait_until):
+            pool.release(sender)
+            breaker.release()
+            if capped:
+                raise Throttled(f"No {channel} send capacity within {max_wait}s")
+            Logger.warning(f"No {channel} send capacity before the code expires")
+            return False
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+            pool.release(sender)
+            breaker.release()
+            return False
+        try:
+            sent = await asyncio.wait_for(_send(channel, to, app_name, otp, sender), timeout=remaining)
+        except asyncio.TimeoutError:
+            sent = False
+        except ProviderRejected:
+            # About this message, not the provider or sender: neither breaker counts it
+            pool.release(sender)
+            breaker.release()
+            raise
+        pool.record(sender, sent)
+        if sent:
+            breaker.record_success()
+            return True
+        breaker.record_failure()
+
+        if attempt < settings.PROVIDER_RETRY_ATTEMPTS:
+            delay = backoff_delay(attempt)
+            if deadline is not None and time.time() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+    return False
+
+
+async def fan_out(routes: Sequence[Tuple[str, str]], app_name: str, otp: str, deadline: Optional[float] = None, race: bool = False) -> List[Dict]:
+    """
+    Send the same code over every route at once. Returns one result per route, in
+    order: `{channel, success, elapsed_ms, error}`. With `race`, the first success
+    wins and sends still in flight (usually waiting on the throttle) are cancelled.
+    """
+    async def attempt(channel: str, to: str) -> Dict:
+        start = time.perf_counter()
+        try:
+            sent = await deliver(channel, to, app_name, otp, deadline=deadline)
+            error = None if sent else "not delivered"
+        except Exception as e:
+            sent, error = False, str(e)
+        return {"channel": channel, "success": sent, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1), "error": error}
+
+    tasks = [asyncio.create_task(attempt(channel, to)) for channel, to in routes]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if (await next_done)["success"] and race:
+                break
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    return [
+        task.result() if not task.cancelled() else {"channel": channel, "success": False, "elapsed_ms": None, "error": "cancelled"}
+        for task, (channel, _) in zip(tasks, routes)
+    ]
+
+
+def failover_routes(channel: str, to: str, enrollment: Enrollment) -> List[Tuple[str, str]]:
+    """
+    The (channel, address) pairs to try for a send, in order. Without the
+    enrollment's opt-in that is just the requested channel; with it, the recovery
+    method's channel and then the others, wherever the user has an address.
+    """
+    routes = [(channel, to)]
+    if not enrollment.failover:
+        return routes
+    addresses = {SMS: enrollment.phone_number, WHATSAPP: enrollment.phone_number, EMAIL: enrollment.email}
+    preferred = [enrollment.recovery_method.lower()] if enrollment.recovery_method else []
+    for alternative in preferred + list(FAILOVER_ORDER):
+        if addresses.get(alternative) and alternative not in [used for used, _ in routes]:
+            routes.append((alternative, addresses[alternative]))
+    return routes
+
+
+async def deliver_any(
+    routes: Sequence[Tuple[str, str]], app_name: str, otp: str, deadline: Optional[float] = None, max_wait: Optional[float] = None
+) -> Optional[str]:
+    """
+    Try each route in turn. Returns the channel that delivered, or None. If
+    nothing was delivered and a provider rejected a message, raises that `ProviderRejected`.
+    `Throttled` (see `deliver`) is raised as soon as a route has to wait.
+    """
+    rejected = None
+    for channel, to in routes:
+        try:
+            if await deliver(channel, to, app_name, otp, deadline=deadline, max_wait=max_wait):
+                return channel
+        except ProviderRejected as e:
+            rejected = e
+    if rejected is not None:
+        raise rejected
+    return None
+
+
+class DeliveryQueue:
+    def __init__(
+        self,
+        redis: Redis = None,
+        stream: str = DELIVERY_STREAM,
+        dead_letter_stream: str = DEAD_LETTER_STREAM,
+        group: str = CONSUMER_GROUP,
+        max_attempts: int = settings.DELIVERY_MAX_ATTEMPTS,
+        throttle_wait: float = settings.DELIVERY_THROTTLE_WAIT,
+        maxlen: int = settings.DELIVERY_STREAM_MAXLEN,
+        claim_idle: float = settings.DELIVERY_CLAIM_IDLE,
+        concurrency: int = settings.DELIVERY_CONCURRENCY,
+    ):
+        self.redis = redis or redis_client
+        self.stream = stream
+        self.dead_letter_stream = dead_letter_stream
+        self.group = group
+        self.max_attempts = max_attempts
+        self.throttle_wait = throttle_wait
+        self.maxlen = maxlen
+        self.claim_idle = claim_idle
+        self.concurrency = concurrency
+        self._groups = set()
+
+    def stream_for(self, priority: str, app_id) -> str:
+        return f"{self.stream}:{priority}:{app_id}"
+
+    def _registry(self, priority: str) -> str:
+        return f"{self.stream}:streams:{priority}"
+
+    # ================== PRODUCER ==================
+
+    async def _add(self, fields: Dict[str, str], priority: str):
+        stream = self.stream_for(priority, fields["app_id"])
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xadd(stream, fields, maxlen=self.maxlen, approximate=True)
+        pipe.sadd(self._registry(priority), stream)
+        await pipe.execute()
+
+    async def enqueue(
+        self, channel: str, to: str, app_name: str, nonce: str, deadline: float, user_id: UUID, app_id: UUID,
+        fallbacks: Sequence[Tuple[str, str]] = (), priority: str = INTERACTIVE,
+    ) -> Optional[str]:
+        """
+        Queue a delivery (with failover routes, see `failover_routes`) of the code
+        issued for `nonce` (see `app.lib.issuance`). Returns its delivery id, or None if Redis is unavailable.
+        """
+        delivery_id = uuid.uuid4().hex
+        fields = {
+            "delivery_id": delivery_id,
+            "channel": channel,
+            "to": to,
+            "app_name": app_name,
+            "nonce": nonce,
+            "user_id": str(user_id),
+            "app_id": str(app_id),
+            "deadline": repr(deadline),
+            "enqueued_at": repr(time.time()),
+            "attempts": "0",
+            "fallbacks": json.dumps(list(fallbacks)),
+        }
+        try:
+            await self._add(fields, priority)
+        except Exception as e:
+            Logger.warning(f"Failed to enqueue {channel} delivery: {e}")
+            return None
+        record_delivery(channel, "queued")
+        return delivery_id
+
+    # ================== CONSUMER ==================
+
+    async def streams(self, priority: str) -> List[str]:
+        """Every app's stream of `priority`, with its consumer group created."""
+        streams = sorted(await self.redis.smembers(self._registry(priority)))
+        for stream in streams:
+            if stream in self._groups:
+                continue
+            try:
+                await self.redis.xgroup_create(stream, self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+            self._groups.add(stream)
+        return streams
+
+    async def _done(self, stream: str, entry_id: str):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(stream, self.group, entry_id)
+        pipe.xdel(stream, entry_id)
+        await pipe.execute()
+
+    async def process(self, stream: str, entry_id: str, fields: Dict[str, str]):
+        channel = fields["channel"]
+        delivery_id = fields["delivery_id"]
+        now = time.time()
+
+        if now >= float(fields["deadline"]):
+            Logger.info(f"Dropping expired {channel} delivery {delivery_id}")
+            record_delivery(channel, "expired")
+            await self._done(stream, entry_id)
+            return
+
+        routes = [(channel, fields["to"])] + [tuple(route) for route in json.loads(fields.get("fallbacks", "[]"))]
+        try:
+            # The code exists only here, while it is being sent
+            otp = derive_code(fields["nonce"])
+            used = await deliver_any(routes, fields["app_name"], otp, deadline=float(fields["deadline"]), max_wait=self.throttle_wait)
+            error = None if used else "no provider accepted the message"
+            retryable = True
+        except Throttled:
+            # Its sender is busy: back to the end of its app's stream, without spending an attempt,
+            # so the worker serves other apps meanwhile
+            record_delivery(channel, "deferred")
+            priority = BULK if stream == self.stream_for(BULK, fields["app_id"]) else INTERACTIVE
+            await self._add(fields, priority)
+            await self._done(stream, entry_id)
+            return
+        except ProviderRejected as e:
+            used, error, retryable = None, str(e), False
+        except Exception as e:
+            used, error, retryable = None, str(e), True
+
+        if used:
+            record_delivery(used, "sent", lag=now - float(fields["enqueued_at"]))
+            if used != channel:
+                Logger.info(f"{channel} delivery {delivery_id} failed over to {used}")
+                record_delivery(channel, "failed_over")
+        else:
+            attempts = int(fields["attempts"]) + 1
+            if retryable and attempts < self.max_attempts and time.time() < float(fields["deadline"]):
+                Logger.warning(f"Retrying {channel} delivery {delivery_id} (attempt {attempts}): {error}")
+                record_delivery(channel, "retried")
+                # Retries wait behind first attempts of interactive sends
+                await self._add({**fields, "attempts": str(attempts)}, BULK)
+            else:
+                Logger.error(f"{channel} delivery {delivery_id} failed after {attempts} attempts: {error}")
+                record_delivery(channel, "dead")
+                # The code itself is useless by now (or soon) and is not kept
+                dead = {key: value for key, value in fields.items() if key != "nonce"}
+                await self.redis.xadd(
+                    self.dead_letter_stream, {**dead, "attempts": str(attempts), "error": error}, maxlen=self.maxlen, approximate=True
+                )
+        await self._done(stream, entry_id)
+
+    async def _read(self, consumer: str, streams: List[str], block_ms: Optional[int]) -> List[tuple]:
+        # One entry per stream and read: a burst from one app waits its turn behind every other app
+        if not streams:
+            return []
+        response = await self.redis.xreadgroup(
+            self.group, consumer, {stream: ">" for stream in streams}, count=1, block=block_ms
+        )
+        return [(stream, entry_id, fields) for stream, entries in response or [] for entry_id, fields in entries]
+
+    async def _claim(self, consumer: str, streams: List[str]) -> List[tuple]:
+        claimed = []
+        for stream in streams:
+            _, entries, *_ = await self.redis.xautoclaim(
+                stream, self.group, consumer, min_idle_time=int(self.claim_idle * 1000), start_id="0-0", count=10
+            )
+            claimed += [(stream, entry_id, fields) for entry_id, fields in entries if fields]
+        return claimed
+
+    async def next_batch(self, consumer: str, block_ms: Optional[int] = None) -> List[tuple]:
+        """The next round of deliveries: interactive ones first, bulk only when none are waiting."""
+        interactive = await self.streams(INTERACTIVE)
+        entries = await self._read(consumer, interactive, block_ms=None)
+        if entries:
+            return entries
+        bulk = await self.streams(BULK)
+        entries = await self._read(consumer, bulk, block_ms=None)
+        if entries or not block_ms:
+            return entries
+        return await self._read(consumer, interactive + bulk, block_ms)
+
+    async def _process_logged(self, consumer: str, stream: str, entry_id: str, fields: Dict[str, str]):
+        try:
+            await self.process(stream, entry_id, fields)
+        except Exception as e:
+            # Left pending, so it is claimed again after DELIVERY_CLAIM_IDLE
+            Logger.warning(f"Delivery worker {consumer} failed on {stream} {entry_id}: {e}")
+
+    async def run_worker(self, consumer: str, block_ms: int = 1000, retry_delay: float = 1.0):
+        """Deliver queued messages until cancelled, up to `concurrency` at a time."""
+        next_claim = 0.0
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+        def start(stream: str, entry_id: str, fields: Dict[str, str]):
+            key = (stream, entry_id)
+
+            def finished(_):
+                in_flight.pop(key, None)
+                slots.release()
+
+            in_flight[key] = asyncio.create_task(self._process_logged(consumer, stream, entry_id, fields))
+            in_flight[key].add_done_callback(finished)
+
+        try:
+            while True:
+                try:
+                    entries = []
+                    if time.monotonic() >= next_claim:
+                        claimed = await self._claim(consumer, await self.streams(INTERACTIVE) + await self.streams(BULK))
+                        # Our own slow sends are idle in the PEL too
+                        entries = [entry for entry in claimed if entry[:2] not in in_flight]
+                        next_claim = time.monotonic() + self.claim_idle
+                    entries += await self.next_batch(consumer, block_ms)
+                    if not entries and not self._groups:
+                        # Nothing was ever queued: XREADGROUP had no stream to block on
+                        await asyncio.sleep(block_ms / 1000)
+                    for stream, entry_id, fields in entries:
+                        await slots.acquire()
+                        start(stream, entry_id, fields)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    Logger.warning(f"Delivery worker {consumer} error: {e}")
+                    self._groups.clear()
+                    await asyncio.sleep(retry_delay)
+        finally:
+            tasks = list(in_flight.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global instance
+delivery_queue = DeliveryQueue()
+
+_worker_tasks: List[asyncio.Task] = []
+
+
+def start_delivery_workers(count: int = settings.DELIVERY_WORKERS):
+    if _worker_tasks:
+        return
+    base = f"{socket.gethostname()}-{os.getpid()}"
+    for i in range(count):
+        _worker_tasks.append(asyncio.create_task(delivery_queue.run_worker(f"{base}-{i}")))
+
+
+async def stop_delivery_workers():
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
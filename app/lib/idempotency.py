@@ -0,0 +1,131 @@
+"""
+Idempotency-Key support for the send routes.
+
+A client that retries a send after a timeout should not make us pay the
+provider twice. Requests carrying an `Idempotency-Key` header are recorded in
+Redis under `idempotency:<scope>:<caller>:<key>`:
+
+- the first request marks the key pending and runs; its successful response is
+  stored for IDEMPOTENCY_TTL seconds;
+- a retry with the same key gets the stored response, without running again;
+- a concurrent duplicate waits (up to IDEMPOTENCY_WAIT) for the first request's
+  result, or gets a 409 if it is still running;
+- reusing a key with a different request body is a 422.
+
+Failed requests release their key so they can be retried. Keys are per caller
+(user and, for API-key calls, app). If Redis is unavailable requests run
+without idempotency protection. The route's `RateLimit(..., idempotent=True)`
+is checked only when the request runs, so replays do not count against it.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+
+from redis.asyncio import Redis
+
+from app.lib.cache import redis_client
+from app.utils.errors import BadRequest, Conflict, UnprocessableEntity
+from app.utils.logger import Logger
+from config import settings
+
+HEADER = "Idempotency-Key"
+PENDING = "pending"
+DONE = "done"
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        redis: Redis = None,
+        ttl: int = settings.IDEMPOTENCY_TTL,
+        pending_ttl: int = settings.IDEMPOTENCY_PENDING_TTL,
+        wait: float = settings.IDEMPOTENCY_WAIT,
+        poll_interval: float = 0.05,
+    ):
+        self.redis = redis or redis_client
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    async def _claim(self, key: str, fingerprint: str) -> Optional[dict]:
+        """Mark `key` pending. Returns None when claimed, else the record already there."""
+        pending = json.dumps({"state": PENDING, "fingerprint": fingerprint})
+        if await self.redis.set(key, pending, nx=True, ex=self.pending_ttl):
+            return None
+        stored = await self.redis.get(key)
+        # Released between SET and GET: report as pending, the caller retries
+        return json.loads(stored) if stored else {"state": PENDING, "fingerprint": fingerprint}
+
+    async def run(self, key: str, fingerprint: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `call` once per key; replay its stored result for repeats."""
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                record = await self._claim(key, fingerprint)
+            except Exception as e:
+                Logger.warning(f"Idempotency check failed for {key}: {e}")
+                return await call()
+
+            if record is None:
+                return await self._run_claimed(key, fingerprint, call)
+            if record["fingerprint"] != fingerprint:
+                raise UnprocessableEntity(f"{HEADER} was already used with a different request")
+            if record["state"] == DONE:
+                return record["response"]
+            if time.monotonic() >= deadline:
+                raise Conflict(f"A request with this {HEADER} is still in progress")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _run_claimed(self, key: str, fingerprint: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            response = await call()
+        except BaseException:
+            # Not stored: the client may retry a failed send with the same key
+            try:
+                await self.redis.delete(key)
+            except Exception as e:
+                Logger.warning(f"Failed to release idempotency key {key}: {e}")
+            raise
+        try:
+            await self.redis.set(key, json.dumps({"state": DONE, "fingerprint": fingerprint, "response": response}), ex=self.ttl)
+        except Exception as e:
+            Logger.warning(f"Failed to store idempotent response for {key}: {e}")
+        return response
+
+
+# Global instance
+idempotency_store = IdempotencyStore()
+
+
+def idempotent(scope: str, store: Optional[IdempotencyStore] = None):
+    """
+    Decorator for route handlers taking `request` and `body`: honours the
+    Idempotency-Key header. Must run after authentication (it keys by caller).
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            request, body = kwargs["request"], kwargs["body"]
+            key = request.headers.get(HEADER)
+            if key is None:
+                return await func(*args, **kwargs)
+            if not 0 < len(key) <= 255:
+                raise BadRequest(f"{HEADER} must be 1 to 255 characters")
+
+            async def call():
+                rate_limit = getattr(request.state, "deferred_rate_limit", None)
+                if rate_limit is not None:
+                    await rate_limit()
+                return await func(*args, **kwargs)
+
+            caller = f"{request.state.user_id}:{getattr(request.state, 'app_id', None) or ''}"
+            fingerprint = hashlib.sha256(body.model_dump_json().encode()).hexdigest()
+            redis_key = f"idempotency:{scope}:{caller}:{hashlib.sha256(key.encode()).hexdigest()}"
+            return await (store or idempotency_store).run(redis_key, fingerprint, call)
+        return wrapper
+    return decorator
@@ -0,0 +1,111 @@
+"""
+Issuance of the codes sent by SMS, WhatsApp and email.
+
+Every issuance gets a fresh random code, unrelated to the enrollment's TOTP
+secret, kept in Redis only as long as it is valid:
+
+    otp:<user_id>:<app_id>   hash: hash, nonce, attempts (expires after ISSUED_CODE_TTL)
+
+`hash` is a keyed hash of the code (HMAC peppered with OTP_CODE_PEPPER, or
+SECRET_KEY when unset) and is all `/verify` needs, so checking a delivered code
+never touches the database. The code itself is derived from the random `nonce`
+with the same key, so a re-send while the code still has ISSUED_CODE_REUSE_MIN_TTL
+seconds left repeats it (with its remaining lifetime and attempt budget) instead
+of invalidating the message already on its way, and a Redis dump alone reveals
+no codes. Queued deliveries carry the nonce too, and workers derive the code
+only when sending it. A submission that is neither this code nor a valid TOTP
+code spends one of ISSUED_CODE_ATTEMPTS; the code is dropped when they run out.
+"""
+
+import hashlib
+import hmac
+import secrets
+from dataclasses import dataclass
+from typing import Optional
+from uuid import UUID
+
+from redis.asyncio import Redis
+
+from app.lib.cache import redis_client
+from app.utils.logger import Logger
+from config import settings
+
+CODE_DIGITS = 6
+
+# KEYS[1] code; ARGV[1] new nonce, ARGV[2] hash of its code, ARGV[3] TTL (ms), ARGV[4] attempts,
+# ARGV[5] minimum TTL (ms) left to reuse the live code
+# Returns {status (issued or reused), nonce, ttl_ms}
+ISSUE_SCRIPT = """
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl >= tonumber(ARGV[5]) then
+    local live = redis.call('HMGET', KEYS[1], 'nonce', 'attempts')
+    if live[1] and tonumber(live[2] or '0') > 0 then
+        return {'reused', live[1], ttl}
+    end
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'hash', ARGV[2], 'nonce', ARGV[1], 'attempts', ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return {'issued', ARGV[1], tonumber(ARGV[3])}
+"""
+
+
+def _pepper() -> bytes:
+    return (settings.OTP_CODE_PEPPER or settings.SECRET_KEY).encode()
+
+
+def derive_code(nonce: str) -> str:
+    """The code issued for `nonce`."""
+    digest = hmac.new(_pepper(), f"code:{nonce}".encode(), hashlib.sha256).digest()
+    return str(int.from_bytes(digest, "big") % 10**CODE_DIGITS).zfill(CODE_DIGITS)
+
+
+def hash_code(user_id: UUID, app_id: UUID, code: str) -> str:
+    """Keyed hash of a code submitted for an enrollment, as stored for verification."""
+    return hmac.new(_pepper(), f"{user_id}:{app_id}:{code}".encode(), hashlib.sha256).hexdigest()
+
+
+def code_key(user_id: UUID, app_id: UUID) -> str:
+    return f"otp:{user_id}:{app_id}"
+
+
+@dataclass
+class IssuedCode:
+    code: str
+    # None when the code was not issued here (the TOTP fallback while Redis is unavailable)
+    nonce: Optional[str]
+    ttl: float
+    reused: bool
+
+
+class CodeIssuer:
+    def __init__(
+        self,
+        redis: Redis = None,
+        ttl: int = settings.ISSUED_CODE_TTL,
+        attempts: int = settings.ISSUED_CODE_ATTEMPTS,
+        reuse_min_ttl: int = settings.ISSUED_CODE_REUSE_MIN_TTL,
+    ):
+        self.redis = redis or redis_client
+        self.ttl = ttl
+        self.attempts = attempts
+        self.reuse_min_ttl = reuse_min_ttl
+        self._script = None
+
+    async def issue(self, user_id: UUID, app_id: UUID) -> Optional[IssuedCode]:
+        """A new code for the enrollment, or its live one. None if Redis is unavailable."""
+        nonce = secrets.token_hex(16)
+        code = derive_code(nonce)
+        args = [nonce, hash_code(user_id, app_id, code), self.ttl * 1000, self.attempts, self.reuse_min_ttl * 1000]
+        try:
+            if self._script is None:
+                self._script = self.redis.register_script(ISSUE_SCRIPT)
+            status, nonce, ttl_ms = await self._script(keys=[code_key(user_id, app_id)], args=args)
+        except Exception as e:
+            Logger.warning(f"Failed to issue code for {code_key(user_id, app_id)}: {e}")
+            return None
+        return IssuedCode(code=derive_code(nonce), nonce=nonce, ttl=int(ttl_ms) / 1000, reused=status == "reused")
+
+
+# Global instance
+code_issuer = CodeIssuer()
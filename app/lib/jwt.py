@@ -1,11 +1,216 @@
+"""
+Password hashing.
+
+bcrypt/argon2 burn hundreds of ms of CPU per call, so hashing runs in a bounded
+process pool instead of on the event loop. Callers use the async `hash`/`verify`
+functions; when the pool and its queue are full they fail fast with a 503.
+
+The scheme and its cost are configured through a `HashPolicy` (see
+PASSWORD_HASH_* settings). `calibrate` picks the cost that hits a target hash
+time on the current hardware, and `verify_and_update` returns a new hash when
+the stored one was made with an outdated scheme or cost.
+"""
+
+import asyncio
+import builtins
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import astuple, dataclass, replace
+from functools import lru_cache
+from typing import Optional
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.lib.metrics import record_password_hash, record_password_hash_rejected, set_password_hash_pending
+from app.utils.errors import ServiceUnavailable
+from app.utils.logger import Logger
+from config import settings
+
+SCHEMES = ("argon2", "bcrypt")
+
+
+@dataclass(frozen=True)
+class HashPolicy:
+    """Hashing scheme and cost parameters. Hashes made with anything else are rehashed on login."""
+
+    scheme: str = "bcrypt"
+    bcrypt_rounds: int = 12
+    argon2_time_cost: int = 3
+    argon2_memory_cost: int = 65536  # KiB
+    argon2_parallelism: int = 4
+
+    def __hash__(self):
+        # The generated __hash__ would resolve `hash` to this module's async hash()
+        return builtins.hash(astuple(self))
+
+
+@lru_cache(maxsize=8)
+def get_context(policy: HashPolicy) -> CryptContext:
+    if policy.scheme not in SCHEMES:
+        raise ValueError(f"Unsupported password hash scheme: {policy.scheme}")
+    return CryptContext(
+        # every supported scheme is accepted for verification; non-default ones are deprecated
+        schemes=list(SCHEMES),
+        default=policy.scheme,
+        deprecated="auto",
+        bcrypt__rounds=policy.bcrypt_rounds,
+        bcrypt__min_rounds=policy.bcrypt_rounds,
+        argon2__type="ID",
+        argon2__time_cost=policy.argon2_time_cost,
+        argon2__memory_cost=policy.argon2_memory_cost,
+        argon2__parallelism=policy.argon2_parallelism,
+    )
+
+
+default_policy = HashPolicy(
+    scheme=settings.PASSWORD_HASH_SCHEME,
+    bcrypt_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    argon2_time_cost=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2_memory_cost=settings.PASSWORD_ARGON2_MEMORY_COST,
+    argon2_parallelism=settings.PASSWORD_ARGON2_PARALLELISM,
+)
+pwd_context = get_context(default_policy)
+
+
+# ================== WORKER FUNCTIONS ==================
+# Module-level so they can be pickled into the process pool. The policy travels
+# with each call so workers follow runtime changes (e.g. calibration). Each
+# returns the result plus the time spent hashing inside the worker.
+
+def _hash_in_worker(policy: HashPolicy, password: str) -> tuple[str, float]:
+    start = time.perf_counter()
+    hashed = get_context(policy).hash(password)
+    return hashed, time.perf_counter() - start
+
+
+def _verify_in_worker(policy: HashPolicy, plain_password: str, hashed_password: str) -> tuple[bool, float]:
+    start = time.perf_counter()
+    verified = get_context(policy).verify(plain_password, hashed_password)
+    return verified, time.perf_counter() - start
+
+
+def _verify_and_update_in_worker(policy: HashPolicy, plain_password: str, hashed_password: str) -> tuple[tuple[bool, Optional[str]], float]:
+    start = time.perf_counter()
+    result = get_context(policy).verify_and_update(plain_password, hashed_password)
+    return result, time.perf_counter() - start
+
+
+# ================== CALIBRATION ==================
+
+def _time_hash(policy: HashPolicy, samples: int = 3) -> float:
+    context = get_context(policy)
+    best = float("inf")
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash("calibration-password")
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate(policy: HashPolicy, target_ms: float, max_cost: int = 20) -> HashPolicy:
+    """Return `policy` with the highest cost whose hash time stays within `target_ms`.
+
+    bcrypt tunes its rounds (each one doubles the work); argon2 keeps memory and
+    parallelism and tunes the time cost. Never goes below the scheme minimum.
+    """
+    target = target_ms / 1000.0
+    if policy.scheme == "bcrypt":
+        field, cost = "bcrypt_rounds", 4
+    else:
+        field, cost = "argon2_time_cost", 1
+
+    candidate = replace(policy, **{field: cost})
+    while cost < max_cost:
+        next_candidate = replace(policy, **{field: cost + 1})
+        if _time_hash(next_candidate) > target:
+            break
+        cost += 1
+        candidate = next_candidate
+
+    Logger.info(f"Calibrated {policy.scheme} to {field}={cost} for a {target_ms}ms target.")
+    return candidate
+
+
+# ================== EXECUTOR ==================
+
+class PasswordHasher:
+    """Runs password hashing on a bounded process pool.
+
+    At most `workers` hashes run at once and at most `max_queue` more may wait;
+    anything beyond that is rejected immediately with ServiceUnavailable. Queue
+    wait, hash time, rejections and pending calls are exported to /metrics.
+    """
+
+    def __init__(self, workers: int = 0, max_queue: int = 64, executor: Optional[Executor] = None, policy: HashPolicy = default_policy):
+        self.policy = policy
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._executor = executor
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            Logger.info(f"Starting password hashing pool with {self.workers} workers.")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self._pending >= self.workers + self.max_queue:
+            record_password_hash_rejected()
+            raise ServiceUnavailable("Authentication service is busy, try again later")
+
+        self._pending += 1
+        set_password_hash_pending(self._pending)
+        try:
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            result, hash_time = await loop.run_in_executor(self._get_executor(), func, self.policy, *args)
+            elapsed = time.perf_counter() - start
+            record_password_hash(max(elapsed - hash_time, 0.0), hash_time)
+            return result
+        finally:
+            self._pending -= 1
+            set_password_hash_pending(self._pending)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash_in_worker, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify_in_worker, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        """Verify and, if the stored hash is outdated, also return a replacement hash."""
+        return await self._run(_verify_and_update_in_worker, plain_password, hashed_password)
+
+    async def calibrate(self, target_ms: float):
+        """Calibrate the current policy against this machine, off the event loop."""
+        self.policy = await asyncio.to_thread(calibrate, self.policy, target_ms)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Global instance
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE,
+)
+
+
+async def hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def hash(password: str):
-    return pwd_context.hash(password)
 
+async def verify(plan_password, hashed_password) -> bool:
+    return await password_hasher.verify(plan_password, hashed_password)
 
-def verify(plan_password, hashed_password):
-    return pwd_context.verify(plan_password, hashed_password)
 
+async def verify_and_update(plan_password, hashed_password) -> tuple[bool, Optional[str]]:
+    return await password_hasher.verify_and_update(plan_password, hashed_password)
@@ -0,0 +1,213 @@
+"""
+Prometheus metrics for the OTP microservice.
+
+Metrics live in the default prometheus_client registry and are served by
+`GET /metrics` (see `app/routes/metricsRouter.py`), so nothing beyond the app
+is needed to inspect them locally. With several worker processes set
+PROMETHEUS_MULTIPROC_DIR and the endpoint aggregates all of them.
+"""
+
+import os
+from functools import wraps
+
+from fastapi import HTTPException
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# ================== HTTP ==================
+
+REQUEST_COUNT = Counter(
+    "http_requests_total",
+    "HTTP requests by route template, method and status code.",
+    ["method", "route", "status"],
+)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template, method and status code.",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+# ================== OTP ==================
+
+OTP_EVENTS = Counter(
+    "otp_events_total",
+    "OTP operations (generate/send/verify) by channel and outcome.",
+    ["operation", "channel", "outcome"],
+)
+
+RATE_LIMIT_REJECTIONS = Counter(
+    "rate_limit_rejections_total",
+    "Requests rejected by a rate limit.",
+    ["scope"],
+)
+
+PROVIDER_ERRORS = Counter(
+    "provider_errors_total",
+    "Failed calls to external delivery providers.",
+    ["provider", "channel"],
+)
+
+PROVIDER_CIRCUIT_OPEN = Gauge(
+    "provider_circuit_open",
+    "1 while the circuit breaker of a provider channel is open (sends fail fast), else 0.",
+    ["circuit"],
+    # Breakers are per process: report open if any live worker has it open
+    multiprocess_mode="livemax",
+)
+
+PROVIDER_THROTTLED = Counter(
+    "provider_throttled_total",
+    "Sends held back by the outbound throttle because a sender or provider bucket was empty.",
+    ["provider"],
+)
+
+SENDER_SENDS = Counter(
+    "provider_sender_sends_total",
+    "Sends per pooled sender identity (channel:number) and outcome (sent, failed).",
+    ["provider", "sender", "outcome"],
+)
+
+# ================== DELIVERY ==================
+
+DELIVERY_EVENTS = Counter(
+    "otp_delivery_events_total",
+    "Queued OTP deliveries by channel and outcome (queued, sent, failed_over, retried, expired, dead).",
+    ["channel", "outcome"],
+)
+
+DELIVERY_LAG = Histogram(
+    "otp_delivery_lag_seconds",
+    "Time from enqueueing an OTP delivery to handing it to the provider.",
+    ["channel"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+# ================== PASSWORD HASHING ==================
+
+PASSWORD_HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds",
+    "Time a password hash/verify waited for a slot in the hashing pool.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "CPU time of one password hash/verify in the hashing pool.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+PASSWORD_HASH_REJECTIONS = Counter(
+    "password_hash_rejections_total",
+    "Password hash/verify calls rejected with 503 because the hashing pool and its queue were full.",
+)
+
+PASSWORD_HASH_PENDING = Gauge(
+    "password_hash_pending",
+    "Password hash/verify calls running or queued in the hashing pool.",
+    multiprocess_mode="livesum",
+)
+
+# ================== CACHE ==================
+
+CACHE_EVENTS = Counter(
+    "cache_events_total",
+    "Model cache hits, misses and evictions by cache and tier.",
+    ["cache", "tier", "event"],
+)
+
+
+def observe_request(method: str, route: str, status: int, duration: float):
+    REQUEST_COUNT.labels(method, route, status).inc()
+    REQUEST_LATENCY.labels(method, route, status).observe(duration)
+
+
+def record_rate_limited(scope: str):
+    RATE_LIMIT_REJECTIONS.labels(scope).inc()
+
+
+def record_provider_error(provider: str, channel: str):
+    PROVIDER_ERRORS.labels(provider, channel).inc()
+
+
+def record_throttled(provider: str):
+    PROVIDER_THROTTLED.labels(provider).inc()
+
+
+def record_sender_send(provider: str, sender: str, outcome: str):
+    SENDER_SENDS.labels(provider, sender, outcome).inc()
+
+
+def record_circuit_state(circuit: str, state: str):
+    PROVIDER_CIRCUIT_OPEN.labels(circuit).set(1 if state == "open" else 0)
+
+
+def record_delivery(channel: str, outcome: str, lag: float = None):
+    DELIVERY_EVENTS.labels(channel, outcome).inc()
+    if lag is not None:
+        DELIVERY_LAG.labels(channel).observe(lag)
+
+
+def record_password_hash(queue_wait: float, hash_time: float):
+    PASSWORD_HASH_QUEUE_WAIT.observe(queue_wait)
+    PASSWORD_HASH_DURATION.observe(hash_time)
+
+
+def record_password_hash_rejected():
+    PASSWORD_HASH_REJECTIONS.inc()
+
+
+def set_password_hash_pending(pending: int):
+    PASSWORD_HASH_PENDING.set(pending)
+
+
+def record_cache_event(cache: str, tier: str, event: str):
+    CACHE_EVENTS.labels(cache, tier, event).inc()
+
+
+def _outcome(exc: Exception) -> str:
+    status = exc.status_code if isinstance(exc, HTTPException) else 500
+    if status == 429:
+        return "rate_limited"
+    if status in (401, 403):
+        return "rejected"
+    if status < 500:
+        return "client_error"
+    return "error"
+
+
+def track_otp(operation: str, channel: str):
+    """Decorator for OTP route handlers: counts each call by its outcome.
+
+    Authentication runs as a dependency before the handler, so only
+    authenticated calls are counted.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as exc:
+                OTP_EVENTS.labels(operation, channel, _outcome(exc)).inc()
+                raise
+            OTP_EVENTS.labels(operation, channel, "success").inc()
+            return result
+        return wrapper
+    return decorator
+
+
+def render_latest() -> tuple[bytes, str]:
+    """Exposition payload and content type for the /metrics endpoint."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
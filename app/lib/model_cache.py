@@ -0,0 +1,254 @@
+"""
+Two-tier cache for rarely changing rows (apps, users).
+
+L1 is a bounded LRU in each worker process with a short TTL; L2 is Redis,
+shared by all workers and nodes. Writers call `invalidate`, which deletes the
+L2 entries and broadcasts the keys on a pub/sub channel so every worker drops
+them from L1. The L1 TTL bounds staleness if a broadcast is missed (e.g. while
+the listener reconnects).
+
+Every key also has a generation in L2 that `invalidate` bumps. A read-through
+fill only writes back if the generation is the one it saw before calling the
+loader, so a row loaded before a concurrent invalidation is never cached.
+
+Values are stored as JSON and rebuilt per read, so callers always get a fresh
+instance that is not attached to any session. Results that are not instances of
+the cached model (e.g. None) are passed through uncached.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Optional, Type, TypeVar
+
+from redis.asyncio import Redis
+from sqlmodel import SQLModel
+
+from app.lib.cache import redis_client
+from app.lib.metrics import record_cache_event
+from app.utils.logger import Logger
+from config import settings
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+T = TypeVar("T", bound=SQLModel)
+
+# KEYS[1] value, KEYS[2] generation; ARGV[1] generation seen before loading ('' if none), ARGV[2] value,
+# ARGV[3] TTL (s)
+# Returns 1 if written, 0 if the key was invalidated meanwhile
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# Every cache by namespace, so broadcasts can be routed to the right L1
+_caches: Dict[str, "TieredCache"] = {}
+
+
+class LRUCache:
+    """Bounded in-process LRU with a per-entry TTL."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """Store `value` for `ttl` seconds (default: the cache's TTL).
+
+        Returns True if the least recently used entry was evicted.
+        """
+        if self.maxsize <= 0:
+            return False
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+            return True
+        return False
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class TieredCache(Generic[T]):
+    """L1 (in-process) + L2 (Redis) read-through cache for one model."""
+
+    def __init__(
+        self,
+        namespace: str,
+        model: Type[T],
+        maxsize: int = settings.MODEL_CACHE_L1_SIZE,
+        l1_ttl: float = settings.MODEL_CACHE_L1_TTL,
+        l2_ttl: int = settings.MODEL_CACHE_L2_TTL,
+        redis: Redis = None,
+    ):
+        self.namespace = namespace
+        self.model = model
+        self.l1 = LRUCache(maxsize, l1_ttl)
+        self.l2_ttl = l2_ttl
+        self.redis = redis or redis_client
+        # Bumped on every invalidation seen by this worker, so L1 is not filled with a
+        # row loaded before it (even when L2 is unavailable)
+        self.epoch = 0
+        self._fill_script = None
+        _caches[namespace] = self
+
+    def _key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    def _generation_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}:gen"
+
+    async def get(self, key: str, loader: Callable[[], Awaitable[Optional[T]]]) -> Optional[T]:
+        data = self.l1.get(key)
+        if data is not None:
+            record_cache_event(self.namespace, "l1", "hit")
+            return self.model.model_validate(data)
+        record_cache_event(self.namespace, "l1", "miss")
+
+        epoch = self.epoch
+        try:
+            raw, generation = await self.redis.mget(self._key(key), self._generation_key(key))
+        except Exception as e:
+            Logger.warning(f"Failed to read {self._key(key)} from cache: {e}")
+            raw, generation = None, None
+        if raw is not None:
+            record_cache_event(self.namespace, "l2", "hit")
+            data = json.loads(raw)
+            self._set_l1(key, data)
+            return self.model.model_validate(data)
+        record_cache_event(self.namespace, "l2", "miss")
+
+        value = await loader()
+        if isinstance(value, self.model):
+            data = value.model_dump(mode="json")
+            if await self._fill_l2(key, generation, data) and self.epoch == epoch:
+                self._set_l1(key, data)
+        return value
+
+    async def _fill_l2(self, key: str, generation: Optional[str], data: Dict[str, Any]) -> bool:
+        """Write back a loaded row unless `key` was invalidated since `generation` was read."""
+        try:
+            if self._fill_script is None:
+                self._fill_script = self.redis.register_script(FILL_SCRIPT)
+            keys = [self._key(key), self._generation_key(key)]
+            return bool(await self._fill_script(keys=keys, args=[generation or "", json.dumps(data), self.l2_ttl]))
+        except Exception as e:
+            Logger.warning(f"Failed to write {self._key(key)} to cache: {e}")
+            # L1 only, still guarded by the local epoch
+            return True
+
+    def _set_l1(self, key: str, data: Dict[str, Any]):
+        if self.l1.set(key, data):
+            record_cache_event(self.namespace, "l1", "eviction")
+
+    async def invalidate(self, *keys: str):
+        """Drop `keys` from L2 and from L1 in every worker."""
+        keys = [str(key) for key in keys if key is not None]
+        if not keys:
+            return
+        self.drop_l1(keys)
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            for key in keys:
+                pipe.delete(self._key(key))
+                pipe.incr(self._generation_key(key))
+                # Outlives any load that could have read the previous generation
+                pipe.expire(self._generation_key(key), self.l2_ttl)
+            await pipe.execute()
+            await self.redis.publish(INVALIDATION_CHANNEL, json.dumps({"namespace": self.namespace, "keys": keys}))
+        except Exception as e:
+            Logger.warning(f"Failed to invalidate {self.namespace} cache for {keys}: {e}")
+
+    def drop_l1(self, keys):
+        self.epoch += 1
+        for key in keys:
+            self.l1.delete(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self.l1), "hits": self.l1.hits, "misses": self.l1.misses, "evictions": self.l1.evictions}
+
+
+def handle_invalidation(message: str):
+    """Apply a broadcast from `TieredCache.invalidate` to the local L1 caches."""
+    try:
+        payload = json.loads(message)
+        cache = _caches.get(payload["namespace"])
+        keys = payload["keys"]
+    except (ValueError, KeyError, TypeError):
+        Logger.warning(f"Ignoring malformed cache invalidation: {message!r}")
+        return
+    if cache is not None:
+        cache.drop_l1(keys)
+
+
+async def listen_for_invalidations(redis: Redis = None, retry_delay: float = 1.0):
+    """Subscribe to invalidation broadcasts until cancelled, reconnecting on errors."""
+    redis = redis or redis_client
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything cached while unsubscribed may have missed a broadcast
+            for cache in _caches.values():
+                cache.epoch += 1
+                cache.l1.clear()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    handle_invalidation(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            Logger.warning(f"Cache invalidation listener disconnected: {e}")
+            await asyncio.sleep(retry_delay)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+def start_invalidation_listener():
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(listen_for_invalidations())
+
+
+async def stop_invalidation_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
@@ -1,43 +1,65 @@
+import hashlib
+import time
+import uuid
 from uuid import UUID
 import jwt
 from datetime import datetime, timedelta, timezone
 
+from app.lib.model_cache import LRUCache
+from app.lib.signing_keys import signing_keys
 from app.schemas import schemas
 from app.utils.errors import require, Unauthorized, BadRequest
 from config import settings
 
+# Verified tokens by SHA-256 digest, each kept until the token's own expiry, so
+# repeat requests skip the signature check and claim parsing
+_verified_tokens = LRUCache(maxsize=settings.TOKEN_CACHE_SIZE)
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"expiration_date": str(expire)})
+    # jti identifies the token for revocation; a float iat lets per-user revocation cut off precisely
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex})
 
+    key = signing_keys.active
     encoded_jwt = jwt.encode(
-        to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
+        to_encode, key.signing_key, algorithm=key.algorithm, headers={"kid": key.kid} if key.kid else None
     )
 
     return encoded_jwt
 
 
 def verify_access_token(token: str):
+    digest = hashlib.sha256(token.encode()).digest()
+    token_data = _verified_tokens.get(digest)
+    if token_data is not None:
+        return token_data
+
     try:
+        key = signing_keys.verification_key(jwt.get_unverified_header(token).get("kid"))
+        require(key, Unauthorized("Invalid token"))
+        # Only the key's own algorithm is accepted; PyJWT checks that `exp` exists and is in the future
         payload = jwt.decode(
-            jwt=token, key=settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
+            jwt=token, key=key.verifying_key, algorithms=[key.algorithm], options={"require": ["exp"]}
         )
-
-        id: UUID = payload.get("id")
-        require(id is not None, Unauthorized("Invalid token"))
-        expiration_date = payload.get("expiration_date")
-
-        # expiration_date should exist and be in the future
-        require(
-            expiration_date is not None and datetime.now() <= datetime.fromisoformat(expiration_date),
-            Unauthorized("Token expired or invalid"))
-
-        token_data = schemas.TokenData(id=id, expiration_date=expiration_date)
-        return token_data
+    except jwt.ExpiredSignatureError:
+        raise Unauthorized("Token expired or invalid")
     except jwt.InvalidTokenError:
         raise Unauthorized("Invalid token")
 
+    id: UUID = payload.get("user_id")
+    require(id is not None, Unauthorized("Invalid token"))
+
+    token_data = schemas.TokenData(
+        id=id,
+        expiration_date=datetime.fromtimestamp(payload["exp"], timezone.utc),
+        jti=payload.get("jti"),
+        issued_at=datetime.fromtimestamp(payload["iat"], timezone.utc) if "iat" in payload else None,
+    )
+    _verified_tokens.set(digest, token_data, ttl=payload["exp"] - time.time())
+    return token_data
+
 
 def get_token(token: str):
     try:
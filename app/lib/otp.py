@@ -1,4 +1,10 @@
+import time
+
 from pyotp import TOTP, random_base32, parse_uri as parse
+from pyotp.utils import strings_equal
+
+# pyotp's default TOTP step, in seconds
+TOTP_INTERVAL = 30
 
 
 def generate_secret():
@@ -10,8 +16,18 @@ def generate_otp(secret):
 def verify_otp(secret, otp):
     return TOTP(secret).verify(otp)
 
+def current_time_step(for_time=None):
+    return int((time.time() if for_time is None else for_time) // TOTP_INTERVAL)
+
+def verify_otp_time_step(secret, otp, for_time=None):
+    """Like `verify_otp`, but returns the accepted time step (or None) so callers can refuse replays."""
+    for_time = time.time() if for_time is None else for_time
+    if strings_equal(str(otp), TOTP(secret, interval=TOTP_INTERVAL).at(for_time)):
+        return current_time_step(for_time)
+    return None
+
 def generate_uri(secret, issuer_name, username):
     return TOTP(secret).provisioning_uri(username, issuer_name=issuer_name)
 
 def parse_uri(uri):
-    return parse(uri)
\ No newline at end of file
+    return parse(uri)
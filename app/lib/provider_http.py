@@ -0,0 +1,63 @@
+"""
+Shared async HTTP client for the messaging providers (Twilio, Resend).
+
+One pooled `httpx.AsyncClient` per process: connections are kept alive and
+reused across sends, capped by PROVIDER_MAX_CONNECTIONS, and every call has
+explicit connect/read timeouts. With PROVIDER_HTTP2 (the default) HTTP/2 is
+negotiated, so concurrent sends to one provider share a connection; it needs
+`h2` (the `httpx[http2]` extra in requirements.txt), and without it the client
+logs a warning and uses HTTP/1.1 keep-alive.
+"""
+
+from typing import Optional
+
+import httpx
+
+from app.utils.logger import Logger
+from config import settings
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def build_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    if settings.PROVIDER_HTTP2 and not HTTP2_AVAILABLE:
+        Logger.warning("PROVIDER_HTTP2 is set but `h2` is not installed; provider calls use HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=settings.PROVIDER_HTTP2 and HTTP2_AVAILABLE,
+        timeout=httpx.Timeout(
+            connect=settings.PROVIDER_CONNECT_TIMEOUT,
+            read=settings.PROVIDER_READ_TIMEOUT,
+            write=settings.PROVIDER_READ_TIMEOUT,
+            pool=settings.PROVIDER_CONNECT_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.PROVIDER_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.PROVIDER_MAX_KEEPALIVE,
+            keepalive_expiry=settings.PROVIDER_KEEPALIVE_EXPIRY,
+        ),
+        transport=transport,
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The process-wide provider client, created on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_client()
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception:
+            pass
+        _client = None
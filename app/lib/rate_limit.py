@@ -0,0 +1,214 @@
+"""
+Redis-backed rate limiting.
+
+Each algorithm is a Lua script, so a check is a single atomic round trip and
+keys always get an expiry (no INCR-then-EXPIRE gap). Clocks come from the Redis
+server (`TIME`), so every worker agrees on the window.
+
+Routes declare their limit as a dependency:
+
+    @router.post("/sms", dependencies=[Depends(RateLimit("sms", limit=3, window=60))])
+
+Allowed responses carry `X-RateLimit-*` headers; rejected ones are a 429 with
+`Retry-After`. If Redis is unavailable the check fails open.
+"""
+
+import math
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+from redis.asyncio import Redis
+
+from app.lib.cache import redis_client
+from app.lib.idempotency import HEADER as IDEMPOTENCY_HEADER
+from app.lib.metrics import record_rate_limited
+from app.utils.decorators import authenticate, request_app_id
+from app.utils.errors import TooManyRequests
+from app.utils.logger import Logger
+
+FIXED_WINDOW = "fixed_window"
+SLIDING_WINDOW = "sliding_window"
+GCRA = "gcra"
+
+# All scripts return {allowed, used, reset_ms, retry_after_ms}
+
+# KEYS[1] counter; ARGV[1] limit, ARGV[2] window (ms)
+FIXED_WINDOW_SCRIPT = """
+local used = redis.call('INCR', KEYS[1])
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl < 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    ttl = tonumber(ARGV[2])
+end
+if used <= tonumber(ARGV[1]) then
+    return {1, used, ttl, 0}
+end
+return {0, used, ttl, ttl}
+"""
+
+# KEYS[1] sorted set of hit timestamps; ARGV[1] limit, ARGV[2] window (ms), ARGV[3] unique member
+SLIDING_WINDOW_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local used = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if used < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[3])
+    used = used + 1
+    allowed = 1
+end
+redis.call('PEXPIRE', KEYS[1], window)
+local reset = window
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+if allowed == 1 then
+    return {1, used, reset, 0}
+end
+return {0, used, reset, reset}
+"""
+
+# Generic cell rate algorithm. KEYS[1] theoretical arrival time; ARGV[1] limit (burst), ARGV[2] period (ms)
+GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local interval = period / limit
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+local allow_at = new_tat - period
+if allow_at > now then
+    return {0, limit, math.ceil(tat - now), math.ceil(allow_at - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now))
+local remaining = math.floor((now - allow_at) / interval)
+return {1, limit - remaining, math.ceil(new_tat - now), 0}
+"""
+
+SCRIPTS = {
+    FIXED_WINDOW: FIXED_WINDOW_SCRIPT,
+    SLIDING_WINDOW: SLIDING_WINDOW_SCRIPT,
+    GCRA: GCRA_SCRIPT,
+}
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    used: int
+    reset_after: float  # seconds until the limit fully resets
+    retry_after: float  # seconds until the next request may pass (0 when allowed)
+
+    @property
+    def remaining(self) -> int:
+        return max(self.limit - self.used, 0)
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(math.ceil(self.retry_after), 1))
+        return headers
+
+
+class RateLimiter:
+    """Runs the rate-limit scripts against Redis."""
+
+    def __init__(self, redis: Redis = None):
+        self.redis = redis or redis_client
+        self._scripts = {}
+
+    def _script(self, algorithm: str):
+        # register_script handles EVALSHA with a transparent EVAL fallback
+        if algorithm not in self._scripts:
+            self._scripts[algorithm] = self.redis.register_script(SCRIPTS[algorithm])
+        return self._scripts[algorithm]
+
+    async def hit(self, key: str, limit: int, window: int = 60, algorithm: str = FIXED_WINDOW) -> RateLimitResult:
+        """Count one request against `key` (at most `limit` per `window` seconds)."""
+        window_ms = int(window * 1000)
+        args = [limit, window_ms]
+        if algorithm == SLIDING_WINDOW:
+            args.append(f"{time.time_ns()}-{uuid.uuid4().hex[:8]}")
+
+        try:
+            allowed, used, reset_ms, retry_ms = await self._script(algorithm)(keys=[key], args=args)
+        except Exception as e:
+            Logger.warning(f"Rate limit check failed for {key}: {e}")
+            # Fail open
+            return RateLimitResult(allowed=True, limit=limit, used=0, reset_after=window, retry_after=0)
+
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=limit,
+            used=int(used),
+            reset_after=int(reset_ms) / 1000,
+            retry_after=int(retry_ms) / 1000,
+        )
+
+
+# Global instance
+rate_limiter = RateLimiter()
+
+
+class RateLimit:
+    """
+    Per-route rate limit dependency, keyed by authenticated user and app.
+
+    With `idempotent`, for routes decorated with `@idempotent`: a request carrying
+    an Idempotency-Key is counted only when it actually runs, so retries that
+    replay a stored response never use up the budget (see `app.lib.idempotency`).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        window: int = 60,
+        algorithm: str = FIXED_WINDOW,
+        limiter: Optional[RateLimiter] = None,
+        idempotent: bool = False,
+    ):
+        if algorithm not in SCRIPTS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.algorithm = algorithm
+        self.limiter = limiter
+        self.idempotent = idempotent
+
+    async def key(self, request: Request) -> str:
+        user_id = await authenticate(request)
+        app_id = await request_app_id(request)
+        return f"rate:{self.name}:{user_id}:{app_id}"
+
+    async def check(self, request: Request, response: Response):
+        limiter = self.limiter or rate_limiter
+        result = await limiter.hit(await self.key(request), self.limit, self.window, self.algorithm)
+        if not result.allowed:
+            record_rate_limited(self.name)
+            raise TooManyRequests("Too many requests", headers=result.headers())
+        response.headers.update(result.headers())
+
+    async def __call__(self, request: Request, response: Response):
+        if self.idempotent and request.headers.get(IDEMPOTENCY_HEADER):
+            # Checked by @idempotent once it knows the request is not a replay
+            request.state.deferred_rate_limit = lambda: self.check(request, response)
+            return
+        await self.check(request, response)
@@ -10,14 +10,72 @@ import hashlib
 from uuid import UUID
 
 from app.lib.cache import redis_client
+from app.lib.issuance import code_key, hash_code
+from app.lib.otp import TOTP_INTERVAL, current_time_step
+from app.lib.rate_limit import RateLimiter, FIXED_WINDOW
 from app.utils.logger import Logger
 
 
+# KEYS[1] rate counter, KEYS[2] failed attempts, KEYS[3] issued code (see app.lib.issuance), KEYS[4] code accepted
+# in the current TOTP step, KEYS[5] issued code last accepted
+# ARGV[1] rate limit, ARGV[2] rate window (ms), ARGV[3] max failed attempts, ARGV[4] failed window (ms),
+# ARGV[5] keyed hash of the submitted OTP, ARGV[6] TOTP step TTL (ms)
+# Returns {status, rate_used, rate_reset_ms, failed_attempts, retry_after_ms}
+VERIFY_OTP_SCRIPT = """
+local used = redis.call('INCR', KEYS[1])
+local reset = redis.call('PTTL', KEYS[1])
+if reset < 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    reset = tonumber(ARGV[2])
+end
+if used > tonumber(ARGV[1]) then
+    return {'rate_limited', used, reset, 0, reset}
+end
+local failed = tonumber(redis.call('GET', KEYS[2]) or '0')
+if failed >= tonumber(ARGV[3]) then
+    return {'blocked', used, reset, failed, redis.call('PTTL', KEYS[2])}
+end
+if redis.call('GET', KEYS[4]) == ARGV[5] or redis.call('GET', KEYS[5]) == ARGV[5] then
+    return {'replayed', used, reset, failed, 0}
+end
+local issued = redis.call('HGET', KEYS[3], 'hash')
+if not issued then
+    return {'missing', used, reset, failed, 0}
+end
+if issued == ARGV[5] then
+    local ttl = redis.call('PTTL', KEYS[3])
+    if ttl <= 0 then
+        ttl = ARGV[6]
+    end
+    redis.call('DEL', KEYS[3], KEYS[2])
+    redis.call('SET', KEYS[5], ARGV[5], 'PX', ttl)
+    return {'valid', used, reset, 0, 0}
+end
+return {'invalid', used, reset, failed, 0}
+"""
+
+# KEYS[1] failed attempts, KEYS[2] issued code; ARGV[1] failed window (ms)
+# Returns the failed attempt count
+FAIL_OTP_SCRIPT = """
+local failed = redis.call('INCR', KEYS[1])
+if failed == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+if redis.call('EXISTS', KEYS[2]) == 1 and redis.call('HINCRBY', KEYS[2], 'attempts', -1) <= 0 then
+    redis.call('DEL', KEYS[2])
+end
+return failed
+"""
+
+
 class RedisService:
     """Enhanced Redis service with additional utilities for the OTP microservice."""
     
     def __init__(self, redis: Redis = None):
         self.redis = redis or redis_client
+        self.rate_limiter = RateLimiter(self.redis)
+        self._verify_otp_script = None
+        self._fail_otp_script = None
     
     # ================== RATE LIMITING ==================
     
@@ -33,14 +91,9 @@ class RedisService:
         Returns:
             tuple: (is_allowed, current_count)
         """
-        try:
-            current = await self.redis.incr(key)
-            if current == 1:
-                await self.redis.expire(key, window)
-            return current <= limit, current
-        except Exception as e:
-            Logger.warning(f"Rate limit check failed for {key}: {e}")
-            return True, 0  # Fail open
+        # Single atomic round trip (fails open if Redis is unavailable)
+        result = await self.rate_limiter.hit(key, limit, window, FIXED_WINDOW)
+        return result.allowed, result.used
     
     async def get_rate_limit_status(self, key: str) -> Dict[str, Any]:
         """Get current rate limit status."""
@@ -57,33 +110,96 @@ class RedisService:
     
     # ================== OTP MANAGEMENT ==================
     
-    async def store_otp(self, user_id: UUID, app_id: UUID, otp: str, ttl: int = 120) -> bool:
-        """Store OTP with expiration."""
-        key = f"otp:{user_id}:{app_id}"
+    async def verify_and_consume_otp(
+        self,
+        user_id: UUID,
+        app_id: UUID,
+        otp: str,
+        rate_limit: int = 10,
+        rate_window: int = 60,
+        max_failed: int = 5,
+        failed_ttl: int = 900,
+        time_step: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Check a submitted OTP against the issued one in a single round trip.
+
+        Atomically bumps the verify rate limit, refuses when too many failed
+        attempts were made, and compares-and-deletes the keyed hash of the code
+        issued for the enrollment (see `app.lib.issuance`), so two concurrent
+        requests can never consume the same code. A code already accepted (the
+        delivered one, or in the current TOTP step `time_step`) is refused as
+        replayed. A mismatch (`invalid`) changes nothing, since the submission
+        may still be a valid TOTP code: the caller records it with
+        `record_failed_otp` once that check fails too.
+
+        Returns:
+            dict with `status` (valid, invalid, missing, replayed, rate_limited,
+            blocked or unavailable), `rate_used`, `rate_reset`, `failed_attempts` and
+            `retry_after` (seconds)
+        """
+        keys = [
+            f"rate:verify_otp:{user_id}:{app_id}",
+            f"failed_attempts:otp_verify:{user_id}:{app_id}",
+            code_key(user_id, app_id),
+            self._totp_step_key(user_id, app_id, current_time_step() if time_step is None else time_step),
+            f"issued_used:{user_id}:{app_id}",
+        ]
+        args = [rate_limit, rate_window * 1000, max_failed, failed_ttl * 1000, hash_code(user_id, app_id, otp), TOTP_INTERVAL * 1000]
         try:
-            await self.redis.setex(key, ttl, otp)
-            return True
+            if self._verify_otp_script is None:
+                self._verify_otp_script = self.redis.register_script(VERIFY_OTP_SCRIPT)
+            status, used, reset_ms, failed, retry_ms = await self._verify_otp_script(keys=keys, args=args)
         except Exception as e:
-            Logger.warning(f"Failed to store OTP for {key}: {e}")
-            return False
-    
-    async def get_and_delete_otp(self, user_id: UUID, app_id: UUID) -> Optional[str]:
-        """Get OTP and immediately delete it to prevent reuse."""
-        key = f"otp:{user_id}:{app_id}"
+            Logger.warning(f"OTP verification script failed for {keys[2]}: {e}")
+            return {"status": "unavailable", "rate_used": 0, "rate_reset": rate_window, "failed_attempts": 0, "retry_after": 0}
+
+        return {
+            "status": status,
+            "rate_used": int(used),
+            "rate_reset": int(reset_ms) / 1000,
+            "failed_attempts": int(failed),
+            "retry_after": max(int(retry_ms), 0) / 1000,
+        }
+
+    async def record_failed_otp(self, user_id: UUID, app_id: UUID, failed_ttl: int = 900) -> int:
+        """
+        Count a failed verification and spend one attempt of the live issued code.
+
+        The code is dropped when its attempts run out. Returns the failed
+        attempt count (0 if Redis is unavailable).
+        """
+        keys = [f"failed_attempts:otp_verify:{user_id}:{app_id}", code_key(user_id, app_id)]
         try:
-            # Use pipeline for atomic get-and-delete
-            pipe = self.redis.pipeline()
-            pipe.get(key)
-            pipe.delete(key)
-            results = await pipe.execute()
-            return results[0] if results[0] else None
+            if self._fail_otp_script is None:
+                self._fail_otp_script = self.redis.register_script(FAIL_OTP_SCRIPT)
+            return int(await self._fail_otp_script(keys=keys, args=[failed_ttl * 1000]))
         except Exception as e:
-            Logger.warning(f"Failed to get and delete OTP for {key}: {e}")
-            return None
-    
+            Logger.warning(f"Failed to record failed attempt for {keys[1]}: {e}")
+            return 0
+
+    @staticmethod
+    def _totp_step_key(user_id: UUID, app_id: UUID, time_step: int) -> str:
+        return f"totp_used:{user_id}:{app_id}:{time_step}"
+
+    async def claim_totp_step(self, user_id: UUID, app_id: UUID, time_step: int, otp: str) -> bool:
+        """
+        Record that `otp` (its keyed hash) was accepted for this enrollment and TOTP step.
+
+        Returns False if the step was already claimed (a replay). The key lives
+        for one TOTP interval, as long as the code itself is valid.
+        """
+        key = self._totp_step_key(user_id, app_id, time_step)
+        try:
+            return bool(await self.redis.set(key, hash_code(user_id, app_id, otp), nx=True, px=TOTP_INTERVAL * 1000))
+        except Exception as e:
+            Logger.warning(f"Failed to record TOTP step for {key}: {e}")
+            # Fail open, like the rate limits
+            return True
+
     async def check_otp_exists(self, user_id: UUID, app_id: UUID) -> bool:
-        """Check if OTP exists without consuming it."""
-        key = f"otp:{user_id}:{app_id}"
+        """Check if an issued code is live, without consuming it."""
+        key = code_key(user_id, app_id)
         try:
             exists = await self.redis.exists(key)
             return bool(exists)
@@ -209,6 +325,61 @@ class RedisService:
             Logger.warning(f"Failed to invalidate user cache for {user_id}: {e}")
             return False
     
+    async def get_cached_enrollment(self, user_id: UUID, app_id: UUID) -> tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Get a cached enrollment.
+
+        Returns:
+            (hit, data): data is None on a miss and for a cached "not found"
+        """
+        key = f"enrollment:{user_id}:{app_id}"
+        try:
+            data = await self.redis.get(key)
+        except Exception as e:
+            Logger.warning(f"Failed to get cached enrollment for {key}: {e}")
+            return False, None
+        if data is None:
+            return False, None
+        return True, json.loads(data)
+
+    async def cache_enrollment(
+        self,
+        user_id: UUID,
+        app_id: UUID,
+        data: Optional[Dict[str, Any]],
+        ttl: int = 300,
+        negative_ttl: int = 30,
+    ) -> bool:
+        """Cache an enrollment; `None` caches "not found" for the shorter `negative_ttl`."""
+        key = f"enrollment:{user_id}:{app_id}"
+        try:
+            await self.redis.setex(key, ttl if data is not None else negative_ttl, json.dumps(data, default=str))
+            return True
+        except Exception as e:
+            Logger.warning(f"Failed to cache enrollment for {key}: {e}")
+            return False
+
+    async def invalidate_enrollment(self, user_id: UUID, app_id: UUID) -> bool:
+        """Drop a cached enrollment after it changed in the database."""
+        key = f"enrollment:{user_id}:{app_id}"
+        try:
+            await self.redis.delete(key)
+            return True
+        except Exception as e:
+            Logger.warning(f"Failed to invalidate enrollment cache for {key}: {e}")
+            return False
+
+    async def invalidate_app_enrollments(self, app_id: UUID, user_ids: List[UUID], batch: int = 1000) -> bool:
+        """Drop the cached enrollments of every user of an app (they carry its name)."""
+        keys = [f"enrollment:{user_id}:{app_id}" for user_id in user_ids]
+        try:
+            for start in range(0, len(keys), batch):
+                await self.redis.delete(*keys[start:start + batch])
+            return True
+        except Exception as e:
+            Logger.warning(f"Failed to invalidate enrollment cache for app {app_id}: {e}")
+            return False
+
     # ================== BASIC UTILITIES ==================
     
     # ================== HEALTH & DIAGNOSTICS ==================
@@ -0,0 +1,158 @@
+"""
+Rotating refresh tokens stored in Redis.
+
+A login starts a token family. The client gets an opaque `<family>.<secret>`
+token; Redis keeps only its SHA-256 under `refresh_family:<family>` along with
+the user id. Each refresh atomically swaps in a new token and returns it, so a
+token works once. Presenting an already-rotated token means it leaked (or was
+replayed): the whole family is revoked and the user has to log in again.
+
+Families expire after REFRESH_TOKEN_EXPIRE_DAYS without use. Each user's
+families are also listed under `refresh_user:<user_id>` so they can all be
+revoked at once; every rotation extends that set along with the family, so it
+never expires while one of its families is live.
+"""
+
+import hashlib
+import secrets
+from typing import Optional
+from uuid import UUID
+
+from redis.asyncio import Redis
+
+from app.lib.cache import redis_client
+from app.utils.errors import ServiceUnavailable, Unauthorized
+from app.utils.logger import Logger
+from config import settings
+
+# KEYS[1] family, KEYS[2] the user's family set; ARGV[1] presented token hash, ARGV[2] new token hash,
+# ARGV[3] family TTL (ms)
+# Returns {status, user_id}
+ROTATE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'current')
+if not current then
+    return {'invalid', ''}
+end
+local user_id = redis.call('HGET', KEYS[1], 'user_id')
+if current ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return {'reused', user_id}
+end
+redis.call('HSET', KEYS[1], 'current', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+redis.call('PEXPIRE', KEYS[2], ARGV[3])
+return {'rotated', user_id}
+"""
+
+# KEYS[1] family, KEYS[2] the user's family set; ARGV[1] presented token hash, ARGV[2] user id, ARGV[3] family
+# Returns 1 if the family was revoked
+REVOKE_SCRIPT = """
+local family = redis.call('HMGET', KEYS[1], 'current', 'user_id')
+if family[1] ~= ARGV[1] or family[2] ~= ARGV[2] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[3])
+return 1
+"""
+
+
+def _digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RefreshTokenStore:
+    def __init__(self, redis: Redis = None, ttl: int = settings.REFRESH_TOKEN_EXPIRE_DAYS * 86400):
+        self.redis = redis or redis_client
+        self.ttl = ttl
+        self._rotate_script = None
+        self._revoke_script = None
+
+    @staticmethod
+    def _key(family: str) -> str:
+        return f"refresh_family:{family}"
+
+    @staticmethod
+    def _user_key(user_id: UUID) -> str:
+        return f"refresh_user:{user_id}"
+
+    @staticmethod
+    def _new_token(family: str) -> str:
+        return f"{family}.{secrets.token_urlsafe(32)}"
+
+    async def issue(self, user_id: UUID) -> Optional[str]:
+        """Start a new token family for `user_id` and return its first token (None if Redis is down)."""
+        family = secrets.token_urlsafe(16)
+        token = self._new_token(family)
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hset(self._key(family), mapping={"current": _digest(token), "user_id": str(user_id)})
+            pipe.expire(self._key(family), self.ttl)
+            pipe.sadd(self._user_key(user_id), family)
+            pipe.expire(self._user_key(user_id), self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            Logger.warning(f"Failed to store refresh token for user {user_id}: {e}")
+            return None
+        return token
+
+    async def rotate(self, token: str) -> tuple[str, str]:
+        """Exchange `token` for a new one. Returns (user_id, new_token)."""
+        family, sep, _ = token.partition(".")
+        if not family or not sep:
+            raise Unauthorized("Invalid refresh token")
+
+        new_token = self._new_token(family)
+        try:
+            # The family's user never changes, so reading it ahead of the script is safe
+            owner = await self.redis.hget(self._key(family), "user_id")
+            if owner is None:
+                raise Unauthorized("Invalid refresh token")
+            if self._rotate_script is None:
+                self._rotate_script = self.redis.register_script(ROTATE_SCRIPT)
+            status, user_id = await self._rotate_script(
+                keys=[self._key(family), self._user_key(owner)], args=[_digest(token), _digest(new_token), self.ttl * 1000]
+            )
+        except Unauthorized:
+            raise
+        except Exception as e:
+            Logger.warning(f"Failed to rotate refresh token: {e}")
+            raise ServiceUnavailable("Refresh tokens are temporarily unavailable")
+
+        if status == "reused":
+            Logger.warning(f"Refresh token reuse detected for user {user_id}; token family revoked")
+        if status != "rotated":
+            raise Unauthorized("Invalid refresh token")
+        return user_id, new_token
+
+    async def revoke(self, token: str, user_id: UUID) -> bool:
+        """
+        Revoke the family `token` belongs to (e.g. on logout). Only the family's
+        current token, presented by its own user, revokes it.
+        """
+        family = token.partition(".")[0]
+        try:
+            if self._revoke_script is None:
+                self._revoke_script = self.redis.register_script(REVOKE_SCRIPT)
+            revoked = await self._revoke_script(
+                keys=[self._key(family), self._user_key(user_id)], args=[_digest(token), str(user_id), family]
+            )
+            return bool(revoked)
+        except Exception as e:
+            Logger.warning(f"Failed to revoke refresh token family: {e}")
+            return False
+
+    async def revoke_user(self, user_id: UUID) -> int:
+        """Revoke every token family of `user_id`. Returns how many were still active."""
+        try:
+            families = await self.redis.smembers(self._user_key(user_id))
+            if not families:
+                return 0
+            return await self.redis.delete(*[self._key(family) for family in families], self._user_key(user_id)) - 1
+        except Exception as e:
+            Logger.warning(f"Failed to revoke refresh tokens for user {user_id}: {e}")
+            raise ServiceUnavailable("Refresh tokens are temporarily unavailable")
+
+
+# Global instance
+refresh_tokens = RefreshTokenStore()
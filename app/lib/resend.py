@@ -1,17 +1,19 @@
-import resend
-
 from pydantic import EmailStr
 from config import settings
+from app.lib.metrics import record_provider_error
+from app.lib.provider_http import get_http_client
+from app.lib.resilience import ProviderRejected, is_rejection
+from app.utils.timing import timed
 
-resend.api_key = settings.RESEND_API_KEY
+emails_url = "https://api.resend.com/emails"
 
 
-def send_email(
+async def send_email(
     to: EmailStr,
     subject: str,
     body: str,):
     
-    params: resend.Emails.SendParams = {
+    params = {
         "from": settings.EMAIL_ADDRESS,
         "to": [to],
         "subject": subject,
@@ -19,11 +21,20 @@ def send_email(
     }
     
     try:
-        email = resend.Emails.send(params)
-        return email
+        with timed("provider"):
+            response = await get_http_client().post(
+                emails_url,
+                json=params,
+                headers={"Authorization": f"Bearer {settings.RESEND_API_KEY}"},
+            )
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
         from app.utils.logger import Logger
         Logger.error(f"Resend send_email failed: {e}")
+        record_provider_error("resend", "email")
+        if is_rejection(e):
+            raise ProviderRejected(f"Resend rejected the email: {e}") from e
         return None
 
 def get_template(app_name: str, code: str) -> str:
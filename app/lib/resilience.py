@@ -0,0 +1,116 @@
+"""
+Circuit breakers and retry backoff for the messaging providers.
+
+Each provider+channel (e.g. twilio/sms) has a breaker in this process. After
+PROVIDER_BREAKER_FAILURES consecutive failed sends it opens and sends on that
+channel fail immediately instead of waiting on a degraded provider. After
+PROVIDER_BREAKER_RESET seconds one probe send is let through (half-open): success
+closes the breaker, failure keeps it open for another period.
+
+Only failures that say something about the provider count: 5xx, 429, timeouts
+and connection errors. A 4xx refusing the message itself (a bad recipient
+number, say) is raised as `ProviderRejected`; it is neither retried nor counted,
+so a few bad numbers from one tenant cannot open a breaker shared by all.
+"""
+
+import random
+import time
+from typing import Callable, Dict, Tuple
+
+import httpx
+
+from app.lib.metrics import record_circuit_state
+from app.utils.logger import Logger
+from config import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderRejected(Exception):
+    """The provider refused the message itself (4xx): sending it again cannot succeed."""
+
+
+def is_rejection(error: Exception) -> bool:
+    """Whether a provider call failed permanently: a 4xx other than 408 (timeout) and 429 (rate limited)."""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return False
+    status = error.response.status_code
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = settings.PROVIDER_BREAKER_FAILURES,
+        reset_timeout: float = settings.PROVIDER_BREAKER_RESET,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self) -> bool:
+        """Whether a call may go through now. In half-open state only one probe at a time is allowed."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        now = self._clock()
+        # A probe that never reported back (cancelled) does not block the breaker forever
+        if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+            return False
+        self._probe_started = now
+        return True
+
+    def release(self):
+        """Give back a probe slot taken by `allow()` without a result (the call was never made, or did not count)."""
+        self._probe_started = None
+
+    def record_success(self):
+        if self._opened_at is not None:
+            Logger.info(f"Circuit {self.name} closed")
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        record_circuit_state(self.name, CLOSED)
+
+    def record_failure(self):
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                Logger.warning(f"Circuit {self.name} opened after {self._failures} consecutive failures")
+            # Opened, or a half-open probe failed: wait another full period
+            self._opened_at = self._clock()
+            self._probe_started = None
+            record_circuit_state(self.name, OPEN)
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+
+def get_breaker(provider: str, channel: str) -> CircuitBreaker:
+    key = (provider, channel)
+    if key not in _breakers:
+        _breakers[key] = CircuitBreaker(f"{provider}/{channel}")
+    return _breakers[key]
+
+
+def backoff_delay(attempt: int, base: float = settings.PROVIDER_RETRY_BASE_DELAY, cap: float = settings.PROVIDER_RETRY_MAX_DELAY) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
@@ -0,0 +1,179 @@
+"""
+Access-token revocation.
+
+Tokens can be revoked one by one (by `jti`) or per user ("every token issued
+before now"). The denylist lives in Redis, with each entry kept only as long as
+the tokens it covers can still be valid:
+
+    revoked:jti:<jti>     until the token's own expiry
+    revoked:user:<id>     cutoff timestamp, for ACCESS_TOKEN_EXPIRE_MINUTES
+
+Every worker mirrors the denylist in an in-process Bloom filter, kept current by
+a pub/sub listener and rebuilt from Redis periodically (the filter cannot drop
+expired entries). A token that misses the filter is not revoked, so the common
+case costs no Redis round trip; a hit is confirmed in Redis, since Bloom filters
+have false positives. Until the listener is in sync (startup, reconnects) every
+check goes to Redis.
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from redis.asyncio import Redis
+
+from app.lib.cache import redis_client
+from app.schemas.schemas import TokenData
+from app.utils.errors import ServiceUnavailable
+from app.utils.logger import Logger
+from config import settings
+
+REVOCATION_CHANNEL = "auth:revoked"
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter sized for `capacity` items at `error_rate` false positives."""
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: two 64-bit halves of one digest give all k positions
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    def __init__(
+        self,
+        redis: Redis = None,
+        capacity: int = settings.REVOCATION_BLOOM_CAPACITY,
+        error_rate: float = settings.REVOCATION_BLOOM_ERROR_RATE,
+        rebuild_interval: float = settings.REVOCATION_REBUILD_INTERVAL,
+    ):
+        self.redis = redis or redis_client
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._next_rebuild = 0.0
+        # False until the filter mirrors Redis; checks then always go to Redis
+        self.synced = False
+
+    # ================== REVOKING ==================
+
+    async def revoke_token(self, jti: str, expires_at: datetime):
+        """Revoke one access token until it expires anyway."""
+        ttl = max(math.ceil(expires_at.timestamp() - time.time()), 1)
+        await self._revoke(f"jti:{jti}", "1", ttl)
+
+    async def revoke_user(self, user_id: UUID, before: Optional[float] = None):
+        """Revoke every access token of `user_id` issued before `before` (default: now)."""
+        cutoff = time.time() if before is None else before
+        await self._revoke(f"user:{user_id}", repr(cutoff), settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+    async def _revoke(self, entry: str, value: str, ttl: int):
+        self._bloom.add(entry)
+        try:
+            await self.redis.set(f"revoked:{entry}", value, ex=ttl)
+            await self.redis.publish(REVOCATION_CHANNEL, entry)
+        except Exception as e:
+            Logger.warning(f"Failed to revoke {entry}: {e}")
+            raise ServiceUnavailable("Token revocation is temporarily unavailable")
+
+    # ================== CHECKING ==================
+
+    async def is_revoked(self, token: TokenData) -> bool:
+        jti_entry = f"jti:{token.jti}" if token.jti else None
+        user_entry = f"user:{token.id}"
+        if self.synced and user_entry not in self._bloom and (jti_entry is None or jti_entry not in self._bloom):
+            return False
+
+        keys = [f"revoked:{user_entry}"] + ([f"revoked:{jti_entry}"] if jti_entry else [])
+        try:
+            cutoff, *jti_revoked = await self.redis.mget(keys)
+        except Exception as e:
+            Logger.warning(f"Failed to check token revocation: {e}")
+            # Fail open, like the rate limits
+            return False
+
+        if any(jti_revoked):
+            return True
+        issued_at = token.issued_at.timestamp() if token.issued_at else 0.0
+        return cutoff is not None and issued_at < float(cutoff)
+
+    # ================== SYNC ==================
+
+    async def rebuild(self):
+        """Replace the filter with the entries currently in Redis."""
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        async for key in self.redis.scan_iter(match="revoked:*", count=1000):
+            bloom.add(key[len("revoked:"):])
+        self._bloom = bloom
+        self._next_rebuild = time.monotonic() + self.rebuild_interval
+
+    async def listen(self, retry_delay: float = 1.0):
+        """Keep the filter in sync with other workers until cancelled."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                # Subscribe before loading, so nothing revoked in between is missed
+                await pubsub.subscribe(REVOCATION_CHANNEL)
+                await self.rebuild()
+                self.synced = True
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message:
+                        self._bloom.add(message["data"])
+                    if time.monotonic() >= self._next_rebuild:
+                        await self.rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.synced = False
+                Logger.warning(f"Revocation listener disconnected: {e}")
+                await asyncio.sleep(retry_delay)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+# Global instance
+revocations = RevocationList()
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+def start_revocation_listener():
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(revocations.listen())
+
+
+async def stop_revocation_listener():
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+    revocations.synced = False
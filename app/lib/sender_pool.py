@@ -0,0 +1,114 @@
+"""
+Pools of sender identities (Twilio numbers, email addresses) per channel.
+
+Throughput is capped per sending number, so spreading sends over several numbers
+scales it. For each send the pool picks a sender:
+
+- among healthy senders only: each has its own circuit breaker, so a number
+  that keeps failing (blocked, deregistered) drops out of rotation and is
+  probed again after PROVIDER_BREAKER_RESET seconds. Only provider and
+  transport failures count: a message the provider rejected (`ProviderRejected`,
+  e.g. a bad recipient) says nothing about the sender;
+- preferring numbers in the recipient's country (by calling code), when the
+  pool has any;
+- by SENDER_SELECTION: `least_loaded` picks the sender whose throttle bucket
+  frees up first, `sticky` keeps each recipient on the same number (rendezvous
+  hashing, so losing a number only moves that number's recipients).
+
+Configure the numbers as comma-separated lists in TWILIO_PHONE_NUMBERS and
+TWILIO_WHATSAPP_NUMBERS (default: the single TWILIO_PHONE_NUMBER and
+TWILIO_WHATSAPP_NUMBER).
+"""
+
+import hashlib
+from typing import List, Optional, Sequence
+
+from app.lib.metrics import record_sender_send
+from app.lib.resilience import OPEN, CircuitBreaker, get_breaker
+from app.lib.throttle import OutboundThrottle, outbound_throttle
+from config import settings
+
+LEAST_LOADED = "least_loaded"
+STICKY = "sticky"
+
+# ITU calling codes of one and two digits; every other code has three. Codes are prefix-free.
+_ONE_DIGIT_CODES = {"1", "7"}
+_TWO_DIGIT_CODES = {
+    "20", "27", "30", "31", "32", "33", "34", "36", "39", "40", "41", "43", "44", "45", "46", "47", "48", "49",
+    "51", "52", "53", "54", "55", "56", "57", "58", "60", "61", "62", "63", "64", "65", "66",
+    "81", "82", "84", "86", "90", "91", "92", "93", "94", "95", "98",
+}
+
+
+def calling_code(number: str) -> Optional[str]:
+    """Country calling code of an E.164 number (`+44...` -> `44`), or None for other addresses."""
+    if not number.startswith("+"):
+        return None
+    digits = number[1:]
+    for length, codes in ((1, _ONE_DIGIT_CODES), (2, _TWO_DIGIT_CODES)):
+        if digits[:length] in codes:
+            return digits[:length]
+    return digits[:3] or None
+
+
+def parse_senders(value: str) -> List[str]:
+    return [sender.strip() for sender in value.split(",") if sender.strip()]
+
+
+class SenderPool:
+    def __init__(
+        self,
+        provider: str,
+        channel: str,
+        senders: Sequence[str],
+        strategy: str = settings.SENDER_SELECTION,
+        throttle: OutboundThrottle = None,
+    ):
+        if strategy not in (LEAST_LOADED, STICKY):
+            raise ValueError(f"Unknown sender selection strategy: {strategy}")
+        self.provider = provider
+        self.channel = channel
+        self.senders = list(senders)
+        self.strategy = strategy
+        self.throttle = throttle or outbound_throttle
+
+    def bucket(self, sender: str) -> str:
+        """The sender's id in the outbound throttle."""
+        return f"{self.channel}:{sender}"
+
+    def breaker(self, sender: str) -> CircuitBreaker:
+        return get_breaker(self.provider, f"sender:{self.bucket(sender)}")
+
+    def healthy(self) -> List[str]:
+        return [sender for sender in self.senders if self.breaker(sender).state != OPEN]
+
+    async def _ordered(self, candidates: List[str], to: str) -> List[str]:
+        if self.strategy == STICKY:
+            return sorted(candidates, key=lambda sender: hashlib.sha256(f"{to}|{sender}".encode()).digest(), reverse=True)
+        next_free = await self.throttle.next_free(self.provider, [self.bucket(sender) for sender in candidates])
+        return [sender for _, _, sender in sorted(zip(next_free, range(len(candidates)), candidates))]
+
+    async def choose(self, to: str) -> Optional[str]:
+        """The sender for a message to `to`, or None when no sender is healthy."""
+        candidates = self.healthy()
+        if not candidates:
+            return None
+        code = calling_code(to)
+        local = [sender for sender in candidates if code and calling_code(sender) == code]
+        for sender in await self._ordered(local or candidates, to):
+            # Claims the probe slot of a recovering sender
+            if self.breaker(sender).allow():
+                return sender
+        return None
+
+    def release(self, sender: str):
+        """Give back a probe slot claimed by `choose` when the send was not made, or failed for reasons unrelated to the sender."""
+        self.breaker(sender).release()
+
+    def record(self, sender: str, sent: bool):
+        breaker = self.breaker(sender)
+        if sent:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        record_sender_send(self.provider, self.bucket(sender), "sent" if sent else "failed")
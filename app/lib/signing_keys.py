@@ -0,0 +1,113 @@
+"""
+Access-token signing keys, selected by `kid`.
+
+Keys are PEM files in JWT_KEYS_DIR named `<kid>.pem`. A private key can sign and
+verify; a public key only verifies (tokens issued before a rotation). The
+algorithm follows the key type: Ed25519 -> EdDSA, EC P-256 -> ES256, RSA -> RS256.
+JWT_ACTIVE_KID picks the signing key (optional when there is a single private key).
+
+Public keys are published at `/.well-known/jwks.json`, so gateways can verify
+tokens locally. Rotating without downtime:
+
+1. Add the new private key next to the current one. It now shows up in the JWKS.
+2. Once gateway JWKS caches have refreshed (JWKS_MAX_AGE), set JWT_ACTIVE_KID to
+   the new key and restart workers one by one.
+3. Replace the old private key with its public half. Delete it once the last
+   token it signed has expired (ACCESS_TOKEN_EXPIRE_MINUTES).
+
+Without JWT_KEYS_DIR, tokens are signed with SECRET_KEY/ALGORITHM as before and
+carry no `kid`. Tokens without a `kid` are always checked against SECRET_KEY, so
+tokens issued before switching to asymmetric keys stay valid until they expire.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+from jwt import get_algorithm_by_name
+
+from config import settings
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    kid: Optional[str]
+    algorithm: str
+    verifying_key: Any
+    signing_key: Any = None  # None for verification-only keys
+
+    @property
+    def can_sign(self) -> bool:
+        return self.signing_key is not None
+
+    def public_jwk(self) -> Dict[str, Any]:
+        jwk = get_algorithm_by_name(self.algorithm).to_jwk(self.verifying_key, as_dict=True)
+        jwk.update({"kid": self.kid, "alg": self.algorithm, "use": "sig"})
+        return jwk
+
+
+def _algorithm_for(public_key) -> str:
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "EdDSA"
+    if isinstance(public_key, ec.EllipticCurvePublicKey) and isinstance(public_key.curve, ec.SECP256R1):
+        return "ES256"
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return "RS256"
+    raise ValueError(f"Unsupported signing key type: {type(public_key).__name__}")
+
+
+def load_pem_key(kid: str, pem: bytes) -> SigningKey:
+    if b"PRIVATE KEY" in pem:
+        private_key = load_pem_private_key(pem, password=None)
+        public_key = private_key.public_key()
+    else:
+        private_key = None
+        public_key = load_pem_public_key(pem)
+    return SigningKey(kid=kid, algorithm=_algorithm_for(public_key), verifying_key=public_key, signing_key=private_key)
+
+
+class KeySet:
+    """The active signing key plus every key accepted for verification."""
+
+    def __init__(self, keys: Dict[str, SigningKey], active_kid: Optional[str] = None, legacy: Optional[SigningKey] = None):
+        self.keys = keys
+        self.legacy = legacy
+        if active_kid:
+            if active_kid not in keys or not keys[active_kid].can_sign:
+                raise ValueError(f"JWT_ACTIVE_KID {active_kid!r} is not a private key in the key set")
+            self.active = keys[active_kid]
+        else:
+            private = [key for key in keys.values() if key.can_sign]
+            if len(private) > 1:
+                raise ValueError("Several private signing keys found: set JWT_ACTIVE_KID")
+            self.active = private[0] if private else legacy
+        if self.active is None:
+            raise ValueError("No signing key available")
+
+        # Built once: the endpoint serves these bytes as-is
+        self.jwks = json.dumps({"keys": [key.public_jwk() for key in keys.values()]}, sort_keys=True).encode()
+        self.jwks_etag = '"' + hashlib.sha256(self.jwks).hexdigest()[:32] + '"'
+
+    def verification_key(self, kid: Optional[str]) -> Optional[SigningKey]:
+        if kid is None:
+            return self.legacy
+        return self.keys.get(kid)
+
+
+def load_key_set(keys_dir: str = settings.JWT_KEYS_DIR, active_kid: str = settings.JWT_ACTIVE_KID) -> KeySet:
+    legacy = SigningKey(kid=None, algorithm=settings.ALGORITHM, verifying_key=settings.SECRET_KEY, signing_key=settings.SECRET_KEY)
+    keys = {}
+    if keys_dir:
+        for filename in sorted(os.listdir(keys_dir)):
+            if filename.endswith(".pem"):
+                kid = filename[: -len(".pem")]
+                with open(os.path.join(keys_dir, filename), "rb") as f:
+                    keys[kid] = load_pem_key(kid, f.read())
+    return KeySet(keys, active_kid or None, legacy)
+
+
+signing_keys = load_key_set()
@@ -0,0 +1,128 @@
+"""
+Outbound send throttling shared by every worker.
+
+Providers cap throughput per sending number (Twilio long codes send about one
+message per second) and per account; sending faster only buys 429s. Before each
+send the delivery worker takes a token from the bucket of its sender and of its
+provider, in one atomic Redis round trip (GCRA, like the route rate limits):
+
+    throttle:sender:<provider>:<sender>   <provider>_SENDER_RATE per second
+    throttle:provider:<provider>          <provider>_RATE per second
+
+When either bucket is empty nothing is consumed and the sender waits until both
+have a token, never past the code's deadline. Queued deliveries wait at most
+DELIVERY_THROTTLE_WAIT; past that `deliver` raises `Throttled` and the entry goes
+back to the end of its app's stream, so other apps' codes are sent meanwhile. Each bucket allows a burst of one
+second's worth of sends. A rate of 0 disables that bucket. If Redis is
+unavailable sends are not throttled.
+"""
+
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from app.lib.cache import redis_client
+from app.lib.metrics import record_throttled
+from app.utils.logger import Logger
+from config import settings
+
+# KEYS: bucket TAT keys; ARGV: interval (ms) and burst for each key, in order.
+# Takes one token from every bucket, or none; returns the wait (ms) until all have one.
+THROTTLE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local wait = 0
+local tats = {}
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local tat = tonumber(redis.call('GET', key)) or now
+    if tat < now then
+        tat = now
+    end
+    tats[i] = tat + interval
+    local allow_at = tats[i] - burst * interval
+    if allow_at - now > wait then
+        wait = allow_at - now
+    end
+end
+if wait > 0 then
+    return math.ceil(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, tostring(tats[i]), 'PX', math.ceil(tats[i] - now))
+end
+return 0
+"""
+
+
+
+class Throttled(Exception):
+    """No send capacity within the caller's wait; the send can be tried again later."""
+
+
+# Messages per second per sending number, and per provider account
+RATES = {
+    "twilio": (settings.TWILIO_SENDER_RATE, settings.TWILIO_RATE),
+    "resend": (settings.RESEND_SENDER_RATE, settings.RESEND_RATE),
+}
+
+
+class OutboundThrottle:
+    def __init__(self, redis: Redis = None, rates: dict = None):
+        self.redis = redis or redis_client
+        self.rates = rates or RATES
+        self._script = None
+
+    @staticmethod
+    def _sender_key(provider: str, sender: str) -> str:
+        return f"throttle:sender:{provider}:{sender}"
+
+    def buckets(self, provider: str, sender: str) -> List[Tuple[str, float]]:
+        sender_rate, provider_rate = self.rates.get(provider, (0, 0))
+        buckets = [(self._sender_key(provider, sender), sender_rate), (f"throttle:provider:{provider}", provider_rate)]
+        return [(key, rate) for key, rate in buckets if rate > 0]
+
+    async def next_free(self, provider: str, senders: List[str]) -> List[float]:
+        """For each sender, when its bucket is next free (Redis clock, ms; 0 if idle). Lower is less loaded."""
+        try:
+            tats = await self.redis.mget([self._sender_key(provider, sender) for sender in senders])
+        except Exception as e:
+            Logger.warning(f"Failed to read sender load for {provider}: {e}")
+            return [0.0] * len(senders)
+        return [float(tat) if tat else 0.0 for tat in tats]
+
+    async def try_acquire(self, provider: str, sender: str) -> float:
+        """Take a token for one send if available. Returns 0 on success, else seconds to wait."""
+        buckets = self.buckets(provider, sender)
+        if not buckets:
+            return 0.0
+        args = []
+        for _, rate in buckets:
+            args += [1000 / rate, max(int(rate), 1)]
+        try:
+            if self._script is None:
+                self._script = self.redis.register_script(THROTTLE_SCRIPT)
+            wait_ms = await self._script(keys=[key for key, _ in buckets], args=args)
+        except Exception as e:
+            Logger.warning(f"Outbound throttle check failed for {provider}/{sender}: {e}")
+            # Fail open, like the route rate limits
+            return 0.0
+        return int(wait_ms) / 1000
+
+    async def acquire(self, provider: str, sender: str, deadline: Optional[float] = None) -> bool:
+        """Wait for a send token. Returns False if none is free before `deadline` (epoch seconds)."""
+        while True:
+            wait = await self.try_acquire(provider, sender)
+            if wait <= 0:
+                return True
+            record_throttled(provider)
+            if deadline is not None and time.time() + wait >= deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+# Global instance
+outbound_throttle = OutboundThrottle()
@@ -1,38 +1,50 @@
-from twilio.rest import Client
+import json
+from typing import Optional
 
 from config import settings
+from app.lib.metrics import record_provider_error
+from app.lib.provider_http import get_http_client
+from app.lib.resilience import ProviderRejected, is_rejection
+from app.utils.timing import timed
 
 account_sid = settings.TWILIO_ACCOUNT_SID
 auth_token = settings.TWILIO_AUTH_TOKEN
 twilio_phone_number = settings.TWILIO_PHONE_NUMBER
 twilio_whatsapp_number = settings.TWILIO_WHATSAPP_NUMBER
 twilio_whatsapp_content_sid = settings.TWILIO_WHATSAPP_CONTENT_SID
-client = Client(username=account_sid, password=auth_token)
+messages_url = f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json"
 
-def send_sms(to: str, body: str):
+async def create_message(**params) -> dict:
+    """POST to Twilio's Messages API on the shared pooled client. Returns the created message."""
+    with timed("provider"):
+        response = await get_http_client().post(messages_url, data=params, auth=(account_sid, auth_token))
+    response.raise_for_status()
+    return response.json()
+
+async def send_sms(to: str, body: str, from_: Optional[str] = None):
     try:
-        message = client.messages.create(
-            body=body,
-            from_=twilio_phone_number,
-            to=to
-        )
-        return message
+        return await create_message(Body=body, From=from_ or twilio_phone_number, To=to)
     except Exception as e:
-        # Log and return None so callers can translate to InternalError via require(...)
+        # Log and return None so callers can retry (ProviderRejected when retrying cannot help)
         from app.utils.logger import Logger
         Logger.error(f"Twilio send_sms failed: {e}")
+        record_provider_error("twilio", "sms")
+        if is_rejection(e):
+            raise ProviderRejected(f"Twilio rejected the SMS: {e}") from e
         return None
 
-def send_whatsapp(to: str, code: str):
+async def send_whatsapp(to: str, code: str, from_: Optional[str] = None):
     try:
-        message = client.messages.create(
-            content_variables='{"1": "'+code+'"}',
-            content_sid=twilio_whatsapp_content_sid,
-            from_="whatsapp:" + twilio_whatsapp_number,
-            to="whatsapp:" + to,
+        return await create_message(
+            ContentVariables=json.dumps({"1": code}),
+            ContentSid=twilio_whatsapp_content_sid,
+            From="whatsapp:" + (from_ or twilio_whatsapp_number),
+            To="whatsapp:" + to,
         )
-        return message
     except Exception as e:
         from app.utils.logger import Logger
         Logger.error(f"Twilio send_whatsapp failed: {e}")
+        record_provider_error("twilio", "whatsapp")
+        if is_rejection(e):
+            raise ProviderRejected(f"Twilio rejected the WhatsApp message: {e}") from e
         return None
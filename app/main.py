@@ -2,15 +2,20 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from app.utils.middlewares import CreateStateMiddleware
+from app.utils.middlewares import CreateStateMiddleware, MetricsMiddleware
 from config import settings
 from .models.clean_and_seed_data import drop_database, seed_data
 from .routes import codeRouter, authRouter, appRouter, otpRouter
-from .routes import healthRouter
+from .routes import healthRouter, metricsRouter, jwksRouter
 from .models.db import db
 from .utils.logger import Logger
 from app.utils.exceptionHandler import fastapi_exception_handler, ApiException
 from app.lib.cache import redis_client, close_redis
+from app.lib.jwt import password_hasher
+from app.lib.model_cache import start_invalidation_listener, stop_invalidation_listener
+from app.lib.revocation import start_revocation_listener, stop_revocation_listener
+from app.lib.delivery import start_delivery_workers, stop_delivery_workers
+from app.lib.provider_http import close_http_client
 
 ENV = settings.ENV
 is_dev = ENV == "dev"
@@ -20,26 +25,43 @@ async def lifespan(app: FastAPI):
     try:
         Logger.warning("You are running in " + ENV + " mode.")
         if is_dev:
-            drop_database()
+            await drop_database()
 
-        db.init_db()
+        await db.init_db()
 
         if is_dev:
-            seed_data()
+            await seed_data()
+
+        if settings.PASSWORD_HASH_TARGET_MS > 0:
+            await password_hasher.calibrate(settings.PASSWORD_HASH_TARGET_MS)
         # try pinging redis at startup (optional)
         try:
             await redis_client.ping()
             Logger.info("Redis is available")
         except Exception as e:
             Logger.warning(f"Redis not available at startup: {e}")
+        # Keeps this worker's App/User cache coherent with writes from other workers
+        start_invalidation_listener()
+        start_revocation_listener()
+        if settings.DELIVERY_IN_PROCESS:
+            start_delivery_workers(settings.DELIVERY_WORKERS)
     except Exception as e:
         Logger.error(e)
     yield
     # Shutdown/cleanup
+    await stop_invalidation_listener()
+    await stop_revocation_listener()
+    await stop_delivery_workers()
+    await close_http_client()
     try:
         await close_redis()
     except Exception:
         pass
+    try:
+        await db.dispose()
+    except Exception:
+        pass
+    password_hasher.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -56,6 +78,8 @@ app.add_middleware(
 )
 
 app.add_middleware(CreateStateMiddleware)
+# Added last so it is the outermost middleware and times the whole request
+app.add_middleware(MetricsMiddleware)
 
 
 routes = [codeRouter, otpRouter, authRouter, appRouter]
@@ -63,4 +87,6 @@ for route in routes:
     app.include_router(route.router, prefix="/api")
 
 # health router (it already defines its own prefix)
-app.include_router(healthRouter.router)
\ No newline at end of file
+app.include_router(healthRouter.router)
+app.include_router(metricsRouter.router)
+app.include_router(jwksRouter.router)
\ No newline at end of file
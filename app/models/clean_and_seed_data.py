@@ -1,38 +1,33 @@
 import json
 import os
 
-from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel import SQLModel
+from app.models.db import db
 from app.models.tables import App, User, AuthService, Auth
-from config import settings
 from app.utils.logger import Logger
 from app.lib.otp import generate_secret
+from app.lib.api_keys import hash_api_key, parse_prefix
 
-DATABASE_URL = settings.DATABASE_URL
-engine = create_engine(DATABASE_URL)
 file_path = os.path.join(os.path.dirname(__file__), "seed_data.json")
 
 
-from sqlmodel import SQLModel
-from sqlalchemy import MetaData
-
-def drop_database():
-    with Session(engine) as session:
-        connection = session.connection()
+async def drop_database():
+    # Uses the shared engine (and its pool) instead of a dedicated one
+    async with db.engine.begin() as connection:
         Logger.info("Dropping database...")
         Logger.info("Setting session_replication_role to 'replica'.")
-        connection.exec_driver_sql("SET session_replication_role = 'replica';")
+        await connection.exec_driver_sql("SET session_replication_role = 'replica';")
         Logger.info("Dropping tables...")
-        SQLModel.metadata.drop_all(connection)
+        await connection.run_sync(SQLModel.metadata.drop_all)
         Logger.info("Setting session_replication_role to 'origin'.")
-        connection.exec_driver_sql("SET session_replication_role = 'origin';")
-        session.commit()
+        await connection.exec_driver_sql("SET session_replication_role = 'origin';")
         Logger.info("Database dropped successfully.")
 
 
 
-def seed_data():
+async def seed_data():
     Logger.info("Seeding database...")
-    with Session(engine) as session:
+    async with db.session() as session:
         Logger.info("Getting data...")
         with open(file_path) as file:
             data = json.load(file)
@@ -44,10 +39,14 @@ def seed_data():
                 Logger.info("Adding user: ", user["username"])
                 session.add(User(**user))
             Logger.info("Users added successfully.")
-            session.commit()
+            await session.commit()
             Logger.info("Adding apps...")
             for app in data["apps"]:
                 Logger.info("Adding app: ", app["name"])
+                # Seed keys are stored like real ones: prefix plus keyed hash
+                api_key = app.pop("api_key")
+                app["api_key_prefix"] = parse_prefix(api_key)
+                app["api_key_secret"] = hash_api_key(api_key)
                 session.add(App(**app))
             Logger.info("Apps added successfully.")
 
@@ -64,4 +63,4 @@ def seed_data():
                 session.add(AuthService(**service))
             Logger.info("Services added successfully.")
 
-        session.commit()
+        await session.commit()
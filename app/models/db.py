@@ -1,37 +1,146 @@
 from config import settings
 DATABASE_URL = settings.DATABASE_URL
 from .tables import User, AuthService, Auth, App
-from sqlmodel import SQLModel, create_engine, Session
-from contextlib import contextmanager
+from .migrations import upgrade
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+import time
 from app.utils.logger import Logger
+from app.utils import timing
+
+# Map sync driver URLs to their asyncio counterparts so existing .env files keep working
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(database_url: str) -> str:
+    scheme, sep, rest = database_url.partition("://")
+    if not sep:
+        return database_url
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+class PoolMetrics:
+    """Checkout counters for the connection pool (wait times in seconds)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, wait: float):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        checkouts = self.checkouts or 1
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_total / checkouts * 1000, 2),
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waits (including connect/pre-ping)."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        wait = time.perf_counter() - start
+        pool_metrics.observe(wait)
+        timing.record("db_pool", wait)
+        return connection
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing.record("db", time.perf_counter() - conn.info["query_start"].pop())
+
 
 class DB:
     def __init__(self, database_url: str = None):
-        self.database_url = database_url
-        self.engine = create_engine(self.database_url)
+        self.database_url = to_async_url(database_url)
+        self.engine = create_async_engine(
+            self.database_url,
+            poolclass=InstrumentedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+        event.listen(self.engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(self.engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        # expire_on_commit=False: committed records are returned to the routes and
+        # must not trigger lazy loads (which are not allowed under asyncio)
+        self.session_factory = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
 
-    def create_db_and_tables(self):
-        SQLModel.metadata.create_all(self.engine)
+    async def create_db_and_tables(self):
+        async with self.engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+            # Existing tables get the columns added since they were created
+            return await connection.run_sync(upgrade)
 
-    def init_db(self):
+    async def init_db(self):
         Logger.info("Creating tables on the database.")
-        self.create_db_and_tables()
+        added = await self.create_db_and_tables()
+        if added:
+            Logger.info(f"Added columns: {', '.join(added)}")
         Logger.info("Tables created successfully or already exist.")
 
-    @contextmanager
-    def session(self):
-        Logger.info("Creating session.")
-        session = Session(self.engine)
+    @asynccontextmanager
+    async def session(self):
+        Logger.debug("Creating session.")
+        session = self.session_factory()
         try:
             yield session
         finally:
-            Logger.info("Closing session.")
-            session.close()
+            Logger.debug("Closing session.")
+            await session.close()
+
+    async def dispose(self):
+        await self.engine.dispose()
+
+    def pool_status(self) -> Dict[str, Any]:
+        pool = self.engine.sync_engine.pool
+        return {
+            "size": pool.size(),
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+            **pool_metrics.snapshot(),
+        }
 
 # global instance of DB
 db = DB(DATABASE_URL)
 
-def get_session():
+async def get_session():
     # Creates a new session for each request.
-    with db.session() as session:
+    async with db.session() as session:
         yield session
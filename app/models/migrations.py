@@ -0,0 +1,68 @@
+"""
+Upgrades for databases created by an earlier release.
+
+`SQLModel.metadata.create_all` creates missing tables but never alters existing
+ones, so columns added to a table later are applied here, on startup right
+after it (see `DB.create_db_and_tables`). Every step checks the live schema
+first and does nothing once applied. The same SQL is listed in the README for
+running by hand.
+"""
+
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from app.lib.api_keys import format_api_key, generate_prefix, hash_api_key
+from app.lib.otp import generate_secret
+from app.utils.logger import Logger
+
+# (table, column, statements adding it), in release order
+ADDED_COLUMNS: List[Tuple[str, str, List[str]]] = [
+    ("app", "api_key_prefix", [
+        "ALTER TABLE app ADD COLUMN api_key_prefix VARCHAR(16)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_app_api_key_prefix ON app (api_key_prefix)",
+    ]),
+    # Existing enrollments keep sending over the requested channel only
+    ("authservice", "failover", [
+        "ALTER TABLE authservice ADD COLUMN failover BOOLEAN NOT NULL DEFAULT false",
+    ]),
+]
+
+
+def reissue_unprefixed_api_keys(connection: Connection) -> int:
+    """
+    Give apps created before prefixed API keys a new key. Returns how many.
+
+    Their `api_key_secret` still holds the old plaintext key, which nothing
+    accepts any more. It is replaced by the hash of a random key that is not
+    kept, so owners get a working key from the reset endpoint.
+    """
+    rows = connection.execute(text("SELECT id FROM app WHERE api_key_prefix IS NULL")).all()
+    for (app_id,) in rows:
+        prefix = generate_prefix()
+        connection.execute(
+            text("UPDATE app SET api_key_prefix = :prefix, api_key_secret = :secret WHERE id = :id"),
+            {"prefix": prefix, "secret": hash_api_key(format_api_key(prefix, generate_secret())), "id": app_id},
+        )
+    if rows:
+        Logger.warning(f"Reissued the API keys of {len(rows)} apps created before prefixed keys; their owners must reset them")
+    return len(rows)
+
+
+BACKFILLS: List[Callable[[Connection], int]] = [reissue_unprefixed_api_keys]
+
+
+def upgrade(connection: Connection) -> List[str]:
+    """Apply the missing columns and backfills. Returns the `table.column`s added."""
+    inspector = inspect(connection)
+    added = []
+    for table, column, statements in ADDED_COLUMNS:
+        if not inspector.has_table(table) or column in {existing["name"] for existing in inspector.get_columns(table)}:
+            continue
+        for statement in statements:
+            connection.execute(text(statement))
+        added.append(f"{table}.{column}")
+    for backfill in BACKFILLS:
+        backfill(connection)
+    return added
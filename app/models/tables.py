@@ -18,7 +18,9 @@ class User(SQLModel, table=True):
 class App(SQLModel, table=True):
     id: UUID = Field(default_factory=lambda: uuid.uuid4(), primary_key=True)
     name: str = Field(index=True, max_length=100)
+    # Keyed hash of the API key (see app/lib/api_keys.py); the prefix finds the app
     api_key_secret: str = Field(index=True, max_length=256)
+    api_key_prefix: Optional[str] = Field(default=None, index=True, unique=True, max_length=16)
     owner_id: UUID = Field(foreign_key="user.id", unique=True)
     auth_services: List["AuthService"] = Relationship(back_populates="app")
     created_at: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -31,6 +33,8 @@ class AuthService(SQLModel, table=True):
     otp_method: OtpMethod = Field(max_length=50)
     otp_secret: str = Field(max_length=100)
     enabled: bool = Field(default=False, index=True)
+    # Send codes through the other channels (recovery method first) when the requested one fails
+    failover: bool = Field(default=False)
     user: Optional[User] = Relationship(back_populates="auth_services")
     app: Optional[App] = Relationship(back_populates="auth_services")
     expiration_date: Optional[datetime] = Field(default_factory=lambda: datetime.now(timezone.utc) + timedelta(days=365))
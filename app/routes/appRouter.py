@@ -1,5 +1,5 @@
 from fastapi import APIRouter, status, Depends, Request
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from uuid import UUID
 
 from app.models.db import get_session
@@ -7,58 +7,54 @@ from app.utils.decorators import RequiresAuthentication
 import app.schemas.schemas as schemas
 from app.controllers import appController
 from app.utils.exceptionHandler import ApiException
+from app.utils.errors import require, NotFound
 
-router = APIRouter(prefix="/app", tags=["app"])
+router = APIRouter(prefix="/app", tags=["app"], dependencies=[Depends(RequiresAuthentication)])
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-@RequiresAuthentication
-def create_app(body: schemas.CreateApp, request: Request, session: Session = Depends(get_session)):
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.AppWithApiKey)
+async def create_app(body: schemas.CreateApp, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
 
-    new_app = appController.create_app(user_id, body.name, session)
-    return new_app
+    new_app, api_key = await appController.create_app(user_id, body.name, session)
+    return {**new_app.model_dump(), "api_key": api_key}
 
-@router.get("/{app_id}", status_code=status.HTTP_200_OK)
-@RequiresAuthentication
-def get_app(app_id: UUID, request: Request, session: Session = Depends(get_session)):
-    app = appController.get_app_by_id(app_id, session)
+@router.get("/{app_id}", status_code=status.HTTP_200_OK, response_model=schemas.AppResponse)
+async def get_app(app_id: UUID, request: Request, session: AsyncSession = Depends(get_session)):
+    app = await appController.get_app_by_id(app_id, session)
+    require(app, NotFound("App not found"))
     return app
 
-@router.put("/{app_id}", status_code=status.HTTP_200_OK)
-@RequiresAuthentication
-def update_app(app_id: UUID, body: schemas.UpdateApp, request: Request, session: Session = Depends(get_session)):
+@router.put("/{app_id}", status_code=status.HTTP_200_OK, response_model=schemas.AppResponse)
+async def update_app(app_id: UUID, body: schemas.UpdateApp, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
-    app = appController.update_app_name(app_id, user_id, body.name, session)
+    app = await appController.update_app_name(app_id, user_id, body.name, session)
     return app
 
-@router.delete("/{app_id}", status_code=status.HTTP_200_OK)
-@RequiresAuthentication
-def delete_app(app_id: UUID, request: Request, session: Session = Depends(get_session)):
+@router.delete("/{app_id}", status_code=status.HTTP_200_OK, response_model=schemas.AppResponse)
+async def delete_app(app_id: UUID, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
 
-    app = appController.delete_app(user_id, app_id, session)
+    app = await appController.delete_app(user_id, app_id, session)
     return app
 
-@router.put("/{app_id}/api-key", status_code=status.HTTP_201_CREATED)
-@RequiresAuthentication
-def create_api_key(app_id: UUID, request: Request, session: Session = Depends(get_session)):
+@router.put("/{app_id}/api-key", status_code=status.HTTP_201_CREATED, response_model=schemas.AppWithApiKey)
+async def create_api_key(app_id: UUID, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
 
-    app = appController.reset_api_key_secret(app_id, user_id, session)
-    return app
+    app, api_key = await appController.reset_api_key_secret(app_id, user_id, session)
+    return {**app.model_dump(), "api_key": api_key}
 
-@router.get("/{app_id}/api-key", status_code=status.HTTP_200_OK)
-@RequiresAuthentication
-def get_api_key(app_id: UUID, request: Request, session: Session = Depends(get_session)):
+# The key itself cannot be read back, only its prefix
+@router.get("/{app_id}/api-key", status_code=status.HTTP_200_OK, response_model=schemas.AppResponse)
+async def get_api_key(app_id: UUID, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
 
-    app = appController.get_api_key_secret(app_id, user_id, session)
+    app = await appController.get_api_key_secret(app_id, user_id, session)
     return app
 
-@router.get("/{app_id}/users", status_code=status.HTTP_200_OK)
-@RequiresAuthentication
-def get_users( app_id: UUID, request: Request, session: Session = Depends(get_session)):
+@router.get("/{app_id}/users", status_code=status.HTTP_200_OK, response_model=list[schemas.AppResponse])
+async def get_users( app_id: UUID, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
 
-    app = appController.get_user_apps(user_id, app_id, session)
+    app = await appController.get_user_apps(user_id, app_id, session)
     return app
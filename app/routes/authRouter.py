@@ -1,12 +1,15 @@
-from fastapi import APIRouter, status, Depends
-from sqlmodel import Session
+from fastapi import APIRouter, status, Depends, Request
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.controllers import authController, userController
 from app.schemas import schemas
 from app.models.db import get_session
 from app.lib import jwt, oauth
+from app.lib.refresh_tokens import refresh_tokens
+from app.lib.revocation import revocations
+from app.utils.decorators import RequiresAuthentication
 from app.models.tables import User
-from app.utils.errors import require, NotFound, Conflict, InternalError, Unauthorized
+from app.utils.errors import require, NotFound, Conflict, InternalError, Unauthorized, BadRequest
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -14,14 +17,14 @@ router = APIRouter(prefix="/auth", tags=["auth"])
     "/", status_code=status.HTTP_201_CREATED,
     response_model=schemas.UserResponse
 )
-async def create_user(user: schemas.CreateUser, session: Session = Depends(get_session)):
-    user_exist = userController.user_exists(user.username, session)
+async def create_user(user: schemas.CreateUser, session: AsyncSession = Depends(get_session)):
+    user_exist = await userController.user_exists(user.username, session)
     require(not user_exist, Conflict("User already exists"))
 
-    password_hash = jwt.hash(user.password)
-    new_user: User = userController.create_user(user, session)
+    password_hash = await jwt.hash(user.password)
+    new_user: User = await userController.create_user(user, session)
     require(new_user, InternalError("Failed to create user"))
-    auth_record: bool = authController.create_auth_record(new_user, password_hash, session)
+    auth_record: bool = await authController.create_auth_record(new_user, password_hash, session)
     require(auth_record, InternalError("Failed to create auth record"))
     return new_user
 
@@ -29,17 +32,49 @@ async def create_user(user: schemas.CreateUser, session: Session = Depends(get_s
 @router.post("/login", response_model=schemas.Token)
 async def login(
     user_credentials: schemas.UserCredentials,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_session),
 ):
-    user = userController.get_user(user_credentials.username, db)
+    user = await userController.get_user(user_credentials.username, db)
     require(user, NotFound("User not found"))
 
-    auth_record = authController.get_auth_record(user.id, db)
-    verification = jwt.verify(user_credentials.password, auth_record.password_hash)
+    auth_record = await authController.get_auth_record(user.id, db)
+    verification, new_hash = await jwt.verify_and_update(user_credentials.password, auth_record.password_hash)
     require(verification, Unauthorized("Invalid credentials"))
 
+    # Transparently upgrade hashes made with an outdated scheme or cost
+    if new_hash:
+        await authController.update_password_hash(auth_record, new_hash, db)
+
     access_token = oauth.create_access_token(data={"user_id": str(user.id)})
-    return {"access_token": access_token, "token_type": "bearer"}
+    # Without Redis the login still succeeds, just without a refresh token
+    refresh_token = await refresh_tokens.issue(user.id)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@router.post("/refresh", response_model=schemas.Token)
+async def refresh(body: schemas.RefreshRequest):
+    # Redis only: no DB lookup or password hash
+    user_id, refresh_token = await refresh_tokens.rotate(body.refresh_token)
+    access_token = oauth.create_access_token(data={"user_id": user_id})
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@router.post("/logout", dependencies=[Depends(RequiresAuthentication)])
+async def logout(request: Request, body: schemas.LogoutRequest = None):
+    token: schemas.TokenData = request.state.token
+    require(token.jti, BadRequest("Token cannot be revoked"))
+    await revocations.revoke_token(token.jti, token.expiration_date)
+    if body and body.refresh_token:
+        await refresh_tokens.revoke(body.refresh_token, request.state.user_id)
+    return {"success": True}
+
+
+@router.post("/logout/all", dependencies=[Depends(RequiresAuthentication)])
+async def logout_all(request: Request):
+    """Revoke every access and refresh token of the user, on all devices."""
+    user_id = request.state.user_id
+    await revocations.revoke_user(user_id)
+    await refresh_tokens.revoke_user(user_id)
+    return {"success": True}
 
 @router.post("/recovery")
 async def recovery_auth():
@@ -1,208 +1,192 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
-from sqlmodel import Session
+import math
+import time
+
+from fastapi import APIRouter, Depends, Request, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
 from uuid import UUID
 
-from app.controllers.authServiceController import get_service_with_user_and_app
-from app.lib.twilio import send_sms, send_whatsapp
-from app.lib.resend import send_email, get_template
+from app.lib.delivery import delivery_queue, deliver_any, failover_routes, fan_out, SMS, WHATSAPP, EMAIL
 from app.models.db import get_session
 from app.controllers import authServiceController
-from app.lib.otp import generate_otp as generate_otp_code, verify_otp
+from app.lib.issuance import IssuedCode, code_issuer
+from app.lib.resilience import ProviderRejected
+from app.lib.otp import TOTP_INTERVAL, generate_otp as generate_otp_code, current_time_step, verify_otp_time_step
 from app.schemas import schemas
-from app.utils.decorators import RequiresAuthentication
-from app.utils.errors import require, NotFound, Unauthorized, InternalError
-from app.lib.cache import get_redis
+from app.utils.decorators import RequiresUserOrApp
+from app.utils.errors import require, NotFound, Unauthorized, InternalError, TooManyRequests
 from app.lib.redis_service import redis_service
+from app.lib.metrics import track_otp, record_rate_limited
+from app.lib.idempotency import idempotent
+from app.lib.rate_limit import RateLimit, RateLimitResult, SLIDING_WINDOW
+
+VERIFY_RATE_LIMIT = 10
 
-router = APIRouter(prefix="/code", tags=["code"])
+router = APIRouter(prefix="/code", tags=["code"], dependencies=[Depends(RequiresUserOrApp)])
 
-@router.get("/generate/{app_id}")
-@RequiresAuthentication
-async def generate_code(app_id: UUID, request: Request, session: Session = Depends(get_session), redis = Depends(get_redis)):
+# Limits are per user+app; sends use a sliding window so bursts at window edges can't double provider spend
+@router.get("/generate/{app_id}", dependencies=[Depends(RateLimit("generate", limit=5, window=60))])
+@track_otp("generate", "cache")
+async def generate_code(app_id: UUID, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
-    secret = authServiceController.get_secret(user_id, app_id, session)
-    require(secret, NotFound("User not found"))
-
-    # Rate limit: max 5 requests per minute per user+app
-    rate_key = f"rate:{user_id}:{app_id}"
-    try:
-        current = await redis.incr(rate_key)
-        if current == 1:
-            await redis.expire(rate_key, 60)
-    except Exception:
-        # If redis fails, don't completely block - fall back to permissive mode
-        current = 1
-
-    if current > 5:
-        raise HTTPException(status_code=429, detail="Too many requests")
-
-    otp = generate_otp_code(secret)
-
-    # store OTP in redis for short-lived verification (120 seconds)
-    otp_key = f"otp:{user_id}:{app_id}"
-    try:
-        await redis.setex(otp_key, 120, otp)
-    except Exception:
-        # ignore cache set errors - OTP still returned but not stored
-        pass
-
-    return {"code": otp}
-
-@router.post("/sms")
-@RequiresAuthentication
-async def send_sms_otp(body: schemas.BodyWithAppId, request: Request, session: Session = Depends(get_session), redis = Depends(get_redis)):
+    enrollment = await authServiceController.get_enrollment(user_id, app_id, session)
+    require(enrollment, NotFound("User not found"))
+
+    issued = await issue_code(enrollment, user_id, app_id)
+    return {"code": issued.code}
+
+async def issue_code(enrollment: schemas.Enrollment, user_id: UUID, app_id: UUID) -> IssuedCode:
+    """A fresh code (or the live one, for a quick re-send)."""
+    issued = await code_issuer.issue(user_id, app_id)
+    if issued is None:
+        # Redis unavailable: send the TOTP code instead, which /verify accepts through its fallback
+        return IssuedCode(code=generate_otp_code(enrollment.secret), nonce=None, ttl=TOTP_INTERVAL, reused=False)
+    return issued
+
+async def queue_delivery(channel: str, to: str, enrollment: schemas.Enrollment, user_id: UUID, app_id: UUID) -> dict:
+    # Issued (and verifiable) first: the code may reach the user only after a queue delay
+    issued = await issue_code(enrollment, user_id, app_id)
+    app_name = enrollment.app_name
+    deadline = time.time() + issued.ttl
+    routes = failover_routes(channel, to, enrollment)
+    delivery_id = None
+    if issued.nonce is not None:
+        # The queue carries the nonce, never the code
+        delivery_id = await delivery_queue.enqueue(
+            channel, to, app_name, issued.nonce, deadline=deadline, user_id=user_id, app_id=app_id, fallbacks=routes[1:]
+        )
+    if delivery_id is None:
+        # Queue unavailable (Redis down): send inline, as before the queue existed
+        try:
+            sent = await deliver_any(routes, app_name, issued.code, deadline=deadline)
+        except ProviderRejected:
+            sent = None
+        require(sent, InternalError(f"Error sending {channel} code"))
+    return {"success": True, "delivery_id": delivery_id}
+
+@router.post("/sms", status_code=202, dependencies=[Depends(RateLimit("sms", limit=3, window=60, algorithm=SLIDING_WINDOW, idempotent=True))])
+@idempotent("sms")
+@track_otp("send", "sms")
+async def send_sms_otp(body: schemas.BodyWithAppId, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
     app_id = body.app_id
 
-    # Rate limiting for SMS sending - max 3 per minute per user+app
-    sms_rate_key = f"sms_rate:{user_id}:{app_id}"
-    try:
-        current = await redis.incr(sms_rate_key)
-        if current == 1:
-            await redis.expire(sms_rate_key, 60)
-        if current > 3:
-            raise HTTPException(status_code=429, detail="Too many SMS requests")
-    except Exception:
-        # If redis fails, continue without rate limiting
-        pass
-
-    service = get_service_with_user_and_app(user_id, app_id, session)
-    secret = service.AuthService.secret
-    require(secret, NotFound("User not found"))
-    otp = generate_otp_code(secret)
-    require(otp, InternalError("Error generating OTP"))
-    phone_number = service.User.phone_number
+    enrollment = await authServiceController.get_enrollment(user_id, app_id, session)
+    require(enrollment, NotFound("User not found"))
+    phone_number = enrollment.phone_number
     require(phone_number, NotFound("Phone number not found"))
-    app_name = service.App.name
+    app_name = enrollment.app_name
     require(app_name, NotFound("App not found"))
 
-    message = send_sms(
-        to=phone_number,
-        body=f"Your verification code for {app_name} is: {otp}"
-    )
-    require(message, InternalError("Error sending SMS"))
-
-    return {"success": True}
+    return await queue_delivery(SMS, phone_number, enrollment, user_id, app_id)
 
-@router.post("/whatsapp")
-@RequiresAuthentication
-async def send_whatsapp_otp(body: schemas.BodyWithAppId, request: Request, session: Session = Depends(get_session), redis = Depends(get_redis)):
+@router.post("/whatsapp", status_code=202, dependencies=[Depends(RateLimit("whatsapp", limit=3, window=60, algorithm=SLIDING_WINDOW, idempotent=True))])
+@idempotent("whatsapp")
+@track_otp("send", "whatsapp")
+async def send_whatsapp_otp(body: schemas.BodyWithAppId, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
     app_id = body.app_id
 
     require(user_id and app_id, Unauthorized("Unauthorized"))
-    
-    # Rate limiting for WhatsApp sending - max 3 per minute per user+app
-    whatsapp_rate_key = f"whatsapp_rate:{user_id}:{app_id}"
-    try:
-        current = await redis.incr(whatsapp_rate_key)
-        if current == 1:
-            await redis.expire(whatsapp_rate_key, 60)
-        if current > 3:
-            raise HTTPException(status_code=429, detail="Too many WhatsApp requests")
-    except Exception:
-        # If redis fails, continue without rate limiting
-        pass
-    
-    service = get_service_with_user_and_app(user_id, app_id, session)
-    secret = service.AuthService.secret
-    require(secret, NotFound("User not found"))
-    otp = generate_otp_code(secret)
-    require(otp, InternalError("Error generating OTP"))
-    phone_number = service.User.phone_number
+
+    enrollment = await authServiceController.get_enrollment(user_id, app_id, session)
+    require(enrollment, NotFound("User not found"))
+    phone_number = enrollment.phone_number
     require(phone_number, NotFound("Phone number not found"))
-    message = send_whatsapp(
-        to=phone_number,
-        code=otp
-    )
-    require(message, InternalError("Error sending WhatsApp message"))
 
-    return {"success": True}
+    return await queue_delivery(WHATSAPP, phone_number, enrollment, user_id, app_id)
 
 
-@router.post("/email")
-@RequiresAuthentication
-async def send_email_otp(body: schemas.BodyWithAppId, request: Request, session: Session = Depends(get_session), redis = Depends(get_redis)):
+@router.post("/email", status_code=202, dependencies=[Depends(RateLimit("email", limit=5, window=60, algorithm=SLIDING_WINDOW, idempotent=True))])
+@idempotent("email")
+@track_otp("send", "email")
+async def send_email_otp(body: schemas.BodyWithAppId, request: Request, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
     app_id = body.app_id
 
     require(user_id and app_id, Unauthorized("Unauthorized"))
-    
-    # Rate limiting for email sending - max 5 per minute per user+app
-    email_rate_key = f"email_rate:{user_id}:{app_id}"
-    try:
-        current = await redis.incr(email_rate_key)
-        if current == 1:
-            await redis.expire(email_rate_key, 60)
-        if current > 5:
-            raise HTTPException(status_code=429, detail="Too many email requests")
-    except Exception:
-        # If redis fails, continue without rate limiting
-        pass
-    
-    service = get_service_with_user_and_app(user_id, app_id, session)
-    secret = service.AuthService.secret
-    require(secret, NotFound("User not found"))
-    otp = generate_otp_code(secret)
-    require(otp, InternalError("Error generating OTP"))
-    email = service.User.email
+
+    enrollment = await authServiceController.get_enrollment(user_id, app_id, session)
+    require(enrollment, NotFound("User not found"))
+    email = enrollment.email
     require(email, NotFound("Email not found"))
-    app_name = service.App.name
+    app_name = enrollment.app_name
     require(app_name, NotFound("App not found"))
 
-    response = send_email(
-        to=email,
-        subject=f"Your verification code for {app_name}",
-        body=get_template(app_name, otp)
-        
+    return await queue_delivery(EMAIL, email, enrollment, user_id, app_id)
+
+@router.post("/send", response_model=schemas.SendCodeResponse, dependencies=[Depends(RateLimit("send", limit=3, window=60, algorithm=SLIDING_WINDOW, idempotent=True))])
+@idempotent("send")
+@track_otp("send", "multi")
+async def send_code(body: schemas.SendCode, request: Request, session: AsyncSession = Depends(get_session)):
+    user_id = request.state.user_id
+    app_id = body.app_id
+
+    enrollment = await authServiceController.get_enrollment(user_id, app_id, session)
+    require(enrollment, NotFound("User not found"))
+
+    addresses = {SMS: enrollment.phone_number, WHATSAPP: enrollment.phone_number, EMAIL: enrollment.email}
+    channels = list(dict.fromkeys(body.channels))
+    missing = [channel for channel in channels if not addresses[channel]]
+    require(not missing, NotFound(f"No address for {', '.join(missing)}"))
+
+    # One code for every channel, sent concurrently rather than queued: the caller gets the results
+    issued = await issue_code(enrollment, user_id, app_id)
+    results = await fan_out(
+        [(channel, addresses[channel]) for channel in channels],
+        enrollment.app_name, issued.code, deadline=time.time() + issued.ttl, race=body.mode == "first",
     )
-    require(response, InternalError("Error sending email"))
+    delivered = [result for result in results if result["success"]]
+    require(delivered, InternalError("Error sending code", extra={"results": results}))
 
-    return {"success": True}
+    first = min(delivered, key=lambda result: result["elapsed_ms"])
+    return {"success": True, "channel": first["channel"], "results": results}
 
 @router.post("/verify")
-@RequiresAuthentication
-async def verify_code( body: schemas.VerifyOTP, request: Request, session: Session = Depends(get_session), redis = Depends(get_redis)):
+@track_otp("verify", "any")
+async def verify_code( body: schemas.VerifyOTP, request: Request, response: Response, session: AsyncSession = Depends(get_session)):
     user_id = request.state.user_id
     app_id = body.app_id
     otp = body.otp
 
     require(user_id and app_id and otp, Unauthorized("Unauthorized"))
-    
-    # Rate limiting for verification attempts - max 10 per minute per user+app
-    verify_rate_key = f"verify_rate:{user_id}:{app_id}"
-    try:
-        current = await redis.incr(verify_rate_key)
-        if current == 1:
-            await redis.expire(verify_rate_key, 60)
-        if current > 10:
-            raise HTTPException(status_code=429, detail="Too many verification attempts")
-    except Exception:
-        # If redis fails, continue without rate limiting
-        pass
-    
-    # Check if OTP was generated and stored in cache
-    otp_key = f"otp:{user_id}:{app_id}"
-    cached_otp = None
-    try:
-        cached_otp = await redis.get(otp_key)
-    except Exception:
-        # If redis fails, fall back to TOTP verification
-        pass
-    
-    # Verify against cached OTP first (if available), then fall back to TOTP
-    if cached_otp and cached_otp == otp:
-        # Valid cached OTP - remove it to prevent reuse
-        try:
-            await redis.delete(otp_key)
-        except Exception:
-            pass
+
+    # Rate limit (10/min per user+app), failed-attempt budget, replay check and
+    # consume-on-match of the issued code happen in one atomic Redis round trip,
+    # so a delivered code is verified without touching the database
+    now = time.time()
+    check = await redis_service.verify_and_consume_otp(
+        user_id, app_id, otp, rate_limit=VERIFY_RATE_LIMIT, time_step=current_time_step(now)
+    )
+    status = check["status"]
+    limit = RateLimitResult(
+        allowed=status != "rate_limited",
+        limit=VERIFY_RATE_LIMIT,
+        used=check["rate_used"],
+        reset_after=check["rate_reset"],
+        retry_after=check["retry_after"],
+    )
+    if status == "rate_limited":
+        record_rate_limited("verify")
+        raise TooManyRequests("Too many verification attempts", headers=limit.headers())
+    if status == "blocked":
+        raise TooManyRequests("Too many failed attempts", headers={"Retry-After": str(max(math.ceil(check["retry_after"]), 1))})
+    response.headers.update(limit.headers())
+    # Already accepted in this TOTP step: refused without touching the database
+    require(status != "replayed", Unauthorized("OTP already used"))
+
+    if status == "valid":
         return {"success": True}
-    
-    # Fall back to TOTP verification
-    secret = authServiceController.get_secret(user_id, app_id, session)
-    require(secret, NotFound("User not found"))
-    result = verify_otp(secret, otp)
-    require(result, Unauthorized("Invalid OTP"))
-
-    return {"success": True}
\ No newline at end of file
+
+    # Not the delivered code (or none is live, or Redis is unavailable): fall back to
+    # TOTP verification, for authenticator apps
+    enrollment = await authServiceController.get_enrollment(user_id, app_id, session)
+    require(enrollment, NotFound("User not found"))
+    time_step = verify_otp_time_step(enrollment.secret, otp, now)
+    if time_step is None:
+        # Counts the failure and spends one attempt of the live delivered code
+        await redis_service.record_failed_otp(user_id, app_id)
+    require(time_step is not None, Unauthorized("Invalid OTP"))
+    # Set-if-absent, so two concurrent requests cannot both accept the same code
+    require(await redis_service.claim_totp_step(user_id, app_id, time_step, otp), Unauthorized("OTP already used"))
+
+    return {"success": True}
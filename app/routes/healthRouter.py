@@ -44,27 +44,34 @@ async def _check_redis() -> dict:
     return {"ok": ok, "latency_ms": round(latency, 2)}
 
 
-def _check_db_sync() -> dict:
+async def _check_db() -> dict:
     start = time.perf_counter()
     try:
         # Use a very small work: open a connection and execute a lightweight query
-        with db.session() as session:
+        async with db.session() as session:
             # use select(1) to avoid SQLAlchemy textual SQL warnings
-            session.exec(select(1))
+            await session.exec(select(1))
         ok = True
     except Exception as e:
         Logger.warning(f"DB health check failed: {e}")
         ok = False
     latency = (time.perf_counter() - start) * 1000.0
-    return {"ok": ok, "latency_ms": round(latency, 2)}
+    return {"ok": ok, "latency_ms": round(latency, 2), "pool": _pool_status()}
+
+
+def _pool_status() -> dict | None:
+    try:
+        return db.pool_status()
+    except Exception as e:
+        Logger.warning(f"DB pool status unavailable: {e}")
+        return None
 
 
 @router.get("/", status_code=status.HTTP_200_OK, response_model=HealthResponse)
 async def health(response: Response):
     # Run checks concurrently
     redis_task = asyncio.create_task(_check_redis())
-    # Run database check in a thread because it uses sync DB session
-    db_task = asyncio.to_thread(_check_db_sync)
+    db_task = asyncio.create_task(_check_db())
 
     # gather
     res_redis, res_db = await asyncio.gather(redis_task, db_task)
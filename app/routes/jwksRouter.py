@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Request, Response
+
+from app.lib.signing_keys import signing_keys
+from config import settings
+
+router = APIRouter(tags=["auth"])
+
+
+@router.get("/.well-known/jwks.json")
+async def jwks(request: Request):
+    """Public keys for verifying access tokens; the body is built once per key set."""
+    headers = {"Cache-Control": f"public, max-age={settings.JWKS_MAX_AGE}", "ETag": signing_keys.jwks_etag}
+    if request.headers.get("If-None-Match") == signing_keys.jwks_etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=signing_keys.jwks, media_type="application/json", headers=headers)
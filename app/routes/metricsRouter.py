@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+
+from app.lib.metrics import render_latest
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    payload, content_type = render_latest()
+    return Response(content=payload, media_type=content_type)
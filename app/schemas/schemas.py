@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal, Optional
 from uuid import UUID
 from datetime import datetime
 
@@ -19,11 +19,21 @@ class UserResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    # Also revokes this refresh token's family when given
+    refresh_token: Optional[str] = None
 
 
 class TokenData(BaseModel):
     id: Optional[UUID]
     expiration_date: Optional[datetime]
+    jti: Optional[str] = None
+    issued_at: Optional[datetime] = None
 
 class UserCredentials(BaseModel):
     username: str
@@ -34,14 +44,35 @@ class OTPRegister(BaseModel):
     username: str
     otp_method: OtpMethod
     recovery_method: RecoveryMethod
+    # Opt in to sending codes through the other channels when the requested one is down
+    failover: bool = False
 
 class BodyWithAppId(BaseModel):
     app_id: UUID
 
+class SendCode(BaseModel):
+    app_id: UUID
+    channels: List[Literal["sms", "whatsapp", "email"]] = Field(min_length=1)
+    # "all": wait for every channel; "first": return on the first success and cancel the rest
+    mode: Literal["all", "first"] = "all"
+
+class ChannelResult(BaseModel):
+    channel: str
+    success: bool
+    elapsed_ms: Optional[float] = None
+    error: Optional[str] = None
+
+class SendCodeResponse(BaseModel):
+    success: bool
+    # The channel that delivered first
+    channel: str
+    results: List[ChannelResult]
+
 class RecoveryOTPData(BaseModel):
     app_id: UUID
     recovery_method: RecoveryMethod
     otp_method: OtpMethod
+    failover: Optional[bool] = None
 
 class CreateApp(BaseModel):
     name: str
@@ -49,6 +80,17 @@ class CreateApp(BaseModel):
 class UpdateApp(BaseModel):
     name: str
 
+class AppResponse(BaseModel):
+    id: UUID
+    name: str
+    owner_id: UUID
+    api_key_prefix: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class AppWithApiKey(AppResponse):
+    # Only returned when the key is created; just its hash is stored
+    api_key: str
+
 class VerifyOTP(BaseModel):
     otp: str
     app_id: UUID
@@ -56,14 +98,39 @@ class VerifyOTP(BaseModel):
 class BodyWithUri(BaseModel):
     uri: str
 
+class Enrollment(BaseModel):
+    """OTP enrollment (AuthService with its User and App) as cached for the code routes."""
+    secret: str
+    enabled: bool
+    phone_number: Optional[str] = None
+    email: Optional[str] = None
+    app_name: str
+    recovery_method: Optional[str] = None
+    failover: bool = False
+
 class ServiceStatus(BaseModel):
     ok: bool
     latency_ms: float
 
 
+class PoolStatus(BaseModel):
+    size: int
+    in_use: int
+    idle: int
+    overflow: int
+    checkouts: int
+    timeouts: int
+    wait_avg_ms: float
+    wait_max_ms: float
+
+
+class DBServiceStatus(ServiceStatus):
+    pool: Optional[PoolStatus] = None
+
+
 class Services(BaseModel):
     redis: ServiceStatus
-    db: ServiceStatus
+    db: DBServiceStatus
 
 
 class HealthResponse(BaseModel):
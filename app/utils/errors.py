@@ -27,11 +27,26 @@ class Conflict(ApiException):
         super().__init__(status_code=409, detail=detail, extra=extra)
 
 
+class UnprocessableEntity(ApiException):
+    def __init__(self, detail: str = "Unprocessable Entity", extra: Optional[dict] = None):
+        super().__init__(status_code=422, detail=detail, extra=extra)
+
+
+class TooManyRequests(ApiException):
+    def __init__(self, detail: str = "Too Many Requests", extra: Optional[dict] = None, headers: Optional[dict] = None):
+        super().__init__(status_code=429, detail=detail, extra=extra, headers=headers)
+
+
 class InternalError(ApiException):
     def __init__(self, detail: str = "Internal Server Error", extra: Optional[dict] = None):
         super().__init__(status_code=500, detail=detail, extra=extra)
 
 
+class ServiceUnavailable(ApiException):
+    def __init__(self, detail: str = "Service Unavailable", extra: Optional[dict] = None):
+        super().__init__(status_code=503, detail=detail, extra=extra)
+
+
 def require(condition: bool, exc: Exception):
     """Helper: raise given exception if condition is False.
 
@@ -7,8 +7,8 @@ from app.utils.logger import Logger
 
 
 class ApiException(HTTPException):
-    def __init__(self, status_code: int = 500, detail: str = "Internal Server Error", extra: dict | None = None):
-        super().__init__(status_code=status_code, detail=detail)
+    def __init__(self, status_code: int = 500, detail: str = "Internal Server Error", extra: dict | None = None, headers: dict | None = None):
+        super().__init__(status_code=status_code, detail=detail, headers=headers)
         self.extra = extra or {}
 
 
@@ -17,6 +17,14 @@ class ApiException(HTTPException):
 # Keep ApiException and the FastAPI handler below.
 
 
+def _log_http_error(message: str, status_code: int):
+    # Client errors (401, 404, 429...) are routine under load; keep them out of the warning stream
+    if status_code >= 500:
+        Logger.warning(message)
+    else:
+        Logger.debug(message)
+
+
 def fastapi_exception_handler(request: Request, exc: Exception):
     """Generic exception handler that returns structured JSON and logs details."""
     # ApiException (our wrapper) or HTTPException
@@ -24,12 +32,12 @@ def fastapi_exception_handler(request: Request, exc: Exception):
         payload = {"error": True, "message": exc.detail}
         if getattr(exc, "extra", None):
             payload.update(exc.extra)
-        Logger.warning(f"Handled ApiException: {exc.status_code} - {exc.detail}")
-        return JSONResponse(status_code=exc.status_code, content=payload)
+        _log_http_error(f"Handled ApiException: {exc.status_code} - {exc.detail}", exc.status_code)
+        return JSONResponse(status_code=exc.status_code, content=payload, headers=exc.headers)
 
     if isinstance(exc, HTTPException):
-        Logger.warning(f"HTTPException: {exc.status_code} - {exc.detail}")
-        return JSONResponse(status_code=exc.status_code, content={"error": True, "message": exc.detail})
+        _log_http_error(f"HTTPException: {exc.status_code} - {exc.detail}", exc.status_code)
+        return JSONResponse(status_code=exc.status_code, content={"error": True, "message": exc.detail}, headers=exc.headers)
 
     # Unhandled exception
     tb = traceback.format_exc()
@@ -1,7 +1,14 @@
+import atexit
+import json
 import logging
 import os
+import queue
+import threading
+import time
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import settings
 
 LOG_DIR = os.path.join(os.getcwd(), "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -10,15 +17,9 @@ os.makedirs(LOG_DIR, exist_ok=True)
 _run_ts = datetime.now().strftime("%Y%m%d_%H%M%S")
 _log_filename = os.path.join(LOG_DIR, f"otp-microservice-{_run_ts}.log")
 
-# Create module-level logger
-_logger = logging.getLogger("otp")
-_logger.setLevel(logging.DEBUG)
+# Level per environment: verbose in dev, INFO elsewhere unless LOG_LEVEL is set
+LOG_LEVEL = (settings.LOG_LEVEL or ("DEBUG" if settings.ENV == "dev" else "INFO")).upper()
 
-# File handler (rotating to be safe)
-_file_handler = RotatingFileHandler(_log_filename, maxBytes=10 * 1024 * 1024, backupCount=3)
-_file_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-_file_handler.setFormatter(_file_formatter)
-_logger.addHandler(_file_handler)
 
 # Console handler with simple colors
 class _ColorFormatter(logging.Formatter):
@@ -36,34 +37,120 @@ class _ColorFormatter(logging.Formatter):
         message = super().format(record)
         return f"{color}{message}{reset}"
 
+
+class _JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        payload = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class _RateLimitFilter(logging.Filter):
+    """Rate-limit repeated warnings/errors per call site.
+
+    At most `burst` records per call site and level pass within `window` seconds
+    (e.g. the same "Redis down" warning fired on every request). Once the window
+    rolls over, the next record reports how many were suppressed.
+    """
+
+    def __init__(self, burst: int = 10, window: float = 60.0, level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0 or record.levelno < self.level:
+            return True
+
+        key = (record.pathname, record.lineno, record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._sites.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+                    suppressed = 0
+
+            if count < self.burst:
+                self._sites[key] = (started, count + 1, suppressed)
+                return True
+
+            self._sites[key] = (started, count, suppressed + 1)
+            return False
+
+
+_formatter = _JsonFormatter() if settings.LOG_JSON else logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+
+# File handler (rotating to be safe)
+_file_handler = RotatingFileHandler(_log_filename, maxBytes=10 * 1024 * 1024, backupCount=3)
+_file_handler.setFormatter(_formatter)
+
 _console_handler = logging.StreamHandler()
-_console_formatter = _ColorFormatter("%(asctime)s [%(levelname)s] %(message)s")
-_console_handler.setFormatter(_console_formatter)
-_logger.addHandler(_console_handler)
+_console_handler.setFormatter(_formatter if settings.LOG_JSON else _ColorFormatter("%(asctime)s [%(levelname)s] %(message)s"))
+
+# Callers only enqueue records; file and console I/O happen on the listener thread
+_queue = queue.SimpleQueue()
+_queue_handler = QueueHandler(_queue)
+_queue_handler.addFilter(_RateLimitFilter(burst=settings.LOG_RATE_LIMIT_BURST, window=settings.LOG_RATE_LIMIT_WINDOW))
+_listener = QueueListener(_queue, _file_handler, _console_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+# Create module-level logger
+_logger = logging.getLogger("otp")
+_logger.setLevel(LOG_LEVEL)
+_logger.addHandler(_queue_handler)
+_logger.propagate = False
 
 
 class Logger:
     """Wrapper around the module logger. Use Logger.info/debug/warning/error.
 
-    Logs are sent both to console and into a per-run file under `logs/`.
+    Logs are sent both to console and into a per-run file under `logs/`, written
+    by a background thread. Level comes from LOG_LEVEL (per environment).
     """
 
+    # stacklevel=2 attributes records to the caller rather than this wrapper
+
     @staticmethod
     def info(*args, sep=' '):
-        _logger.info(sep.join(map(str, args)))
+        if _logger.isEnabledFor(logging.INFO):
+            _logger.info(sep.join(map(str, args)), stacklevel=2)
 
     @staticmethod
     def warning(*args, sep=' '):
-        _logger.warning(sep.join(map(str, args)))
+        if _logger.isEnabledFor(logging.WARNING):
+            _logger.warning(sep.join(map(str, args)), stacklevel=2)
 
     @staticmethod
     def error(*args, sep=' '):
-        _logger.error(sep.join(map(str, args)))
+        if _logger.isEnabledFor(logging.ERROR):
+            _logger.error(sep.join(map(str, args)), stacklevel=2)
 
     @staticmethod
     def debug(*args, sep=' '):
-        _logger.debug(sep.join(map(str, args)))
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(sep.join(map(str, args)), stacklevel=2)
 
     @staticmethod
     def get_logger():
-        return _logger
\ No newline at end of file
+        return _logger
+
+    @staticmethod
+    def flush():
+        """Block until queued records have been written (tests, shutdown)."""
+        _listener.stop()
+        _listener.start()
@@ -1,9 +1,67 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-
-class CreateStateMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        # Example: Set some state or process request before going to route handler
-        request.state.user_id = None  # Example state setting
-        response = await call_next(request)
-        # You can also modify the response after it goes through the route handler
-        return response
\ No newline at end of file
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.lib.metrics import observe_request
+from app.utils import timing
+
+
+class CreateStateMiddleware:
+    """Pure ASGI middleware that prepares per-request state and reports backend timings.
+
+    Sets `request.state.user_id = None` and opens a timing scope; the time spent
+    in DB, Redis and provider calls is returned in a `Server-Timing` header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["user_id"] = None
+        start = time.perf_counter()
+        token = timing.start_scope()
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                header = timing.server_timing_header(timing.current(), time.perf_counter() - start)
+                MutableHeaders(scope=message).append("Server-Timing", header)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            timing.end_scope(token)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request count and latency per route and status."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Use the matched route template (e.g. /api/app/{app_id}) to keep label cardinality bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            observe_request(scope["method"], route_path, status_code, time.perf_counter() - start)
@@ -0,0 +1,56 @@
+"""
+Per-request timing of backend calls (DB, Redis, providers).
+
+The request middleware opens a timing scope; instrumented calls add their
+duration to it with `record`/`timed`, and the totals are sent back as a
+`Server-Timing` header. Outside a request scope recording is a no-op.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+_timings: ContextVar[Optional[Dict[str, list]]] = ContextVar("server_timings", default=None)
+
+
+def start_scope():
+    """Start collecting timings for the current request. Returns a token for `end_scope`."""
+    return _timings.set({})
+
+
+def end_scope(token):
+    _timings.reset(token)
+
+
+def current() -> Dict[str, list]:
+    return _timings.get() or {}
+
+
+def record(metric: str, seconds: float):
+    timings = _timings.get()
+    if timings is None:
+        return
+    entry = timings.setdefault(metric, [0.0, 0])
+    entry[0] += seconds
+    entry[1] += 1
+
+
+@contextmanager
+def timed(metric: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(metric, time.perf_counter() - start)
+
+
+def server_timing_header(timings: Dict[str, list], total: Optional[float] = None) -> str:
+    """Format timings as `name;dur=<ms>;desc="<n> calls"` entries."""
+    parts = [
+        f'{metric};dur={seconds * 1000:.2f};desc="{count} calls"'
+        for metric, (seconds, count) in timings.items()
+    ]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
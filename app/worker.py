@@ -0,0 +1,37 @@
+"""
+Standalone OTP delivery worker.
+
+    python -m app.worker
+
+Runs DELIVERY_WORKERS consumers of the delivery stream until interrupted. Use it
+with DELIVERY_IN_PROCESS=false to scale delivery separately from the API.
+"""
+
+import asyncio
+import signal
+
+from app.lib.cache import close_redis
+from app.lib.delivery import start_delivery_workers, stop_delivery_workers
+from app.lib.provider_http import close_http_client
+from app.utils.logger import Logger
+from config import settings
+
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    Logger.info(f"Starting {settings.DELIVERY_WORKERS} delivery workers")
+    start_delivery_workers(settings.DELIVERY_WORKERS)
+    await stop.wait()
+
+    Logger.info("Stopping delivery workers")
+    await stop_delivery_workers()
+    await close_http_client()
+    await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,10 +2,42 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     ENV: str = "dev"
+    # Logging: empty LOG_LEVEL means DEBUG in dev and INFO elsewhere
+    LOG_LEVEL: str = ""
+    LOG_JSON: bool = False
+    # Max repeated warnings/errors per call site within the window (0 disables)
+    LOG_RATE_LIMIT_BURST: int = 10
+    LOG_RATE_LIMIT_WINDOW: int = 60
     DATABASE_URL: str
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Rotating refresh tokens (Redis); a family expires after this many days without use
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    # Asymmetric signing keys (<kid>.pem files) and the kid that signs; empty = HMAC with SECRET_KEY
+    JWT_KEYS_DIR: str = ""
+    JWT_ACTIVE_KID: str = ""
+    # Cache lifetime of /.well-known/jwks.json for gateways, in seconds
+    JWKS_MAX_AGE: int = 300
+    # Revocation denylist: per-worker Bloom filter size and how often it is rebuilt from Redis (seconds)
+    REVOCATION_BLOOM_CAPACITY: int = 100000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
+    REVOCATION_REBUILD_INTERVAL: int = 300
+    # Key for hashing app API keys (empty = SECRET_KEY); changing it invalidates every key
+    API_KEY_PEPPER: str = ""
+    # Verified access tokens kept in memory (per worker) until they expire
+    TOKEN_CACHE_SIZE: int = 4096
+    # Password hashing process pool (0 workers = one per CPU core)
+    PASSWORD_HASH_WORKERS: int = 0
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+    # Password hash scheme ("argon2" or "bcrypt") and cost; outdated hashes are upgraded on login
+    PASSWORD_HASH_SCHEME: str = "bcrypt"
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_ARGON2_TIME_COST: int = 3
+    PASSWORD_ARGON2_MEMORY_COST: int = 65536
+    PASSWORD_ARGON2_PARALLELISM: int = 4
+    # When > 0, calibrate the cost at startup to hit this hash time on the current hardware
+    PASSWORD_HASH_TARGET_MS: int = 0
     RESEND_API_KEY: str
     EMAIL_ADDRESS: str
     TWILIO_ACCOUNT_SID: str
@@ -13,11 +45,70 @@ class Settings(BaseSettings):
     TWILIO_PHONE_NUMBER: str
     TWILIO_WHATSAPP_NUMBER: str
     TWILIO_WHATSAPP_CONTENT_SID: str
+    # Optional sender pools (comma-separated E.164 numbers); default to the single numbers above
+    TWILIO_PHONE_NUMBERS: str = ""
+    TWILIO_WHATSAPP_NUMBERS: str = ""
+    # How a pool picks the sender: least_loaded or sticky (same number per recipient)
+    SENDER_SELECTION: str = "least_loaded"
+    # Shared async HTTP client for Twilio/Resend (per worker process); timeouts in seconds
+    PROVIDER_CONNECT_TIMEOUT: float = 3.0
+    PROVIDER_READ_TIMEOUT: float = 10.0
+    PROVIDER_MAX_CONNECTIONS: int = 50
+    PROVIDER_MAX_KEEPALIVE: int = 20
+    PROVIDER_KEEPALIVE_EXPIRY: float = 30.0
+    # Negotiated per host; needs `h2` (httpx[http2]), else HTTP/1.1 with a warning
+    PROVIDER_HTTP2: bool = True
+    # Per provider+channel circuit breaker: consecutive failures to open it, seconds before a probe
+    PROVIDER_BREAKER_FAILURES: int = 5
+    PROVIDER_BREAKER_RESET: float = 30.0
+    # Attempts per send (within the code's validity), with jittered exponential backoff in seconds
+    PROVIDER_RETRY_ATTEMPTS: int = 3
+    PROVIDER_RETRY_BASE_DELAY: float = 0.2
+    PROVIDER_RETRY_MAX_DELAY: float = 2.0
+    # Outbound throttling shared across workers, in messages per second (0 = unlimited):
+    # per sending number/address and per provider account
+    TWILIO_SENDER_RATE: float = 1.0
+    TWILIO_RATE: float = 100.0
+    RESEND_SENDER_RATE: float = 0.0
+    RESEND_RATE: float = 2.0
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
     POSTGRES_HOST: str
+    # Connection pool of the shared DB engine (per worker process)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_TIMEOUT: int = 30
     REDIS_URL: str
+    # OTP delivery queue (Redis Streams): worker tasks per process, and whether the API process runs them
+    # (set DELIVERY_IN_PROCESS=false and run `python -m app.worker` to deliver from separate processes)
+    DELIVERY_WORKERS: int = 2
+    # Deliveries each worker sends at once (one waiting on a busy sender does not hold up the rest)
+    DELIVERY_CONCURRENCY: int = 16
+    # Longest a queued delivery waits on a busy sender (seconds) before going back to the end of its app's stream
+    DELIVERY_THROTTLE_WAIT: float = 1.0
+    DELIVERY_IN_PROCESS: bool = True
+    DELIVERY_MAX_ATTEMPTS: int = 3
+    DELIVERY_STREAM_MAXLEN: int = 100000
+    # Deliveries left unacknowledged this long (seconds) by a dead worker are picked up by another
+    DELIVERY_CLAIM_IDLE: int = 30
+    # Codes sent by SMS/WhatsApp/email: lifetime and wrong guesses allowed (seconds, count), the minimum
+    # lifetime left for a re-send to repeat the live code, and the key its hash is stored under (empty = SECRET_KEY)
+    ISSUED_CODE_TTL: int = 120
+    ISSUED_CODE_ATTEMPTS: int = 5
+    ISSUED_CODE_REUSE_MIN_TTL: int = 30
+    OTP_CODE_PEPPER: str = ""
+    # Idempotency-Key on the send routes: how long a response is replayed, how long a request in flight
+    # holds its key (longer than the slowest send), and how long a concurrent duplicate waits (seconds)
+    IDEMPOTENCY_TTL: int = 86400
+    IDEMPOTENCY_PENDING_TTL: int = 150
+    IDEMPOTENCY_WAIT: float = 10.0
+    # App/User cache: per-process LRU (L1) in front of Redis (L2); TTLs in seconds
+    MODEL_CACHE_L1_SIZE: int = 1024
+    MODEL_CACHE_L1_TTL: int = 30
+    MODEL_CACHE_L2_TTL: int = 300
     # Optional explicit fallback redis URL (e.g. redis://127.0.0.1:6379)
     REDIS_FALLBACK: str = ""
 
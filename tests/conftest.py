@@ -2,6 +2,9 @@ import sys
 import time
 import os
 from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
 
 # Set Redis URL for tests BEFORE any imports that might use it
 if 'REDIS_URL' not in os.environ or os.environ.get('REDIS_URL') == 'your_redis_url':
@@ -47,3 +50,28 @@ def pytest_runtest_logreport(report):
     duration = getattr(report, 'duration', 0.0)
     # Use terminal reporter to ensure visibility even with -q
     terminal_reporter.write_line(f"> Test {report.nodeid} {status} in {duration:.3f}s")
+
+
+@pytest.fixture
+def async_session():
+    """Factory for mocked AsyncSession objects.
+
+    `exec`/`commit`/`refresh`/`delete` are awaitables, so tests can keep using
+    `session.exec.return_value.first.return_value = ...` as with sync sessions.
+    """
+    def _make():
+        session = MagicMock()
+        session.exec = AsyncMock(return_value=MagicMock())
+        session.commit = AsyncMock()
+        session.refresh = AsyncMock()
+        session.delete = AsyncMock()
+        return session
+    return _make
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    """Provider circuit breakers are process-wide; start every test with them closed."""
+    from app.lib import resilience
+    resilience._breakers.clear()
+    yield
@@ -2,16 +2,17 @@ from unittest.mock import MagicMock, patch
 from uuid import UUID
 
 from app.controllers import appController
+from app.lib.api_keys import hash_api_key
 from app.utils.errors import NotFound
 
 
-def test_reset_api_key_secret_requires_record():
-    mock_session = MagicMock()
+async def test_reset_api_key_secret_requires_record(async_session):
+    mock_session = async_session()
     # session.exec(...).first() returns None
     mock_session.exec.return_value.first.return_value = None
 
     try:
-        appController.reset_api_key_secret(UUID(int=1), UUID(int=2), mock_session)
+        await appController.reset_api_key_secret(UUID(int=1), UUID(int=2), mock_session)
         raised = False
     except NotFound:
         raised = True
@@ -19,18 +20,55 @@ def test_reset_api_key_secret_requires_record():
     assert raised is True
 
 
-def test_reset_api_key_secret_updates_secret():
+async def test_reset_api_key_secret_updates_secret(async_session):
     # Mock a record object with name and owner_id
     record = MagicMock()
     record.name = "record1"
     record.owner_id = UUID(int=2)
 
-    mock_session = MagicMock()
+    mock_session = async_session()
     mock_session.exec.return_value.first.return_value = record
 
     # Patch the generate_secret to return a deterministic value
     with patch("app.controllers.appController.generate_secret", return_value="secret"):
-        res = appController.reset_api_key_secret(UUID(int=1), UUID(int=2), mock_session)
+        res, api_key = await appController.reset_api_key_secret(UUID(int=1), UUID(int=2), mock_session)
 
-    assert hasattr(res, "api_key_secret")
-    assert res.api_key_secret.endswith("secret")
+    # The key is returned once; only its prefix and keyed hash are stored
+    assert api_key == f"otp_{res.api_key_prefix}_secret"
+    assert res.api_key_secret == hash_api_key(api_key)
+    assert "secret" not in res.api_key_secret
+
+
+async def test_get_app_by_api_key(async_session):
+    from app.models.tables import App
+
+    app = App(name="demo", owner_id=UUID(int=2), api_key_secret="")
+    api_key = appController._set_new_api_key(app)
+    mock_session = async_session()
+    mock_session.exec.return_value.first.return_value = app
+
+    assert (await appController.get_app_by_api_key(api_key, mock_session)).id == app.id
+    assert await appController.get_app_by_api_key(api_key[:-1] + "x", mock_session) is None
+    assert await appController.get_app_by_api_key("not-a-key", mock_session) is None
+
+
+async def test_rename_and_delete_drop_cached_enrollments(async_session):
+    import fakeredis
+    from app.lib.redis_service import RedisService
+
+    app_id, owner, user = UUID(int=1), UUID(int=2), UUID(int=5)
+    record = MagicMock(owner_id=owner, api_key_prefix="abc")
+    record.name = "Old"
+    session = async_session()
+    session.exec.return_value.first.return_value = record
+    session.exec.return_value.all.return_value = [user]
+    service = RedisService(redis=fakeredis.FakeAsyncRedis(decode_responses=True))
+
+    with patch("app.controllers.appController.redis_service", service):
+        for change in (
+            lambda: appController.update_app_name(owner, app_id, "New", session),
+            lambda: appController.delete_app(owner, app_id, session),
+        ):
+            await service.cache_enrollment(user, app_id, {"app_name": "Old"})
+            await change()
+            assert await service.get_cached_enrollment(user, app_id) == (False, None)
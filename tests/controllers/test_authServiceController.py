@@ -1,24 +1,80 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import UUID
 
 from app.controllers import authServiceController
 from app.utils.errors import NotFound
 
 
-def test_get_service_with_user_and_app_not_found():
-    session = MagicMock()
+async def test_get_service_with_user_and_app_not_found(async_session):
+    session = async_session()
     # Setup session.exec(...).first() to return None
     session.exec.return_value.first.return_value = None
-    res = authServiceController.get_service_with_user_and_app("user-1", UUID(int=1), session)
+    res = await authServiceController.get_service_with_user_and_app("user-1", UUID(int=1), session)
     assert res is None
 
 
-def test_get_secret_returns_value():
-    session = MagicMock()
+async def test_get_secret_returns_value(async_session):
+    session = async_session()
     # Mock a record object with otp_secret
     record = MagicMock()
     record.otp_secret = "SECRET"
     session.exec.return_value.first.return_value = record
 
-    secret = authServiceController.get_secret("user-1", UUID(int=1), session)
+    secret = await authServiceController.get_secret("user-1", UUID(int=1), session)
     assert secret == "SECRET"
+
+
+async def test_get_enrollment_reads_through_cache(async_session):
+    import fakeredis
+    from app.lib.redis_service import RedisService
+
+    session = async_session()
+    record = MagicMock()
+    record.AuthService.otp_secret = "SECRET"
+    record.AuthService.enabled = True
+    record.AuthService.recovery_method = "SMS"
+    record.AuthService.failover = True
+    record.User.phone_number = "+10000000000"
+    record.User.email = "user@example.com"
+    record.App.name = "App"
+    session.exec.return_value.first.return_value = record
+    service = RedisService(redis=fakeredis.FakeAsyncRedis(decode_responses=True))
+
+    with patch("app.controllers.authServiceController.redis_service", service):
+        first = await authServiceController.get_enrollment("user-1", UUID(int=1), session)
+        second = await authServiceController.get_enrollment("user-1", UUID(int=1), session)
+        assert session.exec.await_count == 1
+        assert first == second and second.secret == "SECRET" and second.app_name == "App"
+        assert second.recovery_method == "SMS" and second.failover
+
+        # Changes drop the cached entry
+        await service.invalidate_enrollment("user-1", UUID(int=1))
+        await authServiceController.get_enrollment("user-1", UUID(int=1), session)
+        assert session.exec.await_count == 2
+
+
+async def test_get_enrollment_caches_not_found(async_session):
+    import fakeredis
+    from app.lib.redis_service import RedisService
+
+    session = async_session()
+    session.exec.return_value.first.return_value = None
+    service = RedisService(redis=fakeredis.FakeAsyncRedis(decode_responses=True))
+
+    with patch("app.controllers.authServiceController.redis_service", service):
+        assert await authServiceController.get_enrollment("user-1", UUID(int=1), session) is None
+        assert await authServiceController.get_enrollment("user-1", UUID(int=1), session) is None
+        assert session.exec.await_count == 1
+        assert 0 < await service.redis.ttl(f"enrollment:user-1:{UUID(int=1)}") <= 30
+
+
+async def test_disable_otp_is_scoped_to_the_app(async_session):
+    session = async_session()
+    record = MagicMock(enabled=True)
+    session.exec.return_value.first.return_value = record
+
+    with patch("app.controllers.authServiceController.redis_service.invalidate_enrollment", new_callable=AsyncMock):
+        assert await authServiceController.disable_otp(UUID(int=1), UUID(int=2), session)
+
+    statement = str(session.exec.await_args.args[0])
+    assert "authservice.user_id = " in statement and "authservice.app_id = " in statement
@@ -0,0 +1,288 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
+
+import fakeredis
+import pytest
+
+from app.lib.delivery import BULK, INTERACTIVE, DeliveryQueue, deliver, deliver_any, failover_routes, fan_out
+from app.lib.issuance import derive_code
+from app.lib.resilience import ProviderRejected, get_breaker
+from app.lib.throttle import Throttled
+from app.schemas.schemas import Enrollment
+
+
+APP = uuid4()
+
+
+@pytest.fixture
+def queue():
+    return DeliveryQueue(redis=fakeredis.FakeAsyncRedis(decode_responses=True), max_attempts=2, claim_idle=0)
+
+
+def enqueue(queue, channel="sms", to="+10000000000", ttl=60, app_id=APP, **kwargs):
+    return queue.enqueue(channel, to, "App", "n1", deadline=time.time() + ttl, user_id=uuid4(), app_id=app_id, **kwargs)
+
+
+async def test_enqueued_delivery_is_sent_and_removed(queue):
+    delivery_id = await enqueue(queue)
+    assert delivery_id
+
+    (stream, entry_id, fields), = await queue.next_batch("test")
+    assert stream == queue.stream_for(INTERACTIVE, APP)
+    with patch("app.lib.delivery.deliver", new_callable=AsyncMock, return_value=True) as mock_deliver:
+        await queue.process(stream, entry_id, fields)
+
+    # Sent with the code derived from the queued nonce
+    assert mock_deliver.await_args.args == ("sms", "+10000000000", "App", derive_code("n1"))
+    assert await queue.redis.xlen(stream) == 0
+    assert (await queue.redis.xpending(stream, queue.group))["pending"] == 0
+
+
+async def test_expired_delivery_is_dropped(queue):
+    await enqueue(queue, "email", "user@example.com", ttl=-1)
+
+    (stream, entry_id, fields), = await queue.next_batch("test")
+    with patch("app.lib.delivery.deliver", new_callable=AsyncMock) as mock_deliver:
+        await queue.process(stream, entry_id, fields)
+
+    mock_deliver.assert_not_awaited()
+    assert await queue.redis.xlen(stream) == 0
+
+
+async def test_failed_delivery_is_retried_then_dead_lettered(queue):
+    await enqueue(queue, "whatsapp")
+
+    with patch("app.lib.delivery.deliver", new_callable=AsyncMock, side_effect=RuntimeError("provider down")):
+        (stream, entry_id, fields), = await queue.next_batch("test")
+        await queue.process(stream, entry_id, fields)
+        # Requeued as bulk with one attempt used
+        (stream, entry_id, fields), = await queue.next_batch("test")
+        assert stream == queue.stream_for(BULK, APP)
+        assert fields["attempts"] == "1"
+        await queue.process(stream, entry_id, fields)
+
+    assert await queue.next_batch("test") == []
+    (_, dead), = await queue.redis.xrange(queue.dead_letter_stream)
+    assert dead["attempts"] == "2"
+    assert dead["error"] == "provider down"
+    assert "nonce" not in dead
+
+
+async def test_rejected_delivery_is_dead_lettered_at_once(queue):
+    await enqueue(queue)
+
+    (stream, entry_id, fields), = await queue.next_batch("test")
+    with patch("app.lib.delivery.deliver", new_callable=AsyncMock, side_effect=ProviderRejected("invalid 'To' number")):
+        await queue.process(stream, entry_id, fields)
+
+    assert await queue.next_batch("test") == []
+    (_, dead), = await queue.redis.xrange(queue.dead_letter_stream)
+    assert dead["attempts"] == "1"
+
+
+async def test_throttled_delivery_goes_to_the_back_of_its_stream(queue):
+    await enqueue(queue)
+    await enqueue(queue, to="+10000000001")
+
+    (stream, entry_id, fields), = await queue.next_batch("test")
+    with patch("app.lib.delivery.deliver", new_callable=AsyncMock, side_effect=Throttled("busy")) as mock_deliver:
+        await queue.process(stream, entry_id, fields)
+    assert mock_deliver.await_args.kwargs["max_wait"] == queue.throttle_wait
+
+    # Behind the app's other delivery, with no attempt spent
+    (_, _, following), = await queue.next_batch("test")
+    (_, _, requeued), = await queue.next_batch("test")
+    assert following["to"] == "+10000000001"
+    assert requeued["delivery_id"] == fields["delivery_id"] and requeued["attempts"] == "0"
+    assert await queue.redis.xlen(queue.dead_letter_stream) == 0
+
+
+async def test_unacknowledged_delivery_is_claimed(queue):
+    await enqueue(queue)
+    await queue.next_batch("test")  # read by a consumer that then dies
+
+    (_, entry_id, fields), = await queue._claim("other", await queue.streams(INTERACTIVE))
+    assert fields["nonce"] == "n1" and "otp" not in fields
+
+
+async def test_apps_are_served_round_robin(queue):
+    noisy, quiet = uuid4(), uuid4()
+    for _ in range(5):
+        await enqueue(queue, app_id=noisy)
+    await enqueue(queue, app_id=quiet)
+
+    first = await queue.next_batch("test")
+    assert sorted(fields["app_id"] for _, _, fields in first) == sorted([str(noisy), str(quiet)])
+    assert len(await queue.next_batch("test")) == 1
+
+
+async def test_interactive_before_bulk(queue):
+    await enqueue(queue, priority=BULK)
+    await enqueue(queue, app_id=uuid4())
+
+    (stream, _, _), = await queue.next_batch("test")
+    assert stream.startswith(f"{queue.stream}:{INTERACTIVE}:")
+    (stream, _, _), = await queue.next_batch("test")
+    assert stream == queue.stream_for(BULK, APP)
+
+
+async def test_worker_sends_past_a_slow_delivery(queue):
+    slow, quick = uuid4(), uuid4()
+    await enqueue(queue, to="+10000000001", app_id=slow)
+    await enqueue(queue, to="+10000000002", app_id=quick)
+    release = asyncio.Event()
+
+    async def deliver(channel, to, app_name, otp, deadline=None, max_wait=None):
+        if to == "+10000000001":
+            # e.g. waiting on a throttled sender
+            await release.wait()
+        return True
+
+    next_batch = queue.next_batch
+
+    async def blocking_next_batch(consumer, block_ms=None):
+        # fakeredis never blocks (or yields) on XREADGROUP BLOCK
+        await asyncio.sleep(block_ms / 1000)
+        return await next_batch(consumer, block_ms)
+
+    with patch("app.lib.delivery.deliver", side_effect=deliver), \
+            patch.object(queue, "next_batch", blocking_next_batch):
+        worker = asyncio.create_task(queue.run_worker("test", block_ms=10))
+        quick_stream = queue.stream_for(INTERACTIVE, quick)
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if await queue.redis.xlen(quick_stream) == 0:
+                break
+        assert await queue.redis.xlen(quick_stream) == 0
+        assert await queue.redis.xlen(queue.stream_for(INTERACTIVE, slow)) == 1
+
+        release.set()
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if await queue.redis.xlen(queue.stream_for(INTERACTIVE, slow)) == 0:
+                break
+        worker.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await worker
+    assert await queue.redis.xlen(queue.stream_for(INTERACTIVE, slow)) == 0
+
+
+async def test_enqueue_fails_soft_without_redis():
+    redis = MagicMock()
+    redis.pipeline.return_value.execute = AsyncMock(side_effect=ConnectionError("down"))
+
+    assert await enqueue(DeliveryQueue(redis=redis)) is None
+
+
+async def test_deliver_routes_by_channel():
+    with patch("app.lib.delivery.send_sms", new_callable=AsyncMock, return_value={"sid": "SM1"}) as mock_sms, \
+            patch("app.lib.delivery.send_email", new_callable=AsyncMock, return_value=None):
+        assert await deliver("sms", "+1", "App", "123456")
+        assert mock_sms.await_args.kwargs["body"] == "Your verification code for App is: 123456"
+        assert not await deliver("email", "user@example.com", "App", "123456")
+    with pytest.raises(ValueError):
+        await deliver("pigeon", "x", "App", "123456")
+
+
+async def test_deliver_retries_then_opens_the_circuit():
+    sms = AsyncMock(return_value=None)
+    with patch("app.lib.delivery.send_sms", sms), patch("app.lib.delivery.backoff_delay", return_value=0), \
+            patch("app.lib.delivery.settings.PROVIDER_RETRY_ATTEMPTS", 3):
+        assert not await deliver("sms", "+1", "App", "123456")
+        assert sms.await_count == 3
+
+        # Breaker threshold (5) reached during the second send: the rest fail fast
+        assert not await deliver("sms", "+1", "App", "123456")
+        assert sms.await_count == 5
+        assert not await deliver("sms", "+1", "App", "123456")
+        assert sms.await_count == 5
+    assert get_breaker("twilio", "sms").state == "open"
+
+
+async def test_rejected_message_is_not_retried_nor_counted():
+    sms = AsyncMock(side_effect=ProviderRejected("invalid 'To' number"))
+    with patch("app.lib.delivery.send_sms", sms), patch("app.lib.delivery.backoff_delay", return_value=0), \
+            patch("app.lib.delivery.settings.PROVIDER_RETRY_ATTEMPTS", 3):
+        for _ in range(6):
+            with pytest.raises(ProviderRejected):
+                await deliver("sms", "+1", "App", "123456")
+    assert sms.await_count == 6
+    assert get_breaker("twilio", "sms").state == "closed"
+
+
+async def test_deliver_gives_up_at_the_deadline():
+    sms = AsyncMock(return_value=None)
+    with patch("app.lib.delivery.send_sms", sms):
+        assert not await deliver("sms", "+1", "App", "123456", deadline=time.time() - 1)
+    sms.assert_not_awaited()
+
+
+async def test_deliver_caps_the_throttle_wait():
+    acquire = AsyncMock(return_value=False)
+    sms = AsyncMock(return_value={"sid": "SM1"})
+    with patch("app.lib.delivery.sender_pools", {"sms": MagicMock(choose=AsyncMock(return_value="+1"), throttle=MagicMock(acquire=acquire))}), \
+            patch("app.lib.delivery.send_sms", sms):
+        with pytest.raises(Throttled):
+            await deliver("sms", "+2", "App", "123456", deadline=time.time() + 60, max_wait=1)
+        assert acquire.await_args.args[2] <= time.time() + 1
+
+        # The deadline comes first: given up, as without a cap
+        assert not await deliver("sms", "+2", "App", "123456", deadline=time.time() + 0.5, max_wait=1)
+    sms.assert_not_awaited()
+
+
+def test_failover_routes_follow_recovery_method():
+    enrollment = Enrollment(
+        secret="S", enabled=True, phone_number="+1", email="user@example.com", app_name="App", recovery_method="EMAIL"
+    )
+    assert failover_routes("sms", "+1", enrollment) == [("sms", "+1")]
+
+    enrollment.failover = True
+    assert failover_routes("sms", "+1", enrollment) == [("sms", "+1"), ("email", "user@example.com"), ("whatsapp", "+1")]
+
+    enrollment.email = None
+    assert failover_routes("whatsapp", "+1", enrollment) == [("whatsapp", "+1"), ("sms", "+1")]
+
+
+async def test_queued_delivery_fails_over(queue):
+    routes = [("email", "user@example.com")]
+    await enqueue(queue, to="+1", fallbacks=routes)
+
+    (stream, entry_id, fields), = await queue.next_batch("test")
+    with patch("app.lib.delivery.send_sms", new_callable=AsyncMock, return_value=None), \
+            patch("app.lib.delivery.send_email", new_callable=AsyncMock, return_value={"id": "e1"}) as mock_email, \
+            patch("app.lib.delivery.backoff_delay", return_value=0):
+        await queue.process(stream, entry_id, fields)
+
+    assert mock_email.await_args.kwargs["to"] == "user@example.com"
+    assert await queue.next_batch("test") == []
+    assert await queue.redis.xlen(queue.dead_letter_stream) == 0
+
+
+async def test_deliver_any_returns_none_when_all_fail():
+    with patch("app.lib.delivery.deliver", new_callable=AsyncMock, return_value=False):
+        assert await deliver_any([("sms", "+1"), ("email", "a@b.c")], "App", "123456") is None
+
+
+async def test_fan_out_race_cancels_slower_channels():
+    async def slow_sms(**kwargs):
+        await asyncio.sleep(10)
+        return {"sid": "SM1"}
+
+    with patch("app.lib.delivery.send_sms", side_effect=slow_sms), \
+            patch("app.lib.delivery.send_email", new_callable=AsyncMock, return_value={"id": "e1"}):
+        results = await fan_out([("sms", "+1"), ("email", "a@b.c")], "App", "123456", deadline=time.time() + 60, race=True)
+
+    sms, email = results
+    assert email["success"] and email["elapsed_ms"] is not None
+    assert sms == {"channel": "sms", "success": False, "elapsed_ms": None, "error": "cancelled"}
+
+
+async def test_fan_out_all_waits_for_every_channel():
+    with patch("app.lib.delivery.send_sms", new_callable=AsyncMock, return_value={"sid": "SM1"}), \
+            patch("app.lib.delivery.send_email", new_callable=AsyncMock, return_value={"id": "e1"}):
+        results = await fan_out([("sms", "+1"), ("email", "a@b.c")], "App", "123456", deadline=time.time() + 60)
+
+    assert [result["success"] for result in results] == [True, True]
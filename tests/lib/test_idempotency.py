@@ -0,0 +1,71 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import fakeredis
+import pytest
+
+from app.lib.idempotency import IdempotencyStore
+from app.utils.errors import Conflict, InternalError, UnprocessableEntity
+
+
+@pytest.fixture
+def store():
+    return IdempotencyStore(redis=fakeredis.FakeAsyncRedis(decode_responses=True), ttl=60, pending_ttl=10, wait=1, poll_interval=0.01)
+
+
+async def test_repeat_replays_stored_response(store):
+    call = AsyncMock(return_value={"success": True, "delivery_id": "d1"})
+
+    assert await store.run("k", "fp", call) == {"success": True, "delivery_id": "d1"}
+    assert await store.run("k", "fp", call) == {"success": True, "delivery_id": "d1"}
+    call.assert_awaited_once()
+
+
+async def test_concurrent_duplicate_waits_for_first_result(store):
+    release = asyncio.Event()
+    calls = 0
+
+    async def send():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return {"success": True}
+
+    first = asyncio.create_task(store.run("k", "fp", send))
+    await asyncio.sleep(0.02)
+    duplicate = asyncio.create_task(store.run("k", "fp", send))
+    await asyncio.sleep(0.02)
+    assert not duplicate.done()
+
+    release.set()
+    assert await first == await duplicate == {"success": True}
+    assert calls == 1
+
+
+async def test_duplicate_gives_up_while_first_is_running(store):
+    await store.redis.set("k", '{"state": "pending", "fingerprint": "fp"}')
+    with pytest.raises(Conflict):
+        await store.run("k", "fp", AsyncMock())
+
+
+async def test_key_reused_with_other_request(store):
+    await store.run("k", "fp", AsyncMock(return_value={"success": True}))
+    with pytest.raises(UnprocessableEntity):
+        await store.run("k", "other", AsyncMock())
+
+
+async def test_failure_releases_key(store):
+    with pytest.raises(InternalError):
+        await store.run("k", "fp", AsyncMock(side_effect=InternalError("Error sending SMS")))
+
+    retry = AsyncMock(return_value={"success": True})
+    assert await store.run("k", "fp", retry) == {"success": True}
+    retry.assert_awaited_once()
+
+
+async def test_runs_without_redis():
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    redis.set = AsyncMock(side_effect=ConnectionError("down"))
+    call = AsyncMock(return_value={"success": True})
+
+    assert await IdempotencyStore(redis=redis).run("k", "fp", call) == {"success": True}
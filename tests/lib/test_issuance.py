@@ -0,0 +1,65 @@
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+import fakeredis
+import pytest
+
+from app.lib.issuance import CodeIssuer, code_key, derive_code, hash_code
+from app.lib.redis_service import RedisService
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+async def test_issued_code_is_stored_as_keyed_hash(redis):
+    user_id, app_id = uuid4(), uuid4()
+
+    issued = await CodeIssuer(redis=redis, ttl=120, attempts=5).issue(user_id, app_id)
+
+    assert len(issued.code) == 6 and issued.code.isdigit()
+    assert issued.ttl == 120 and not issued.reused
+    stored = await redis.hgetall(code_key(user_id, app_id))
+    assert stored["hash"] == hash_code(user_id, app_id, issued.code)
+    assert derive_code(stored["nonce"]) == issued.code
+    assert stored["attempts"] == "5"
+    assert issued.code not in stored.values()
+    assert 0 < await redis.pttl(code_key(user_id, app_id)) <= 120000
+
+
+async def test_resend_reuses_live_code(redis):
+    user_id, app_id = uuid4(), uuid4()
+    issuer = CodeIssuer(redis=redis, ttl=120, reuse_min_ttl=30)
+
+    first = await issuer.issue(user_id, app_id)
+    again = await issuer.issue(user_id, app_id)
+    assert again.reused and again.code == first.code
+    assert again.ttl <= first.ttl
+
+    # Too close to expiry to be worth repeating: replaced
+    await redis.pexpire(code_key(user_id, app_id), 10000)
+    fresh = await issuer.issue(user_id, app_id)
+    assert not fresh.reused
+    assert fresh.ttl == 120
+
+
+async def test_attempt_budget_drops_code(redis):
+    user_id, app_id = uuid4(), uuid4()
+    issued = await CodeIssuer(redis=redis, attempts=2).issue(user_id, app_id)
+    service = RedisService(redis=redis)
+
+    for _ in range(2):
+        assert (await service.verify_and_consume_otp(user_id, app_id, "abcdef"))["status"] == "invalid"
+        await service.record_failed_otp(user_id, app_id)
+
+    # The right code no longer works, and a re-send issues a new one
+    assert (await service.verify_and_consume_otp(user_id, app_id, issued.code))["status"] == "missing"
+    assert not (await CodeIssuer(redis=redis).issue(user_id, app_id)).reused
+
+
+async def test_issue_fails_soft_without_redis():
+    redis = MagicMock()
+    redis.register_script.return_value = AsyncMock(side_effect=ConnectionError("down"))
+
+    assert await CodeIssuer(redis=redis).issue(uuid4(), uuid4()) is None
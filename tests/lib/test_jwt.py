@@ -0,0 +1,80 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.lib.jwt import PasswordHasher, HashPolicy, calibrate
+from app.utils.errors import ServiceUnavailable
+
+
+def sample(name):
+    return REGISTRY.get_sample_value(name) or 0
+
+
+async def test_hash_and_verify_roundtrip():
+    # A thread pool keeps the test fast; the production default is a process pool
+    hasher = PasswordHasher(workers=1, executor=ThreadPoolExecutor(max_workers=1))
+    calls = sample("password_hash_duration_seconds_count")
+    hash_time = sample("password_hash_duration_seconds_sum")
+
+    hashed = await hasher.hash("s3cret")
+    assert hashed != "s3cret"
+    assert await hasher.verify("s3cret", hashed) is True
+    assert await hasher.verify("wrong", hashed) is False
+
+    # Exported to /metrics
+    assert sample("password_hash_duration_seconds_count") == calls + 3
+    assert sample("password_hash_duration_seconds_sum") > hash_time
+    assert sample("password_hash_pending") == 0
+    hasher.shutdown()
+
+
+async def test_rejects_when_queue_is_full():
+    hasher = PasswordHasher(workers=1, max_queue=0, executor=ThreadPoolExecutor(max_workers=1))
+    hashed = await hasher.hash("s3cret")
+    rejected = sample("password_hash_rejections_total")
+
+    # First call occupies the only slot, the second is rejected immediately
+    first = asyncio.create_task(hasher.verify("s3cret", hashed))
+    await asyncio.sleep(0)
+    with pytest.raises(ServiceUnavailable):
+        await hasher.verify("s3cret", hashed)
+
+    assert await first is True
+    assert sample("password_hash_rejections_total") == rejected + 1
+    assert hasher.pending == 0
+    hasher.shutdown()
+
+
+# Cheap parameters so the scheme/rehash tests stay fast
+FAST_BCRYPT = HashPolicy(scheme="bcrypt", bcrypt_rounds=4)
+FAST_ARGON2 = HashPolicy(scheme="argon2", argon2_time_cost=1, argon2_memory_cost=1024, argon2_parallelism=1)
+
+
+async def test_verify_and_update_rehashes_outdated_scheme():
+    hasher = PasswordHasher(workers=1, executor=ThreadPoolExecutor(max_workers=1), policy=FAST_BCRYPT)
+    old_hash = await hasher.hash("s3cret")
+    assert old_hash.startswith("$2b$04$")
+
+    # Current hash under the current policy: nothing to upgrade
+    assert await hasher.verify_and_update("s3cret", old_hash) == (True, None)
+
+    hasher.policy = FAST_ARGON2
+    verified, new_hash = await hasher.verify_and_update("s3cret", old_hash)
+    assert verified is True
+    assert new_hash.startswith("$argon2id$")
+    assert await hasher.verify("s3cret", new_hash) is True
+
+    # Wrong password never yields a replacement hash
+    assert await hasher.verify_and_update("wrong", old_hash) == (False, None)
+    hasher.shutdown()
+
+
+def test_calibrate_respects_target_and_bounds():
+    # A zero budget keeps the scheme minimum
+    assert calibrate(FAST_BCRYPT, target_ms=0).bcrypt_rounds == 4
+    # max_cost caps the search whatever the target
+    policy = calibrate(FAST_ARGON2, target_ms=10_000, max_cost=2)
+    assert policy.argon2_time_cost == 2
+    assert policy.argon2_memory_cost == FAST_ARGON2.argon2_memory_cost
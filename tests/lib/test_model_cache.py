@@ -0,0 +1,127 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock
+from uuid import uuid4
+
+import fakeredis
+import pytest
+
+from app.lib.model_cache import INVALIDATION_CHANNEL, LRUCache, TieredCache, handle_invalidation, listen_for_invalidations
+from app.models.tables import App
+
+
+@pytest.fixture
+def fake_redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+def make_app(name="demo"):
+    return App(name=name, api_key_secret="secret", owner_id=uuid4())
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    assert cache.set("c", 3) is True
+
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+
+    expired = LRUCache(maxsize=2, ttl=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is None
+    assert len(expired) == 0
+
+
+async def test_read_through_l1_then_l2(fake_redis):
+    app = make_app()
+    loader = AsyncMock(return_value=app)
+    cache = TieredCache(f"test-{uuid4()}", App, redis=fake_redis)
+
+    first = await cache.get("id:1", loader)
+    second = await cache.get("id:1", loader)
+    loader.assert_awaited_once()
+    assert first.id == second.id == app.id
+    # Fresh instance per read, not the loader's (session-bound) object
+    assert second is not app
+
+    # Another worker: empty L1, same Redis
+    other = TieredCache(cache.namespace, App, redis=fake_redis)
+    assert (await other.get("id:1", AsyncMock())).name == "demo"
+
+
+async def test_none_is_not_cached(fake_redis):
+    loader = AsyncMock(return_value=None)
+    cache = TieredCache(f"test-{uuid4()}", App, redis=fake_redis)
+
+    assert await cache.get("name:missing", loader) is None
+    assert await cache.get("name:missing", loader) is None
+    assert loader.await_count == 2
+
+
+async def test_invalidation_during_load_is_not_overwritten(fake_redis):
+    namespace = f"test-{uuid4()}"
+    cache = TieredCache(namespace, App, redis=fake_redis)
+    loading, release = asyncio.Event(), asyncio.Event()
+
+    async def slow_loader():
+        loading.set()
+        await release.wait()
+        return make_app("old")
+
+    read = asyncio.create_task(cache.get("id:1", slow_loader))
+    await loading.wait()
+    # The row changes and is invalidated while the stale read is in flight
+    await cache.invalidate("id:1")
+    release.set()
+
+    assert (await read).name == "old"
+    assert await fake_redis.get(f"cache:{namespace}:id:1") is None
+    assert len(cache.l1) == 0
+    assert (await cache.get("id:1", AsyncMock(return_value=make_app("new")))).name == "new"
+    assert await fake_redis.get(f"cache:{namespace}:id:1") is not None
+
+
+async def test_invalidate_broadcasts_to_other_workers(fake_redis):
+    namespace = f"test-{uuid4()}"
+    cache = TieredCache(namespace, App, redis=fake_redis)
+    await cache.get("id:1", AsyncMock(return_value=make_app()))
+
+    pubsub = fake_redis.pubsub()
+    await pubsub.subscribe(INVALIDATION_CHANNEL)
+    await cache.invalidate("id:1")
+
+    assert await fake_redis.get(f"cache:{namespace}:id:1") is None
+    message = None
+    for _ in range(10):
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.1)
+        if message:
+            break
+    assert json.loads(message["data"]) == {"namespace": namespace, "keys": ["id:1"]}
+    await pubsub.aclose()
+
+
+async def test_listener_drops_l1_entries(fake_redis):
+    namespace = f"test-{uuid4()}"
+    cache = TieredCache(namespace, App, redis=fake_redis)
+    task = asyncio.create_task(listen_for_invalidations(fake_redis))
+    await asyncio.sleep(0.05)
+
+    cache.l1.set("id:1", make_app().model_dump(mode="json"))
+    await fake_redis.publish(INVALIDATION_CHANNEL, json.dumps({"namespace": namespace, "keys": ["id:1"]}))
+    for _ in range(20):
+        if len(cache.l1) == 0:
+            break
+        await asyncio.sleep(0.05)
+    assert len(cache.l1) == 0
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_malformed_invalidation_is_ignored():
+    handle_invalidation("not json")
+    handle_invalidation(json.dumps({"namespace": "unknown", "keys": ["x"]}))
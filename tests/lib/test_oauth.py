@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from uuid import uuid4
+
+import jwt
+import pytest
+
+from app.lib import oauth
+from app.utils.errors import Unauthorized
+from config import settings
+
+
+def test_token_round_trip_uses_standard_exp():
+    user_id = uuid4()
+    token = oauth.create_access_token({"user_id": str(user_id)})
+
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    assert "exp" in payload and "expiration_date" not in payload
+
+    data = oauth.verify_access_token(token)
+    assert data.id == user_id
+    assert data.expiration_date > datetime.now(timezone.utc)
+
+
+def test_repeat_verification_skips_decoding():
+    token = oauth.create_access_token({"user_id": str(uuid4())})
+
+    with patch("app.lib.oauth.jwt.decode", wraps=jwt.decode) as decode:
+        first = oauth.verify_access_token(token)
+        second = oauth.verify_access_token(token)
+
+    assert decode.call_count == 1
+    assert first == second
+
+
+def test_expired_token_is_rejected():
+    expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+    token = jwt.encode({"user_id": str(uuid4()), "exp": expired}, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+    with pytest.raises(Unauthorized):
+        oauth.verify_access_token(token)
+
+
+def test_token_without_exp_is_rejected():
+    token = jwt.encode({"user_id": str(uuid4())}, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+    with pytest.raises(Unauthorized):
+        oauth.verify_access_token(token)
+
+
+def test_tampered_token_is_rejected():
+    token = oauth.create_access_token({"user_id": str(uuid4())})
+
+    with pytest.raises(Unauthorized):
+        oauth.verify_access_token(token[:-2] + ("AA" if token[-2:] != "AA" else "BB"))
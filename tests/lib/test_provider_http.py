@@ -0,0 +1,22 @@
+from unittest.mock import patch
+
+from app.lib import provider_http
+
+
+async def test_http2_without_h2_falls_back_with_warning():
+    with patch.object(provider_http.settings, "PROVIDER_HTTP2", True), \
+            patch.object(provider_http, "HTTP2_AVAILABLE", False), \
+            patch.object(provider_http, "Logger") as logger:
+        client = provider_http.build_client()
+
+    assert logger.warning.called
+    await client.aclose()
+
+
+async def test_http2_disabled_does_not_warn():
+    with patch.object(provider_http.settings, "PROVIDER_HTTP2", False), \
+            patch.object(provider_http, "Logger") as logger:
+        client = provider_http.build_client()
+
+    assert not logger.warning.called
+    await client.aclose()
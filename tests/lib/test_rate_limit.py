@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.lib.rate_limit import RateLimiter, RateLimit, FIXED_WINDOW, SLIDING_WINDOW, GCRA
+from app.utils.exceptionHandler import ApiException, fastapi_exception_handler
+
+
+@pytest.fixture
+def fake_redis():
+    # fakeredis runs the real Lua scripts
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+@pytest.mark.parametrize("algorithm", [FIXED_WINDOW, SLIDING_WINDOW, GCRA])
+async def test_allows_up_to_limit_then_rejects(fake_redis, algorithm):
+    limiter = RateLimiter(fake_redis)
+
+    results = [await limiter.hit("rate:test", limit=3, window=60, algorithm=algorithm) for _ in range(4)]
+
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert [r.remaining for r in results[:3]] == [2, 1, 0]
+    assert results[3].retry_after > 0
+    assert results[3].headers()["Retry-After"] != "0"
+    # Keys always carry an expiry, even though the check is one round trip
+    assert await fake_redis.pttl("rate:test") > 0
+
+
+async def test_gcra_spaces_requests_after_burst(fake_redis):
+    limiter = RateLimiter(fake_redis)
+    for _ in range(3):
+        await limiter.hit("rate:gcra", limit=3, window=60, algorithm=GCRA)
+
+    rejected = await limiter.hit("rate:gcra", limit=3, window=60, algorithm=GCRA)
+    # One request is emitted every window/limit = 20s
+    assert 19 <= rejected.retry_after <= 20
+
+
+async def test_fails_open_when_redis_errors():
+    broken = MagicMock()
+    broken.register_script.side_effect = Exception("redis down")
+
+    result = await RateLimiter(broken).hit("rate:test", limit=1)
+    assert result.allowed is True
+
+
+def test_dependency_sets_headers_and_rejects(fake_redis):
+    app = FastAPI()
+    app.add_exception_handler(ApiException, fastapi_exception_handler)
+    limit = RateLimit("test", limit=1, window=60, limiter=RateLimiter(fake_redis))
+
+    @app.get("/limited/{app_id}", dependencies=[Depends(limit)])
+    async def limited(app_id: str):
+        return {"ok": True}
+
+    client = TestClient(app)
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")):
+        headers = {"Authorization": "Bearer dummy"}
+        ok = client.get("/limited/app-1", headers=headers)
+        rejected = client.get("/limited/app-1", headers=headers)
+        other_app = client.get("/limited/app-2", headers=headers)
+
+    assert ok.status_code == 200
+    assert ok.headers["X-RateLimit-Limit"] == "1"
+    assert ok.headers["X-RateLimit-Remaining"] == "0"
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+    # Limits are per user+app
+    assert other_app.status_code == 200
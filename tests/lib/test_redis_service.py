@@ -43,33 +43,32 @@ class TestRedisService:
     @pytest.mark.asyncio
     async def test_check_rate_limit_first_request(self, redis_service_instance, mock_redis):
         """Test rate limit check for first request."""
-        mock_redis.incr.return_value = 1
-        mock_redis.expire.return_value = True
+        script = AsyncMock(return_value=[1, 1, 60000, 0])
+        mock_redis.register_script.return_value = script
         
         is_allowed, current = await redis_service_instance.check_rate_limit("test_key", 5)
         
         assert is_allowed is True
         assert current == 1
-        mock_redis.incr.assert_called_once_with("test_key")
-        mock_redis.expire.assert_called_once_with("test_key", 60)
+        # One script call (INCR + PEXPIRE server side) instead of two round trips
+        script.assert_awaited_once_with(keys=["test_key"], args=[5, 60000])
+        mock_redis.incr.assert_not_called()
+        mock_redis.expire.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_check_rate_limit_within_limit(self, redis_service_instance, mock_redis):
         """Test rate limit check within allowed limit."""
-        mock_redis.incr.return_value = 3
+        mock_redis.register_script.return_value = AsyncMock(return_value=[1, 3, 42000, 0])
         
         is_allowed, current = await redis_service_instance.check_rate_limit("test_key", 5)
         
         assert is_allowed is True
         assert current == 3
-        mock_redis.incr.assert_called_once_with("test_key")
-        # expire should not be called for existing key
-        mock_redis.expire.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_check_rate_limit_exceeded(self, redis_service_instance, mock_redis):
         """Test rate limit check when limit is exceeded."""
-        mock_redis.incr.return_value = 6
+        mock_redis.register_script.return_value = AsyncMock(return_value=[0, 6, 30000, 30000])
         
         is_allowed, current = await redis_service_instance.check_rate_limit("test_key", 5)
         
@@ -79,7 +78,7 @@ class TestRedisService:
     @pytest.mark.asyncio
     async def test_check_rate_limit_redis_failure(self, redis_service_instance, mock_redis):
         """Test rate limit check when Redis fails."""
-        mock_redis.incr.side_effect = Exception("Redis connection failed")
+        mock_redis.register_script.return_value = AsyncMock(side_effect=Exception("Redis connection failed"))
         
         is_allowed, current = await redis_service_instance.check_rate_limit("test_key", 5)
         
@@ -100,56 +99,6 @@ class TestRedisService:
     
     # ================== OTP MANAGEMENT TESTS ==================
     
-    @pytest.mark.asyncio
-    async def test_store_otp(self, redis_service_instance, mock_redis):
-        """Test storing OTP in Redis."""
-        user_id = uuid4()
-        app_id = uuid4()
-        otp = "123456"
-        
-        mock_redis.setex.return_value = True
-        
-        result = await redis_service_instance.store_otp(user_id, app_id, otp, 120)
-        
-        assert result is True
-        mock_redis.setex.assert_called_once_with(f"otp:{user_id}:{app_id}", 120, otp)
-    
-    @pytest.mark.asyncio
-    async def test_get_and_delete_otp(self, redis_service_instance, mock_redis):
-        """Test getting and deleting OTP atomically."""
-        user_id = uuid4()
-        app_id = uuid4()
-        expected_otp = "123456"
-        
-        # Mock pipeline
-        mock_pipeline = MagicMock()
-        mock_pipeline.get = MagicMock()
-        mock_pipeline.delete = MagicMock()
-        mock_pipeline.execute = AsyncMock(return_value=[expected_otp, 1])
-        mock_redis.pipeline.return_value = mock_pipeline
-        
-        result = await redis_service_instance.get_and_delete_otp(user_id, app_id)
-        
-        assert result == expected_otp
-        mock_pipeline.get.assert_called_once_with(f"otp:{user_id}:{app_id}")
-        mock_pipeline.delete.assert_called_once_with(f"otp:{user_id}:{app_id}")
-    
-    @pytest.mark.asyncio
-    async def test_get_and_delete_otp_not_found(self, redis_service_instance, mock_redis):
-        """Test getting and deleting OTP when OTP doesn't exist."""
-        user_id = uuid4()
-        app_id = uuid4()
-        
-        mock_pipeline = MagicMock()
-        mock_pipeline.get = MagicMock()
-        mock_pipeline.delete = MagicMock()
-        mock_pipeline.execute = AsyncMock(return_value=[None, 0])
-        mock_redis.pipeline.return_value = mock_pipeline
-        
-        result = await redis_service_instance.get_and_delete_otp(user_id, app_id)
-        
-        assert result is None
-    
     @pytest.mark.asyncio
     async def test_check_otp_exists(self, redis_service_instance, mock_redis):
         """Test checking if OTP exists."""
@@ -364,16 +313,13 @@ class TestRedisServiceIntegration:
     async def test_rate_limiting_workflow(self):
         """Test complete rate limiting workflow."""
         mock_redis = MagicMock()
-        mock_redis.incr = AsyncMock()
-        mock_redis.expire = AsyncMock()
-        mock_redis.get = AsyncMock()
-        mock_redis.ttl = AsyncMock()
+        # Simulate multiple requests: the script returns {allowed, used, reset_ms, retry_ms}
+        mock_redis.register_script.return_value = AsyncMock(
+            side_effect=[[1, n, 60000, 0] for n in range(1, 6)] + [[0, 6, 60000, 60000]]
+        )
         
         service = RedisService(redis=mock_redis)
         
-        # Simulate multiple requests
-        mock_redis.incr.side_effect = [1, 2, 3, 4, 5, 6]  # 6 requests
-        
         results = []
         for i in range(6):
             is_allowed, current = await service.check_rate_limit("test_user", 5)
@@ -389,28 +335,121 @@ class TestRedisServiceIntegration:
     
     @pytest.mark.asyncio
     async def test_otp_verification_workflow(self):
-        """Test OTP storage and verification workflow."""
-        mock_redis = MagicMock()
-        mock_redis.setex = AsyncMock(return_value=True)
-        mock_pipeline = MagicMock()
-        mock_pipeline.get = MagicMock()
-        mock_pipeline.delete = MagicMock()
-        mock_pipeline.execute = AsyncMock(return_value=["123456", 1])
-        mock_redis.pipeline.return_value = mock_pipeline
-        
-        service = RedisService(redis=mock_redis)
+        """Test OTP issuance and verification workflow."""
+        import fakeredis
+        from app.lib.issuance import CodeIssuer
+
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        service = RedisService(redis=redis)
         user_id = uuid4()
         app_id = uuid4()
-        otp = "123456"
-        
-        # Store OTP
-        stored = await service.store_otp(user_id, app_id, otp)
-        assert stored is True
-        
-        # Retrieve and delete OTP
-        retrieved_otp = await service.get_and_delete_otp(user_id, app_id)
-        assert retrieved_otp == otp
-        
-        # Verify pipeline was used correctly
-        mock_pipeline.get.assert_called_once_with(f"otp:{user_id}:{app_id}")
-        mock_pipeline.delete.assert_called_once_with(f"otp:{user_id}:{app_id}")
\ No newline at end of file
+
+        # Issue a code: only its keyed hash is stored
+        issued = await CodeIssuer(redis=redis).issue(user_id, app_id)
+        assert issued.code not in (await redis.hgetall(f"otp:{user_id}:{app_id}")).values()
+
+        # Verify and consume it
+        result = await service.verify_and_consume_otp(user_id, app_id, issued.code)
+        assert result["status"] == "valid"
+        assert await service.check_otp_exists(user_id, app_id) is False
+
+class TestVerifyAndConsumeOTP:
+    """verify_and_consume_otp runs the real Lua script on fakeredis."""
+
+    @pytest.fixture
+    def service(self):
+        import fakeredis
+        return RedisService(redis=fakeredis.FakeAsyncRedis(decode_responses=True))
+
+    @staticmethod
+    async def issue(service, user_id, app_id) -> str:
+        from app.lib.issuance import CodeIssuer
+        return (await CodeIssuer(redis=service.redis).issue(user_id, app_id)).code
+
+    @pytest.mark.asyncio
+    async def test_valid_code_is_consumed_once(self, service):
+        user_id, app_id = uuid4(), uuid4()
+        code = await self.issue(service, user_id, app_id)
+
+        first = await service.verify_and_consume_otp(user_id, app_id, code, time_step=1)
+        second = await service.verify_and_consume_otp(user_id, app_id, "abcdef", time_step=1)
+
+        assert first["status"] == "valid"
+        assert second["status"] == "missing"
+        assert await service.check_otp_exists(user_id, app_id) is False
+
+    @pytest.mark.asyncio
+    async def test_invalid_code_counts_only_recorded_failures_then_blocks(self, service):
+        user_id, app_id = uuid4(), uuid4()
+        code = await self.issue(service, user_id, app_id)
+
+        # A mismatch alone changes nothing: it may still be a valid TOTP code
+        result = await service.verify_and_consume_otp(user_id, app_id, "abcdef", max_failed=2)
+        assert result["status"] == "invalid"
+        assert result["failed_attempts"] == 0
+
+        for attempt in range(1, 3):
+            assert await service.record_failed_otp(user_id, app_id) == attempt
+
+        result = await service.verify_and_consume_otp(user_id, app_id, code, max_failed=2)
+        assert result["status"] == "blocked"
+        assert result["retry_after"] > 0
+        # The cached code survives a blocked attempt
+        assert await service.check_otp_exists(user_id, app_id) is True
+
+    @pytest.mark.asyncio
+    async def test_recorded_failure_spends_code_attempts(self, service):
+        from app.lib.issuance import CodeIssuer
+
+        user_id, app_id = uuid4(), uuid4()
+        await CodeIssuer(redis=service.redis, attempts=2).issue(user_id, app_id)
+
+        await service.record_failed_otp(user_id, app_id)
+        assert await service.check_otp_exists(user_id, app_id) is True
+        await service.record_failed_otp(user_id, app_id)
+        assert await service.check_otp_exists(user_id, app_id) is False
+        # Nothing is created when no code is live
+        await service.record_failed_otp(user_id, app_id)
+        assert await service.check_otp_exists(user_id, app_id) is False
+
+    @pytest.mark.asyncio
+    async def test_rate_limited(self, service):
+        user_id, app_id = uuid4(), uuid4()
+
+        for _ in range(2):
+            assert (await service.verify_and_consume_otp(user_id, app_id, "1", rate_limit=2))["status"] == "missing"
+        result = await service.verify_and_consume_otp(user_id, app_id, "1", rate_limit=2)
+
+        assert result["status"] == "rate_limited"
+        assert result["rate_used"] == 3
+        assert 0 < result["retry_after"] <= 60
+
+    @pytest.mark.asyncio
+    async def test_redis_failure_is_unavailable(self):
+        mock_redis = MagicMock()
+        mock_redis.register_script.return_value = AsyncMock(side_effect=Exception("Redis down"))
+        service = RedisService(redis=mock_redis)
+
+        result = await service.verify_and_consume_otp(uuid4(), uuid4(), "123456")
+
+        assert result["status"] == "unavailable"
+
+    @pytest.mark.asyncio
+    async def test_consumed_code_is_replayed(self, service):
+        user_id, app_id = uuid4(), uuid4()
+        code = await self.issue(service, user_id, app_id)
+
+        assert (await service.verify_and_consume_otp(user_id, app_id, code, time_step=1))["status"] == "valid"
+        assert (await service.verify_and_consume_otp(user_id, app_id, code, time_step=1))["status"] == "replayed"
+        assert (await service.verify_and_consume_otp(user_id, app_id, code, time_step=2))["status"] == "replayed"
+        # Kept apart from the TOTP step, so an authenticator code in the same step still claims it
+        assert await service.claim_totp_step(user_id, app_id, 1, "654321") is True
+
+    @pytest.mark.asyncio
+    async def test_claim_totp_step_once(self, service):
+        user_id, app_id = uuid4(), uuid4()
+
+        assert await service.claim_totp_step(user_id, app_id, 7, "654321") is True
+        assert await service.claim_totp_step(user_id, app_id, 7, "654321") is False
+        assert (await service.verify_and_consume_otp(user_id, app_id, "654321", time_step=7))["status"] == "replayed"
+        assert 0 < await service.redis.pttl(f"totp_used:{user_id}:{app_id}:7") <= 30000
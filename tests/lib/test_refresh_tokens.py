@@ -0,0 +1,106 @@
+from uuid import uuid4
+from unittest.mock import AsyncMock, MagicMock
+
+import fakeredis
+import pytest
+
+from app.lib.refresh_tokens import RefreshTokenStore
+from app.utils.errors import ServiceUnavailable, Unauthorized
+
+
+@pytest.fixture
+def store():
+    return RefreshTokenStore(redis=fakeredis.FakeAsyncRedis(decode_responses=True), ttl=60)
+
+
+async def test_rotation_returns_new_token_once(store):
+    user_id = uuid4()
+    token = await store.issue(user_id)
+
+    rotated_user, new_token = await store.rotate(token)
+    assert rotated_user == str(user_id)
+    assert new_token != token
+    assert new_token.split(".")[0] == token.split(".")[0]
+
+    # The raw token is never stored
+    family = token.split(".")[0]
+    assert token not in (await store.redis.hgetall(f"refresh_family:{family}")).values()
+
+
+async def test_reuse_revokes_the_family(store):
+    token = await store.issue(uuid4())
+    _, new_token = await store.rotate(token)
+
+    with pytest.raises(Unauthorized):
+        await store.rotate(token)
+    # The legitimate (latest) token is revoked too
+    with pytest.raises(Unauthorized):
+        await store.rotate(new_token)
+
+
+@pytest.mark.parametrize("token", ["", "no-family-separator", "unknown.token"])
+async def test_unknown_tokens_are_rejected(store, token):
+    with pytest.raises(Unauthorized):
+        await store.rotate(token)
+
+
+async def test_revoke(store):
+    user_id = uuid4()
+    token = await store.issue(user_id)
+    assert await store.revoke(token, user_id) is True
+    with pytest.raises(Unauthorized):
+        await store.rotate(token)
+    assert await store.redis.smembers(f"refresh_user:{user_id}") == set()
+
+
+async def test_revoke_requires_the_current_token_of_its_owner(store):
+    user_id = uuid4()
+    token = await store.issue(user_id)
+    family = token.split(".")[0]
+
+    # Someone else's session, or a forged or rotated token of the family: left alone
+    assert await store.revoke(token, uuid4()) is False
+    assert await store.revoke(f"{family}.forged", user_id) is False
+    stale = token
+    _, token = await store.rotate(token)
+    assert await store.revoke(stale, user_id) is False
+
+    assert (await store.rotate(token))[1]
+
+
+async def test_redis_failure():
+    redis = MagicMock()
+    redis.pipeline.return_value.execute = AsyncMock(side_effect=Exception("Redis down"))
+    redis.register_script.return_value = AsyncMock(side_effect=Exception("Redis down"))
+    store = RefreshTokenStore(redis=redis)
+
+    assert await store.issue(uuid4()) is None
+    with pytest.raises(ServiceUnavailable):
+        await store.rotate("family.secret")
+
+
+async def test_revoke_user_revokes_every_family(store):
+    user_id = uuid4()
+    tokens = [await store.issue(user_id), await store.issue(user_id)]
+    other = await store.issue(uuid4())
+
+    assert await store.revoke_user(user_id) == 2
+    for token in tokens:
+        with pytest.raises(Unauthorized):
+            await store.rotate(token)
+    assert (await store.rotate(other))[1]
+
+
+async def test_rotation_keeps_the_user_set_alive(store):
+    user_id = uuid4()
+    token = await store.issue(user_id)
+    # Close to expiring: only rotations keep the family (and so the user's set) in use
+    await store.redis.pexpire(f"refresh_user:{user_id}", 500)
+
+    _, token = await store.rotate(token)
+    assert await store.redis.pttl(f"refresh_user:{user_id}") > 59000
+
+    # Logging out everywhere still reaches the family
+    assert await store.revoke_user(user_id) == 1
+    with pytest.raises(Unauthorized):
+        await store.rotate(token)
@@ -1,6 +1,9 @@
+import json
 import unittest
+import httpx
 from app.lib.resend import get_template
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
+from app.lib.provider_http import build_client
 from app.lib.resend import send_email
 
 class TestGetTemplate(unittest.TestCase):
@@ -12,11 +15,10 @@ class TestGetTemplate(unittest.TestCase):
         result = get_template(app_name, code)
         self.assertEqual(result, expected_html)
 
-class TestSendEmail(unittest.TestCase):
+class TestSendEmail(unittest.IsolatedAsyncioTestCase):
 
-    @patch('app.lib.resend.resend.Emails.send')
     @patch('app.lib.resend.settings')
-    def test_send_email(self, mock_settings, mock_send):
+    async def test_send_email(self, mock_settings):
         mock_settings.RESEND_API_KEY = "fake_api_key"
         mock_settings.EMAIL_ADDRESS = "test@example.com"
         
@@ -24,18 +26,25 @@ class TestSendEmail(unittest.TestCase):
         subject = "Test Subject"
         body = "Test Body"
         
-        mock_send.return_value = MagicMock(status_code=200)
-        
-        response = send_email(to, subject, body)
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"id": "email-1"})
+
+        with patch('app.lib.resend.get_http_client', return_value=build_client(transport=httpx.MockTransport(handler))):
+            response = await send_email(to, subject, body)
         
-        mock_send.assert_called_once_with({
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0].headers["Authorization"], "Bearer fake_api_key")
+        self.assertEqual(json.loads(requests[0].content), {
             "from": "test@example.com",
             "to": [to],
             "subject": subject,
             "text": body
         })
         
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response, {"id": "email-1"})
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,14 +1,32 @@
 from unittest.mock import patch
+
+import httpx
+import pytest
+
+from app.lib.provider_http import build_client
 from app.lib.resend import send_email
+from app.lib.resilience import ProviderRejected
+
 
+def mock_client(handler):
+    return patch("app.lib.resend.get_http_client", return_value=build_client(transport=httpx.MockTransport(handler)))
 
-def test_send_email_handles_exceptions():
-    class FakeException(Exception):
-        pass
 
-    def fake_send(params):
-        raise FakeException("boom")
+async def test_send_email_handles_exceptions():
+    def handler(request):
+        raise httpx.ReadTimeout("boom")
 
-    with patch("app.lib.resend.resend.Emails.send", side_effect=fake_send):
-        res = send_email("test@example.com", "subj", "body")
+    with mock_client(handler):
+        res = await send_email("test@example.com", "subj", "body")
         assert res is None
+
+
+async def test_send_email_handles_error_responses():
+    for status in (500, 429):
+        with mock_client(lambda request: httpx.Response(status, json={"message": "busy"})):
+            assert await send_email("test@example.com", "subj", "body") is None
+
+    # The message itself was refused: not worth retrying
+    with mock_client(lambda request: httpx.Response(422, json={"message": "invalid"})):
+        with pytest.raises(ProviderRejected):
+            await send_email("test@example.com", "subj", "body")
@@ -0,0 +1,84 @@
+import httpx
+
+from app.lib.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, backoff_delay, is_rejection
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("twilio/sms", failure_threshold=3, reset_timeout=30, clock=Clock())
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # resets the count
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_half_open_allows_a_single_probe():
+    clock = Clock()
+    breaker = CircuitBreaker("resend/email", failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+
+    clock.now = 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # probe in flight
+
+    # Failed probe: open for another full period
+    breaker.record_failure()
+    clock.now = 59
+    assert not breaker.allow()
+    clock.now = 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_lost_probe_does_not_block_forever():
+    clock = Clock()
+    breaker = CircuitBreaker("twilio/whatsapp", failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+
+
+def test_backoff_is_jittered_and_capped():
+    delays = [backoff_delay(attempt, base=0.5, cap=2.0) for attempt in range(1, 8) for _ in range(20)]
+    assert all(0 <= delay <= 2.0 for delay in delays)
+    assert len(set(delays)) > 1
+    assert all(backoff_delay(1, base=0.5, cap=2.0) <= 0.5 for _ in range(20))
+
+
+def test_released_probe_can_be_retaken():
+    clock = Clock()
+    breaker = CircuitBreaker("twilio/sms", failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+
+    assert breaker.allow() and not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_only_message_level_4xx_are_rejections():
+    def error(status):
+        request = httpx.Request("POST", "https://api.example.com")
+        return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+    assert is_rejection(error(400)) and is_rejection(error(422))
+    assert not any(is_rejection(error(status)) for status in (408, 429, 500, 503))
+    assert not is_rejection(httpx.ConnectTimeout("boom"))
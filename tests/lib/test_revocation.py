@@ -0,0 +1,106 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+from uuid import uuid4
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+from app.lib import oauth
+from app.lib.revocation import BloomFilter, RevocationList
+from app.schemas.schemas import TokenData
+
+
+@pytest.fixture
+def fake_redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+def token_data(user_id=None, issued_at=None):
+    now = datetime.now(timezone.utc)
+    return TokenData(
+        id=user_id or uuid4(),
+        expiration_date=now + timedelta(minutes=5),
+        jti=uuid4().hex,
+        issued_at=issued_at or now,
+    )
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [f"jti:{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+
+    assert all(item in bloom for item in items)
+    false_positives = sum(f"other:{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+async def test_revoke_token_and_user(fake_redis):
+    revocations = RevocationList(redis=fake_redis)
+    token = token_data()
+    await revocations.revoke_token(token.jti, token.expiration_date)
+    assert await revocations.is_revoked(token) is True
+    assert 0 < await fake_redis.ttl(f"revoked:jti:{token.jti}") <= 300
+
+    user_id = uuid4()
+    old = token_data(user_id, issued_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+    await revocations.revoke_user(user_id)
+    new = token_data(user_id, issued_at=datetime.now(timezone.utc) + timedelta(seconds=1))
+    assert await revocations.is_revoked(old) is True
+    assert await revocations.is_revoked(new) is False
+
+
+async def test_synced_filter_skips_redis_for_clean_tokens(fake_redis):
+    revocations = RevocationList(redis=fake_redis)
+    await revocations.rebuild()
+    revocations.synced = True
+
+    with patch.object(fake_redis, "mget", AsyncMock(return_value=[None, None])) as mget:
+        assert await revocations.is_revoked(token_data()) is False
+        mget.assert_not_called()
+
+
+async def test_listener_syncs_other_workers(fake_redis):
+    revoked = token_data()
+    # Revoked before the worker started: picked up by the initial load
+    await RevocationList(redis=fake_redis).revoke_token(revoked.jti, revoked.expiration_date)
+
+    worker = RevocationList(redis=fake_redis)
+    task = asyncio.create_task(worker.listen())
+    for _ in range(20):
+        if worker.synced:
+            break
+        await asyncio.sleep(0.05)
+    assert worker.synced
+    assert f"jti:{revoked.jti}" in worker._bloom
+
+    # Revoked elsewhere while running: arrives over pub/sub
+    later = token_data()
+    await RevocationList(redis=fake_redis).revoke_token(later.jti, later.expiration_date)
+    for _ in range(40):
+        if f"jti:{later.jti}" in worker._bloom:
+            break
+        await asyncio.sleep(0.05)
+    assert await worker.is_revoked(later) is True
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_logout_revokes_the_token(fake_redis):
+    from app.main import app
+
+    revocations = RevocationList(redis=fake_redis)
+    token = oauth.create_access_token({"user_id": str(uuid4())})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with patch("app.routes.authRouter.revocations", revocations), patch("app.utils.decorators.revocations", revocations):
+        client = TestClient(app)
+        assert client.post("/api/auth/logout", headers=headers).status_code == 200
+        r = client.post("/api/auth/logout", headers=headers)
+        assert r.status_code == 401
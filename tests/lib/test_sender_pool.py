@@ -0,0 +1,103 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import fakeredis
+import pytest
+
+from app.lib.delivery import deliver
+from app.lib.resilience import CircuitBreaker, ProviderRejected, _breakers
+from app.lib.sender_pool import LEAST_LOADED, STICKY, SenderPool, calling_code, parse_senders
+from app.lib.throttle import OutboundThrottle
+
+US = ["+14155550100", "+14155550101"]
+UK = "+447700900123"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def pool(strategy=LEAST_LOADED, senders=US + [UK]):
+    throttle = OutboundThrottle(redis=fakeredis.FakeAsyncRedis(decode_responses=True), rates={"twilio": (1, 0)})
+    return SenderPool("twilio", "sms", senders, strategy=strategy, throttle=throttle)
+
+
+def test_calling_code():
+    assert calling_code("+14155550100") == "1"
+    assert calling_code("+447700900123") == "44"
+    assert calling_code("+353851234567") == "353"
+    assert calling_code("user@example.com") is None
+    assert parse_senders(" +1, ,+2 ") == ["+1", "+2"]
+
+
+async def test_prefers_numbers_in_the_recipient_country():
+    sms = pool()
+    assert await sms.choose("+447911123456") == UK
+    assert await sms.choose("+12125550000") in US
+    # No local number: any sender
+    assert await sms.choose("+33612345678") in US + [UK]
+
+
+async def test_least_loaded_spreads_sends():
+    sms = pool()
+    chosen = []
+    for _ in range(2):
+        sender = await sms.choose("+12125550000")
+        assert await sms.throttle.try_acquire("twilio", sms.bucket(sender)) == 0
+        chosen.append(sender)
+    assert sorted(chosen) == US
+
+
+async def test_sticky_keeps_recipient_on_one_number():
+    sms = pool(STICKY, senders=[f"+1415555010{i}" for i in range(5)])
+    first = await sms.choose("+12125550000")
+    assert all([await sms.choose("+12125550000") == first for _ in range(5)])
+    assert len({await sms.choose(f"+1212555000{i}") for i in range(10)}) > 1
+
+
+async def test_failing_sender_leaves_rotation():
+    sms = pool(STICKY, senders=US)
+    sender = await sms.choose("+12125550000")
+    for _ in range(5):
+        sms.record(sender, False)
+
+    assert sms.healthy() == [other for other in US if other != sender]
+    assert await sms.choose("+12125550000") != sender
+
+    for other in US:
+        for _ in range(5):
+            sms.record(other, False)
+    assert await sms.choose("+12125550000") is None
+
+
+async def test_released_probe_returns_sender_to_rotation():
+    clock = Clock()
+    sms = pool(STICKY, senders=[UK])
+    _breakers[("twilio", f"sender:{sms.bucket(UK)}")] = CircuitBreaker("probe", failure_threshold=1, reset_timeout=30, clock=clock)
+    sms.record(UK, False)
+    clock.now = 30
+
+    # Probe claimed, then the send never happened (no throttle capacity)
+    assert await sms.choose("+447911123456") == UK
+    assert await sms.choose("+447911123456") is None
+    sms.release(UK)
+    assert await sms.choose("+447911123456") == UK
+
+
+async def test_rejected_send_keeps_sender_healthy():
+    sms = pool(senders=[UK])
+    sms.throttle.rates = {"twilio": (0, 0)}
+    with patch("app.lib.delivery.sender_pools", {"sms": sms}), \
+            patch("app.lib.delivery.send_sms", new_callable=AsyncMock, side_effect=ProviderRejected("invalid 'To' number")):
+        for _ in range(6):
+            with pytest.raises(ProviderRejected):
+                await deliver("sms", "+447911123456", "App", "123456")
+    assert sms.healthy() == [UK]
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        SenderPool("twilio", "sms", US, strategy="random", throttle=MagicMock(next_free=AsyncMock()))
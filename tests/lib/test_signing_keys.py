@@ -0,0 +1,100 @@
+from unittest.mock import patch
+from uuid import uuid4
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from fastapi.testclient import TestClient
+
+from app.lib import oauth
+from app.lib.signing_keys import load_key_set
+from app.main import app
+from app.utils.errors import Unauthorized
+
+
+def write_private(path, key):
+    path.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+
+def write_public(path, key):
+    path.write_bytes(key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+
+
+@pytest.fixture
+def old_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+@pytest.fixture
+def new_key():
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def test_key_set_picks_algorithm_by_key_type(tmp_path, old_key, new_key):
+    write_public(tmp_path / "2024-01.pem", old_key)
+    write_private(tmp_path / "2024-02.pem", new_key)
+
+    keys = load_key_set(str(tmp_path), "")
+
+    assert keys.active.kid == "2024-02"
+    assert keys.keys["2024-01"].algorithm == "ES256"
+    assert keys.keys["2024-02"].algorithm == "EdDSA"
+    assert not keys.keys["2024-01"].can_sign
+
+
+def test_several_private_keys_need_active_kid(tmp_path, old_key, new_key):
+    write_private(tmp_path / "a.pem", old_key)
+    write_private(tmp_path / "b.pem", new_key)
+
+    with pytest.raises(ValueError):
+        load_key_set(str(tmp_path), "")
+    assert load_key_set(str(tmp_path), "a").active.kid == "a"
+
+
+def test_rotation_keeps_old_tokens_valid(tmp_path, old_key, new_key):
+    write_private(tmp_path / "old.pem", old_key)
+    with patch("app.lib.oauth.signing_keys", load_key_set(str(tmp_path), "")):
+        old_token = oauth.create_access_token({"user_id": str(uuid4())})
+    assert jwt.get_unverified_header(old_token)["kid"] == "old"
+
+    # Rotated: new key signs, old one only verifies
+    write_public(tmp_path / "old.pem", old_key)
+    write_private(tmp_path / "new.pem", new_key)
+    with patch("app.lib.oauth.signing_keys", load_key_set(str(tmp_path), "new")):
+        new_token = oauth.create_access_token({"user_id": str(uuid4())})
+        assert jwt.get_unverified_header(new_token) == {"alg": "EdDSA", "kid": "new", "typ": "JWT"}
+        assert oauth.verify_access_token(old_token).id
+        assert oauth.verify_access_token(new_token).id
+
+
+def test_unknown_kid_is_rejected(tmp_path, old_key):
+    write_private(tmp_path / "known.pem", old_key)
+    keys = load_key_set(str(tmp_path), "")
+    token = jwt.encode({"user_id": str(uuid4()), "exp": 4102444800}, old_key, algorithm="ES256", headers={"kid": "other"})
+
+    with patch("app.lib.oauth.signing_keys", keys), pytest.raises(Unauthorized):
+        oauth.verify_access_token(token)
+
+
+def test_jwks_publishes_public_keys_only(tmp_path, old_key, new_key):
+    write_public(tmp_path / "old.pem", old_key)
+    write_private(tmp_path / "new.pem", new_key)
+    keys = load_key_set(str(tmp_path), "")
+
+    with patch("app.routes.jwksRouter.signing_keys", keys):
+        client = TestClient(app)
+        r = client.get("/.well-known/jwks.json")
+        assert r.status_code == 200
+        assert "max-age" in r.headers["Cache-Control"]
+        jwks = r.json()["keys"]
+        assert {key["kid"]: key["alg"] for key in jwks} == {"old": "ES256", "new": "EdDSA"}
+        assert all("d" not in key for key in jwks)
+
+        # The JWKS verifies our tokens without the service
+        with patch("app.lib.oauth.signing_keys", keys):
+            token = oauth.create_access_token({"user_id": "u"})
+        public = jwt.PyJWKSet.from_dict(r.json())["new"]
+        assert jwt.decode(token, public.key, algorithms=["EdDSA"])["user_id"] == "u"
+
+        assert client.get("/.well-known/jwks.json", headers={"If-None-Match": r.headers["ETag"]}).status_code == 304
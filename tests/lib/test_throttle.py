@@ -0,0 +1,49 @@
+import time
+from unittest.mock import MagicMock
+
+import fakeredis
+import pytest
+
+from app.lib.throttle import OutboundThrottle
+
+
+@pytest.fixture
+def throttle():
+    # One send per second per number, three per second for the whole provider
+    return OutboundThrottle(redis=fakeredis.FakeAsyncRedis(decode_responses=True), rates={"twilio": (1, 3)})
+
+
+async def test_sender_bucket_limits_each_number(throttle):
+    assert await throttle.try_acquire("twilio", "+1") == 0
+    wait = await throttle.try_acquire("twilio", "+1")
+    assert 0 < wait <= 1
+
+    # Another number has its own bucket
+    assert await throttle.try_acquire("twilio", "+2") == 0
+
+
+async def test_provider_bucket_limits_all_numbers(throttle):
+    for sender in ("+1", "+2", "+3"):
+        assert await throttle.try_acquire("twilio", sender) == 0
+    assert await throttle.try_acquire("twilio", "+4") > 0
+
+
+async def test_rejected_acquire_consumes_nothing(throttle):
+    assert await throttle.try_acquire("twilio", "+1") == 0
+    assert await throttle.try_acquire("twilio", "+1") > 0
+    # The refused attempt on +1 did not use a provider token
+    assert await throttle.try_acquire("twilio", "+2") == 0
+    assert await throttle.try_acquire("twilio", "+3") == 0
+
+
+async def test_acquire_gives_up_at_deadline(throttle):
+    assert await throttle.acquire("twilio", "+1", deadline=time.time() + 5)
+    assert not await throttle.acquire("twilio", "+1", deadline=time.time() + 0.1)
+
+
+async def test_unlimited_provider_and_fail_open():
+    assert await OutboundThrottle(redis=MagicMock(), rates={}).try_acquire("resend", "a@b.c") == 0
+
+    redis = MagicMock()
+    redis.register_script.side_effect = ConnectionError("down")
+    assert await OutboundThrottle(redis=redis, rates={"twilio": (1, 1)}).try_acquire("twilio", "+1") == 0
@@ -1,26 +1,66 @@
 from unittest.mock import patch
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from app.lib.provider_http import build_client
+from app.lib.resilience import ProviderRejected
 from app.lib.twilio import send_sms, send_whatsapp
+from config import settings
 
 
-def test_send_sms_handles_exceptions(monkeypatch):
-    class FakeException(Exception):
-        pass
+def mock_client(handler):
+    return patch("app.lib.twilio.get_http_client", return_value=build_client(transport=httpx.MockTransport(handler)))
 
-    def fake_create(*args, **kwargs):
-        raise FakeException("boom")
 
-    with patch("app.lib.twilio.client.messages.create", side_effect=fake_create):
-        res = send_sms("+123", "hi")
-        assert res is None
+async def test_send_sms_posts_message():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(201, json={"sid": "SM123"})
+
+    with mock_client(handler):
+        res = await send_sms("+123", "hi")
+
+    assert res == {"sid": "SM123"}
+    request, = requests
+    assert request.url.path.endswith("/Messages.json")
+    assert request.headers["Authorization"].startswith("Basic ")
+    assert parse_qs(request.content.decode()) == {"Body": ["hi"], "From": [settings.TWILIO_PHONE_NUMBER], "To": ["+123"]}
+
 
+async def test_send_whatsapp_escapes_content_variables():
+    requests = []
 
-def test_send_whatsapp_handles_exceptions(monkeypatch):
-    class FakeException(Exception):
-        pass
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(201, json={"sid": "SM124"})
 
-    def fake_create(*args, **kwargs):
-        raise FakeException("boom")
+    with mock_client(handler):
+        assert await send_whatsapp("+123", '0"0') == {"sid": "SM124"}
 
-    with patch("app.lib.twilio.client.messages.create", side_effect=fake_create):
-        res = send_whatsapp("+123", "0000")
+    form = parse_qs(requests[0].content.decode())
+    assert form["To"] == ["whatsapp:+123"]
+    assert form["ContentVariables"] == ['{"1": "0\\"0"}']
+
+
+async def test_send_sms_handles_exceptions():
+    def handler(request):
+        raise httpx.ConnectTimeout("boom")
+
+    with mock_client(handler):
+        res = await send_sms("+123", "hi")
         assert res is None
+
+
+async def test_send_whatsapp_handles_error_responses():
+    with mock_client(lambda request: httpx.Response(503, json={"code": 20503})):
+        res = await send_whatsapp("+123", "0000")
+        assert res is None
+
+    # Invalid 'To' number: rejected, not a provider failure
+    with mock_client(lambda request: httpx.Response(400, json={"code": 21211})):
+        with pytest.raises(ProviderRejected):
+            await send_whatsapp("+123", "0000")
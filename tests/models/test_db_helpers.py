@@ -4,18 +4,45 @@ from uuid import UUID
 from app.controllers import appController
 
 
-def test_get_app_by_id_returns_record():
-    mock_session = MagicMock()
+async def test_get_app_by_id_returns_record(async_session):
+    mock_session = async_session()
     record = MagicMock()
     mock_session.exec.return_value.first.return_value = record
 
-    res = appController.get_app_by_id(UUID(int=1), mock_session)
+    res = await appController.get_app_by_id(UUID(int=1), mock_session)
     assert res is record
 
 
-def test_get_app_by_id_none():
-    mock_session = MagicMock()
+async def test_get_app_by_id_none(async_session):
+    mock_session = async_session()
     mock_session.exec.return_value.first.return_value = None
 
-    res = appController.get_app_by_id(UUID(int=1), mock_session)
+    res = await appController.get_app_by_id(UUID(int=1), mock_session)
     assert res is None
+
+
+def test_to_async_url_maps_sync_drivers():
+    from app.models.db import to_async_url
+
+    assert to_async_url("postgresql://u:p@host:5432/db") == "postgresql+asyncpg://u:p@host:5432/db"
+    assert to_async_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    # Already-async URLs are left untouched
+    assert to_async_url("postgresql+asyncpg://u:p@host/db") == "postgresql+asyncpg://u:p@host/db"
+
+
+async def test_pool_status_counts_checkouts(tmp_path):
+    from sqlmodel import select
+    from app.models.db import DB, pool_metrics
+
+    database = DB(f"sqlite:///{tmp_path / 'pool.db'}")
+    before = pool_metrics.checkouts
+    async with database.session() as session:
+        await session.exec(select(1))
+        status = database.pool_status()
+        assert status["in_use"] == 1
+
+    status = database.pool_status()
+    assert status["in_use"] == 0
+    assert status["idle"] == 1
+    assert status["checkouts"] == before + 1
+    await database.dispose()
@@ -0,0 +1,74 @@
+from uuid import uuid4
+
+from sqlalchemy import text
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.lib.api_keys import parse_prefix
+from app.models.db import DB
+from app.models.tables import App, AuthService
+
+# The app table as created before prefixed API keys
+LEGACY_APP = """
+CREATE TABLE app (
+    id CHAR(32) NOT NULL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    api_key_secret VARCHAR(256) NOT NULL,
+    owner_id CHAR(32) NOT NULL,
+    created_at DATETIME
+)
+"""
+
+# The authservice table as created before opt-in failover
+LEGACY_AUTH_SERVICE = """
+CREATE TABLE authservice (
+    id CHAR(32) NOT NULL PRIMARY KEY,
+    user_id CHAR(32) NOT NULL,
+    app_id CHAR(32) NOT NULL,
+    recovery_method VARCHAR(50) NOT NULL,
+    otp_method VARCHAR(50) NOT NULL,
+    otp_secret VARCHAR(100) NOT NULL,
+    enabled BOOLEAN NOT NULL,
+    expiration_date DATETIME,
+    created_at DATETIME
+)
+"""
+
+
+async def test_existing_database_is_upgraded(tmp_path):
+    db = DB(f"sqlite:///{tmp_path}/legacy.db")
+    app_id = uuid4()
+    async with db.engine.begin() as connection:
+        await connection.execute(text(LEGACY_APP))
+        await connection.execute(
+            text("INSERT INTO app (id, name, api_key_secret, owner_id) VALUES (:id, 'demo', 'OTP-demo-PLAINTEXT', :owner)"),
+            {"id": app_id.hex, "owner": uuid4().hex},
+        )
+        await connection.execute(text(LEGACY_AUTH_SERVICE))
+        await connection.execute(
+            text("INSERT INTO authservice (id, user_id, app_id, recovery_method, otp_method, otp_secret, enabled) "
+                 "VALUES (:id, :user, :app, 'SMS', 'SMS', 'JBSWY3DPEHPK3PXP', 1)"),
+            {"id": uuid4().hex, "user": uuid4().hex, "app": app_id.hex},
+        )
+
+    assert await db.create_db_and_tables() == ["app.api_key_prefix", "authservice.failover"]
+    # Idempotent
+    assert await db.create_db_and_tables() == []
+
+    async with AsyncSession(db.engine) as session:
+        app = (await session.exec(select(App).where(App.id == app_id))).one()
+        enrollment = (await session.exec(select(AuthService).where(AuthService.app_id == app_id))).one()
+    assert enrollment.failover is False
+    # The plaintext key is gone and the app has a (not yet known) prefixed key
+    assert app.api_key_prefix and parse_prefix(f"otp_{app.api_key_prefix}_x") == app.api_key_prefix
+    assert "PLAINTEXT" not in app.api_key_secret
+    async with db.engine.connect() as connection:
+        indexes = (await connection.execute(text("PRAGMA index_list('app')"))).all()
+    assert any(index[1] == "ix_app_api_key_prefix" and index[2] for index in indexes)
+    await db.dispose()
+
+
+async def test_new_database_needs_no_upgrade(tmp_path):
+    db = DB(f"sqlite:///{tmp_path}/new.db")
+    assert await db.create_db_and_tables() == []
+    await db.dispose()
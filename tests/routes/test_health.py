@@ -1,6 +1,6 @@
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock, AsyncMock
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
 
 from app.main import app
 
@@ -14,14 +14,18 @@ def test_health_all_ok(monkeypatch):
 
         # Mock DB session exec to succeed using a simple contextmanager
         with patch("app.routes.healthRouter.db") as mock_db:
-            @contextmanager
-            def healthy_session():
+            @asynccontextmanager
+            async def healthy_session():
                 class Sess:
-                    def exec(self, q):
+                    async def exec(self, q):
                         return None
                 yield Sess()
 
             mock_db.session = healthy_session
+            mock_db.pool_status.return_value = {
+                "size": 5, "in_use": 1, "idle": 4, "overflow": 0,
+                "checkouts": 10, "timeouts": 0, "wait_avg_ms": 0.5, "wait_max_ms": 2.0,
+            }
 
             r = client.get("/health/")
             assert r.status_code == 200
@@ -29,6 +33,8 @@ def test_health_all_ok(monkeypatch):
             assert j.get("ok") is True
             assert "redis" in j["services"]
             assert "db" in j["services"]
+            assert j["services"]["db"]["pool"]["in_use"] == 1
+            assert j["services"]["db"]["pool"]["idle"] == 4
 
 
 def test_health_db_down(monkeypatch):
@@ -37,15 +43,17 @@ def test_health_db_down(monkeypatch):
         mock_redis.ping = AsyncMock(return_value=True)
 
         with patch("app.routes.healthRouter.db") as mock_db:
-            @contextmanager
-            def failing_session():
+            @asynccontextmanager
+            async def failing_session():
                 raise Exception("db down")
                 yield  # pragma: no cover
 
             mock_db.session = failing_session
+            mock_db.pool_status.side_effect = Exception("no pool")
 
             r = client.get("/health/")
             assert r.status_code == 503
             j = r.json()
             assert j.get("ok") is False
             assert j["services"]["db"]["ok"] is False
+            assert j["services"]["db"]["pool"] is None
@@ -0,0 +1,47 @@
+from fastapi.testclient import TestClient
+from unittest.mock import patch, MagicMock, AsyncMock
+from prometheus_client import REGISTRY
+
+from app.main import app
+
+client = TestClient(app)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_endpoint_exports_route_histograms():
+    with patch("app.routes.healthRouter.redis_client") as mock_redis:
+        mock_redis.ping = AsyncMock(return_value=True)
+        client.get("/health/")
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/health/"' in r.text
+    assert "http_request_duration_seconds_bucket" in r.text
+
+
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=None)
+def test_otp_outcomes_are_counted(mock_get_enrollment):
+    labels = {"operation": "generate", "channel": "cache", "outcome": "client_error"}
+    before = sample("otp_events_total", **labels)
+    route_before = sample("http_requests_total", method="GET", route="/api/code/generate/{app_id}", status="404")
+
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")):
+        r = client.get("/api/code/generate/00000000-0000-0000-0000-000000000000", headers={"Authorization": "Bearer dummy"})
+    assert r.status_code == 404
+
+    assert sample("otp_events_total", **labels) == before + 1
+    # Route label is the template, not the concrete path
+    assert sample("http_requests_total", method="GET", route="/api/code/generate/{app_id}", status="404") == route_before + 1
+
+
+async def test_provider_errors_are_counted():
+    from app.lib.twilio import send_sms
+
+    before = sample("provider_errors_total", provider="twilio", channel="sms")
+    with patch("app.lib.twilio.create_message", side_effect=Exception("boom")):
+        assert await send_sms("+123", "hi") is None
+    assert sample("provider_errors_total", provider="twilio", channel="sms") == before + 1
@@ -1,49 +1,248 @@
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
+from app.lib.issuance import CodeIssuer, IssuedCode
 from app.main import app
+from app.schemas.schemas import Enrollment
 from app.utils.errors import NotFound, InternalError
+from config import settings
 
 client = TestClient(app)
 
+ENROLLMENT = Enrollment(secret="JBSWY3DPEHPK3PXP", enabled=True, phone_number="+10000000000", email="user@example.com", app_name="App")
 
-def fake_get_secret(user_id, app_id, session):
-    return "SECRET123"
 
-
-@patch("app.routes.codeRouter.get_service_with_user_and_app")
-@patch("app.routes.codeRouter.authServiceController.get_secret", side_effect=fake_get_secret)
-@patch("app.routes.codeRouter.send_sms", return_value=MagicMock())
-@patch("app.routes.codeRouter.send_whatsapp", return_value=MagicMock())
-@patch("app.routes.codeRouter.send_email", return_value=MagicMock())
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=ENROLLMENT)
+@patch("app.routes.codeRouter.code_issuer.issue", new_callable=AsyncMock, return_value=None)
+@patch("app.routes.codeRouter.delivery_queue.enqueue", new_callable=AsyncMock, return_value=None)
+@patch("app.lib.delivery.send_sms", new_callable=AsyncMock, return_value={"sid": "SM1"})
+@patch("app.lib.delivery.send_whatsapp", new_callable=AsyncMock, return_value={"sid": "SM2"})
+@patch("app.lib.delivery.send_email", new_callable=AsyncMock, return_value={"id": "e1"})
 @patch("app.routes.codeRouter.generate_otp_code", return_value="123456")
-def test_generate_and_send_routes(mock_generate_otp, mock_send_email, mock_send_whatsapp, mock_send_sms, mock_get_secret, mock_service):
+def test_generate_and_send_routes(mock_generate_otp, mock_send_email, mock_send_whatsapp, mock_send_sms, mock_enqueue, mock_issue, mock_get_enrollment):
     # Prepare headers with a valid token for decorator (we bypass token validation by monkeypatching oauth)
     with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")):
         headers = {"Authorization": "Bearer dummy"}
 
-        # Generate code (redis is optional and may fail silently in route) - just ensure endpoint runs
+        # Redis unavailable: the TOTP code is handed out instead of an issued one
         r = client.get("/api/code/generate/00000000-0000-0000-0000-000000000000", headers=headers)
         assert r.status_code == 200
-        assert "code" in r.json()
+        assert r.json() == {"code": "123456"}
 
-        # send sms route
+        # send sms route (queue unavailable: sent inline)
         body = {"app_id": "00000000-0000-0000-0000-000000000000"}
         r2 = client.post("/api/code/sms", json=body, headers=headers)
-        assert r2.status_code == 200
+        assert r2.status_code == 202
+        mock_send_sms.assert_awaited_once_with(
+            to="+10000000000", body="Your verification code for App is: 123456", from_=settings.TWILIO_PHONE_NUMBER
+        )
 
         # send whatsapp
         r3 = client.post("/api/code/whatsapp", json=body, headers=headers)
-        assert r3.status_code == 200
+        assert r3.status_code == 202
+        mock_send_whatsapp.assert_awaited_once()
 
         # send email (now POST)
         r4 = client.post("/api/code/email", json=body, headers=headers)
-        assert r4.status_code == 200
+        assert r4.status_code == 202
+        mock_send_email.assert_awaited_once()
+
+        # provider failure on the inline path is still an error
+        mock_send_sms.return_value = None
+        with patch("app.lib.delivery.backoff_delay", return_value=0):
+            assert client.post("/api/code/sms", json=body, headers=headers).status_code == 500
+
+
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=ENROLLMENT)
+@patch("app.routes.codeRouter.code_issuer.issue", new_callable=AsyncMock, return_value=IssuedCode("123456", "n1", 120, False))
+@patch("app.routes.codeRouter.delivery_queue.enqueue", new_callable=AsyncMock, return_value="d1")
+@patch("app.lib.delivery.send_sms", new_callable=AsyncMock)
+def test_send_route_queues_delivery(mock_send_sms, mock_enqueue, mock_issue, mock_get_enrollment):
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")):
+        r = client.post("/api/code/sms", json={"app_id": "00000000-0000-0000-0000-000000000000"}, headers={"Authorization": "Bearer dummy"})
+    assert r.status_code == 202
+    assert r.json() == {"success": True, "delivery_id": "d1"}
+    mock_send_sms.assert_not_awaited()
+    # The code is verifiable as soon as the request returns, whenever it is delivered
+    mock_issue.assert_awaited_once()
+    # Queued with the nonce, never the code itself
+    assert mock_enqueue.await_args.args == ("sms", "+10000000000", "App", "n1")
 
 
-@patch("app.routes.codeRouter.authServiceController.get_secret", side_effect=lambda *a, **k: None)
-def test_generate_requires_secret(mock_get_secret):
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=None)
+def test_generate_requires_enrollment(mock_get_enrollment):
     with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")):
         headers = {"Authorization": "Bearer dummy"}
         r = client.get("/api/code/generate/00000000-0000-0000-0000-000000000000", headers=headers)
-    assert r.status_code == 404
\ No newline at end of file
+    assert r.status_code == 404
+
+@patch("app.routes.codeRouter.redis_service.verify_and_consume_otp", new_callable=AsyncMock)
+def test_verify_route_uses_single_script_result(mock_verify):
+    body = {"app_id": "00000000-0000-0000-0000-000000000000", "otp": "123456"}
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")):
+        headers = {"Authorization": "Bearer dummy"}
+
+        mock_verify.return_value = {"status": "valid", "rate_used": 1, "rate_reset": 60, "failed_attempts": 0, "retry_after": 0}
+        r = client.post("/api/code/verify", json=body, headers=headers)
+        assert r.status_code == 200
+        assert r.headers["X-RateLimit-Remaining"] == "9"
+
+        mock_verify.return_value = {"status": "rate_limited", "rate_used": 11, "rate_reset": 30, "failed_attempts": 0, "retry_after": 30}
+        r = client.post("/api/code/verify", json=body, headers=headers)
+        assert r.status_code == 429
+        assert r.headers["Retry-After"] == "30"
+
+        mock_verify.return_value = {"status": "blocked", "rate_used": 2, "rate_reset": 60, "failed_attempts": 5, "retry_after": 600}
+        r = client.post("/api/code/verify", json=body, headers=headers)
+        assert r.status_code == 429
+
+
+@patch("app.routes.codeRouter.redis_service.claim_totp_step", new_callable=AsyncMock)
+@patch("app.routes.codeRouter.redis_service.verify_and_consume_otp", new_callable=AsyncMock)
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=ENROLLMENT)
+def test_verify_route_rejects_totp_replay(mock_get_enrollment, mock_verify, mock_claim):
+    from pyotp import TOTP
+
+    body = {"app_id": "00000000-0000-0000-0000-000000000000", "otp": TOTP("JBSWY3DPEHPK3PXP").now()}
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")):
+        headers = {"Authorization": "Bearer dummy"}
+
+        mock_verify.return_value = {"status": "missing", "rate_used": 1, "rate_reset": 60, "failed_attempts": 0, "retry_after": 0}
+        mock_claim.return_value = True
+        assert client.post("/api/code/verify", json=body, headers=headers).status_code == 200
+
+        # Lost the set-if-absent race
+        mock_claim.return_value = False
+        assert client.post("/api/code/verify", json=body, headers=headers).status_code == 401
+
+        # Replay caught by the script, before any DB lookup
+        mock_get_enrollment.reset_mock()
+        mock_verify.return_value = {"status": "replayed", "rate_used": 3, "rate_reset": 60, "failed_attempts": 0, "retry_after": 0}
+        assert client.post("/api/code/verify", json=body, headers=headers).status_code == 401
+        mock_get_enrollment.assert_not_called()
+
+        # A delivered code is live and this is not it: a valid TOTP code is still accepted
+        mock_verify.return_value = {"status": "invalid", "rate_used": 4, "rate_reset": 60, "failed_attempts": 0, "retry_after": 0}
+        mock_claim.return_value = True
+        with patch("app.routes.codeRouter.redis_service.record_failed_otp", new_callable=AsyncMock) as mock_failed:
+            assert client.post("/api/code/verify", json=body, headers=headers).status_code == 200
+            mock_failed.assert_not_awaited()
+
+            # Neither code: counted once
+            assert client.post("/api/code/verify", json={**body, "otp": "000000" if body["otp"] != "000000" else "111111"}, headers=headers).status_code == 401
+            mock_failed.assert_awaited_once()
+
+
+def test_routes_require_authentication():
+    r = client.get("/api/code/generate/00000000-0000-0000-0000-000000000000")
+    assert r.status_code == 401
+
+
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=ENROLLMENT)
+@patch("app.utils.decorators.appController.get_app_by_api_key", new_callable=AsyncMock)
+def test_api_key_authentication(mock_get_app, mock_get_enrollment):
+    app_id = "00000000-0000-0000-0000-000000000000"
+    mock_get_app.return_value = MagicMock(id=app_id)
+    headers = {"X-API-Key": "otp_a1b2c3d4e5f6_secret", "X-User-Id": "00000000-0000-0000-0000-000000000001"}
+
+    r = client.get(f"/api/code/generate/{app_id}", headers=headers)
+    assert r.status_code == 200
+    assert str(mock_get_enrollment.await_args.args[0]) == headers["X-User-Id"]
+
+    # Keys only act within their own app
+    assert client.get("/api/code/generate/00000000-0000-0000-0000-0000000000ff", headers=headers).status_code == 403
+    assert client.get(f"/api/code/generate/{app_id}", headers={"X-API-Key": headers["X-API-Key"]}).status_code == 400
+
+    mock_get_app.return_value = None
+    assert client.get(f"/api/code/generate/{app_id}", headers=headers).status_code == 401
+
+
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=ENROLLMENT)
+@patch("app.lib.delivery.send_sms", new_callable=AsyncMock, return_value=None)
+@patch("app.lib.delivery.send_email", new_callable=AsyncMock, return_value={"id": "e1"})
+def test_send_fans_out_one_code(mock_send_email, mock_send_sms, mock_get_enrollment):
+    import asyncio
+    import fakeredis
+    from app.lib.redis_service import RedisService
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    body = {"app_id": "00000000-0000-0000-0000-000000000000", "channels": ["sms", "email"]}
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")), \
+            patch("app.lib.delivery.backoff_delay", return_value=0), \
+            patch("app.routes.codeRouter.code_issuer", CodeIssuer(redis=redis)):
+        r = client.post("/api/code/send", json=body, headers={"Authorization": "Bearer dummy"})
+
+        assert r.status_code == 200
+        data = r.json()
+        assert data["success"] and data["channel"] == "email"
+        assert [(result["channel"], result["success"]) for result in data["results"]] == [("sms", False), ("email", True)]
+        assert all(result["elapsed_ms"] is not None for result in data["results"])
+        # Same code everywhere
+        otp = mock_send_sms.await_args.kwargs["body"].rsplit(" ", 1)[-1]
+        assert mock_send_email.await_args.kwargs["body"].count(otp) == 1
+
+        mock_send_email.return_value = None
+        r = client.post("/api/code/send", json=body, headers={"Authorization": "Bearer dummy"})
+        assert r.status_code == 500
+        assert [result["success"] for result in r.json()["results"]] == [False, False]
+
+        assert client.post("/api/code/send", json={**body, "channels": []}, headers={"Authorization": "Bearer dummy"}).status_code == 422
+
+    # The retry repeated the live code, which verifies from Redis alone
+    assert mock_send_email.await_args.kwargs["body"].count(otp) == 1
+    check = asyncio.run(RedisService(redis=redis).verify_and_consume_otp("user-1", body["app_id"], otp))
+    assert check["status"] == "valid"
+
+
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=ENROLLMENT)
+@patch("app.routes.codeRouter.code_issuer.issue", new_callable=AsyncMock, return_value=IssuedCode("123456", "n1", 120, False))
+@patch("app.routes.codeRouter.delivery_queue.enqueue", new_callable=AsyncMock, return_value="d1")
+def test_send_route_idempotency_key(mock_enqueue, mock_issue, mock_get_enrollment):
+    import fakeredis
+    from app.lib.idempotency import IdempotencyStore
+
+    store = IdempotencyStore(redis=fakeredis.FakeAsyncRedis(decode_responses=True))
+    body = {"app_id": "00000000-0000-0000-0000-000000000000"}
+    headers = {"Authorization": "Bearer dummy", "Idempotency-Key": "retry-1"}
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")), \
+            patch("app.lib.idempotency.idempotency_store", store):
+        first = client.post("/api/code/sms", json=body, headers=headers)
+        retry = client.post("/api/code/sms", json=body, headers=headers)
+        assert first.status_code == retry.status_code == 202
+        assert first.json() == retry.json()
+        assert mock_enqueue.await_count == 1
+
+        other = client.post("/api/code/sms", json={"app_id": "00000000-0000-0000-0000-000000000001"}, headers=headers)
+        assert other.status_code == 422
+
+        client.post("/api/code/sms", json=body, headers={"Authorization": "Bearer dummy"})
+        assert mock_enqueue.await_count == 2
+
+
+@patch("app.routes.codeRouter.authServiceController.get_enrollment", new_callable=AsyncMock, return_value=ENROLLMENT)
+@patch("app.routes.codeRouter.code_issuer.issue", new_callable=AsyncMock, return_value=IssuedCode("123456", "n1", 120, False))
+@patch("app.routes.codeRouter.delivery_queue.enqueue", new_callable=AsyncMock, side_effect=["d1", "d2", "d3"])
+def test_idempotent_replay_is_not_rate_limited(mock_enqueue, mock_issue, mock_get_enrollment):
+    import fakeredis
+    from app.lib.idempotency import IdempotencyStore
+    from app.lib.rate_limit import RateLimiter
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    body = {"app_id": "00000000-0000-0000-0000-000000000000"}
+    headers = {"Authorization": "Bearer dummy"}
+    with patch("app.utils.decorators.verify_access_token", return_value=MagicMock(id="user-1")), \
+            patch("app.lib.idempotency.idempotency_store", IdempotencyStore(redis=redis)), \
+            patch("app.lib.rate_limit.rate_limiter", RateLimiter(redis=redis)):
+        first = client.post("/api/code/sms", json=body, headers={**headers, "Idempotency-Key": "retry-1"})
+        assert first.status_code == 202 and first.headers["X-RateLimit-Remaining"] == "2"
+        for _ in range(2):
+            assert client.post("/api/code/sms", json=body, headers=headers).status_code == 202
+        assert client.post("/api/code/sms", json=body, headers=headers).status_code == 429
+
+        # Past the limit, the retry still gets the stored response
+        retry = client.post("/api/code/sms", json=body, headers={**headers, "Idempotency-Key": "retry-1"})
+        assert retry.status_code == 202
+        assert retry.json() == first.json() == {"success": True, "delivery_id": "d1"}
+        # A new key is a new send, and is limited
+        assert client.post("/api/code/sms", json=body, headers={**headers, "Idempotency-Key": "retry-2"}).status_code == 429
+    assert mock_enqueue.await_count == 3
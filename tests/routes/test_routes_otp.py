@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from app.main import app
+
+client = TestClient(app)
+
+APP_ID = "00000000-0000-0000-0000-000000000000"
+OTHER_APP_ID = "00000000-0000-0000-0000-0000000000ff"
+KEY_HEADERS = {"X-API-Key": "otp_a1b2c3d4e5f6_secret", "X-User-Id": "00000000-0000-0000-0000-000000000001"}
+
+
+@patch("app.routes.otpRouter.authServiceController.disable_otp", new_callable=AsyncMock, return_value=True)
+@patch("app.utils.decorators.appController.get_app_by_api_key", new_callable=AsyncMock, return_value=MagicMock(id=APP_ID))
+def test_api_key_disables_only_its_own_app(mock_get_app, mock_disable):
+    r = client.put("/api/otp/disable", json={"app_id": APP_ID}, headers=KEY_HEADERS)
+    assert r.status_code == 200
+    user_id, app_id, _ = mock_disable.await_args.args
+    assert str(user_id) == KEY_HEADERS["X-User-Id"] and str(app_id) == APP_ID
+
+    # Another tenant's enrollment is out of reach
+    mock_disable.reset_mock()
+    assert client.put("/api/otp/disable", json={"app_id": OTHER_APP_ID}, headers=KEY_HEADERS).status_code == 403
+    mock_disable.assert_not_awaited()
+
+
+@patch("app.routes.otpRouter.authServiceController.enable_otp", new_callable=AsyncMock, return_value=True)
+@patch("app.utils.decorators.appController.get_app_by_api_key", new_callable=AsyncMock, return_value=MagicMock(id=APP_ID))
+def test_enable_is_user_only(mock_get_app, mock_enable):
+    r = client.put("/api/otp/enable", json={"uri": "otpauth://totp/App:user?secret=JBSWY3DPEHPK3PXP&issuer=App"}, headers=KEY_HEADERS)
+    assert r.status_code == 401
+    mock_get_app.assert_not_awaited()
+    mock_enable.assert_not_awaited()
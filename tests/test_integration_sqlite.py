@@ -1,22 +1,26 @@
-# Integration-style test using SQLModel with in-memory SQLite to exercise create_user and create_auth_record
-import os
-import tempfile
-from sqlmodel import SQLModel, Session, create_engine
+# Integration-style test using SQLModel with in-memory SQLite (aiosqlite) to exercise create_user and create_auth_record
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 from app.models.tables import User, Auth
 from app.controllers import userController, authController
 from app.schemas.schemas import CreateUser
 
 
-def test_create_user_and_auth_integration():
-    engine = create_engine("sqlite:///:memory:")
-    SQLModel.metadata.create_all(engine)
+async def test_create_user_and_auth_integration():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
 
-    with Session(engine) as session:
+    async with AsyncSession(engine, expire_on_commit=False) as session:
         # Create a user
         user_in = CreateUser(email="test@example.com", password="pw", username="tester")
-        user = userController.create_user(user_in, session)
+        user = await userController.create_user(user_in, session)
         assert user.username == "tester"
+        assert await userController.user_exists("tester", session) is True
 
         # Create auth record for that user
-        result = authController.create_auth_record(user, "hash123", session)
+        result = await authController.create_auth_record(user, "hash123", session)
         assert result is True
+
+    await engine.dispose()
@@ -1,15 +1,17 @@
+import json
+import logging
 import os
 import time
 
-from app.utils.logger import Logger, LOG_DIR
+from app.utils.logger import Logger, LOG_DIR, _RateLimitFilter, _JsonFormatter
 
 
 def test_logger_writes_file(tmp_path):
     # The Logger writes to LOG_DIR in the project; ensure a log entry appears there.
     # We'll create a log entry and then check the logs directory for a recent file.
     Logger.info("TEST-LOGGER: starting test entry")
-    # Wait briefly to ensure IO flush
-    time.sleep(0.1)
+    # Records are written by the listener thread; wait for the queue to drain
+    Logger.flush()
 
     assert os.path.isdir(LOG_DIR)
     files = [os.path.join(LOG_DIR, f) for f in os.listdir(LOG_DIR) if f.startswith("otp-microservice-")]
@@ -17,3 +19,35 @@ def test_logger_writes_file(tmp_path):
     # pick the most recent file and ensure it's non-empty
     latest = max(files, key=os.path.getmtime)
     assert os.path.getsize(latest) > 0
+
+
+
+def _record(level=logging.WARNING, lineno=10, msg="Redis down"):
+    return logging.LogRecord("otp", level, "app/lib/redis_service.py", lineno, msg, None, None)
+
+
+def test_rate_limit_filter_suppresses_repeats_per_call_site():
+    limiter = _RateLimitFilter(burst=2, window=60)
+
+    assert [limiter.filter(_record()) for _ in range(4)] == [True, True, False, False]
+    # A different call site has its own budget, and INFO is never limited
+    assert limiter.filter(_record(lineno=20)) is True
+    assert all(limiter.filter(_record(level=logging.INFO)) for _ in range(5))
+
+
+def test_rate_limit_filter_reports_suppressed_count_after_window():
+    limiter = _RateLimitFilter(burst=1, window=0.05)
+    assert limiter.filter(_record()) is True
+    assert limiter.filter(_record()) is False
+
+    time.sleep(0.06)
+    record = _record()
+    assert limiter.filter(record) is True
+    assert "1 similar messages suppressed" in record.getMessage()
+
+
+def test_json_formatter_emits_one_object_per_record():
+    line = _JsonFormatter().format(_record(msg="hello"))
+    payload = json.loads(line)
+    assert payload["level"] == "WARNING"
+    assert payload["message"] == "hello"
@@ -0,0 +1,38 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.utils import timing
+from app.utils.middlewares import CreateStateMiddleware
+
+
+def create_app():
+    app = FastAPI()
+    app.add_middleware(CreateStateMiddleware)
+
+    @app.get("/work")
+    async def work(request: Request):
+        timing.record("db", 0.010)
+        timing.record("db", 0.005)
+        with timing.timed("redis"):
+            pass
+        return {"user_id": request.state.user_id}
+
+    return app
+
+
+def test_sets_state_and_server_timing_header():
+    client = TestClient(create_app())
+
+    resp = client.get("/work")
+    assert resp.status_code == 200
+    assert resp.json() == {"user_id": None}
+
+    header = resp.headers["Server-Timing"]
+    assert 'db;dur=15.00;desc="2 calls"' in header
+    assert "redis;dur=" in header
+    assert "total;dur=" in header
+
+
+def test_record_outside_request_scope_is_noop():
+    timing.record("db", 1.0)
+    assert timing.current() == {}